@@ -0,0 +1,2 @@
+# AlgoTradeBot_IB shared package.
+# Building blocks used by the algoTradingBot_IB_*.py scripts.
@@ -0,0 +1,3 @@
+from algotradebot.runner import main
+
+main()
@@ -0,0 +1,156 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from algotradebot.resample import bar_minutes
+from algotradebot.runner import parse_strategy
+from algotradebot.signals import SIGNALS
+from algotradebot.store import BarStore
+from algotradebot.trading import load_parameters
+
+TRADE_COLUMNS = ['side', 'entry_time', 'entry_price', 'exit_time', 'exit_price', 'exit_reason', 'return_percent']
+
+
+def load_bars(path):
+    # bar file as written by ib_insync's util.df(bars): date, open, high, low, close, volume, ...
+    if str(path).endswith('.parquet'):
+        bars = pd.read_parquet(path)
+    else:
+        bars = pd.read_csv(path, parse_dates=['date'])
+    return bars.sort_values('date').reset_index(drop=True)
+
+
+def resample_bars(bars, barSizeSetting):
+    # clock aligned N minute candles, same as BarResampler in the live bot:
+    minutes = bar_minutes(barSizeSetting)
+    if minutes == 1:
+        return bars
+    grouped = bars.groupby(bars['date'].dt.floor(f'{minutes}min'), sort=True)
+    candles = grouped.agg(open=('open', 'first'), high=('high', 'max'), low=('low', 'min'),
+                          close=('close', 'last'), volume=('volume', 'sum'))
+    return candles.rename_axis('date').reset_index()
+
+
+def _next_true(mask):
+    # for every index i, the first index >= i where mask is True (len(mask) when none):
+    n = len(mask)
+    index = np.where(mask, np.arange(n), n)
+    return np.minimum.accumulate(index[::-1])[::-1]
+
+
+def backtest(bars, signal, stop_loss_percent, profit_booking_percent):
+    '''
+    Replays a bar history through the live entry / exit rules of the signal.
+    -----------------------------------------------------------------------
+    The conditions are evaluated for all candles at once; a trade is entered
+    at the close of the candle meeting the entry condition when flat (long
+    checked first, like the live bot) and simulated as the bracket order:
+    take profit at +profit_booking_percent, stop loss at -stop_loss_percent of
+    the entry price (a candle touching both counts as a stop loss), otherwise
+    closed at the close of the candle meeting the exit condition.
+    Percentages apply to the price series given, so pass option bars to
+    backtest the option returns.
+    bars is a DataFrame or a dict of arrays (date, high, low, close, volume).
+    Returns the trades as a DataFrame.
+    '''
+    return simulate(bars, signal.conditions(bars), stop_loss_percent, profit_booking_percent)
+
+
+def simulate(bars, conditions, stop_loss_percent, profit_booking_percent):
+    # bracket order simulation for precomputed signal conditions (see backtest):
+    long_entry, long_exit, short_entry, short_exit = conditions
+    date = np.asarray(bars['date'])
+    high = np.asarray(bars['high'], dtype=float)
+    low = np.asarray(bars['low'], dtype=float)
+    close = np.asarray(bars['close'], dtype=float)
+    n = len(close)
+    next_entry = _next_true(long_entry | short_entry)
+    next_long_exit = _next_true(long_exit)
+    next_short_exit = _next_true(short_exit)
+    take_profit = profit_booking_percent / 100
+    stop_loss = stop_loss_percent / 100
+
+    trades = []
+    i = 0
+    while i < n:
+        k = next_entry[i]
+        if k >= n - 1:
+            break
+        side = 1 if long_entry[k] else -1
+        entry = close[k]
+        # the trade lasts until the exit signal at the latest (or the end of the data):
+        e = (next_long_exit if side == 1 else next_short_exit)[k + 1]
+        end = min(e, n - 1)
+        window = slice(k + 1, end + 1)
+        if side == 1:
+            tp_price, sl_price = entry * (1 + take_profit), entry * (1 - stop_loss)
+            tp_hit = np.flatnonzero(high[window] >= tp_price)
+            sl_hit = np.flatnonzero(low[window] <= sl_price)
+        else:
+            tp_price, sl_price = entry * (1 - take_profit), entry * (1 + stop_loss)
+            tp_hit = np.flatnonzero(low[window] <= tp_price)
+            sl_hit = np.flatnonzero(high[window] >= sl_price)
+        tp_at = k + 1 + tp_hit[0] if len(tp_hit) else n
+        sl_at = k + 1 + sl_hit[0] if len(sl_hit) else n
+        if sl_at <= tp_at and sl_at <= end:
+            j, price, reason = sl_at, sl_price, 'stop_loss'
+        elif tp_at <= end:
+            j, price, reason = tp_at, tp_price, 'take_profit'
+        else:
+            j, price, reason = end, close[end], 'signal' if e < n else 'end_of_data'
+        trades.append((
+            'LONG' if side == 1 else 'SHORT', date[k], entry, date[j], price, reason,
+            side * (price / entry - 1) * 100))
+        # flat again from the exit candle on. The live bot checks the long rules
+        # before the short ones, so a candle closing a trade on its exit signal
+        # can only open a short after a long, while a bracket fill inside the
+        # candle leaves both sides open at its close:
+        if reason == 'signal':
+            i = j if side == 1 and short_entry[j] else j + 1
+        else:
+            i = j
+    return pd.DataFrame(trades, columns=TRADE_COLUMNS)
+
+
+def summary(trades):
+    returns = trades['return_percent']
+    return {
+        'trades': len(trades),
+        'win_rate': float((returns > 0).mean()) if len(trades) else 0.0,
+        'total_return_percent': float(returns.sum()),
+        'average_return_percent': float(returns.mean()) if len(trades) else 0.0,
+        'worst_return_percent': float(returns.min()) if len(trades) else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='algotradebot.backtest',
+                                     description="Backtest the bot strategies on a bar file")
+    parser.add_argument('bars', help="csv or parquet bar file (date, open, high, low, close, volume), "
+                                     "or the symbol with --bar-store")
+    parser.add_argument('--bar-store', help="read the 1 min bars of the symbol from this bar store")
+    parser.add_argument('--strategy', type=parse_strategy, default=parse_strategy('15 mins:ema'),
+                        help="bar size and signal type, e.g. '15 mins:ema' or '1 min:vwap'")
+    parser.add_argument('--parameters', default='Yaz_Trading_Bot_Parameters.csv')
+    parser.add_argument('--trades', help="write the trades to this csv file")
+    args = parser.parse_args(argv)
+
+    stop_loss_percent, profit_booking_percent = load_parameters(args.parameters)
+    barSizeSetting, signal = args.strategy
+    start = time.perf_counter()
+    if args.bar_store:
+        bars = BarStore(args.bar_store).frame(args.bars, '1 min')
+    else:
+        bars = load_bars(args.bars)
+    bars = resample_bars(bars, barSizeSetting)
+    trades = backtest(bars, SIGNALS[signal](), stop_loss_percent, profit_booking_percent)
+    print(f"{len(bars)} {barSizeSetting} candles backtested in {time.perf_counter() - start:.3f}s")
+    print(summary(trades))
+    if args.trades:
+        trades.to_csv(args.trades, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import pickle
+
+from ib_insync import util
+from ib_insync.contract import Option
+
+from algotradebot.journal import journal
+
+
+class OptionChainCache:
+    '''
+    Option chain and contract qualification cache.
+    ---------------------------------------------
+    Keeps, per underlying, the chain expirations and strikes, and per
+    (underlying, expiry, strike, right) the qualified Option contract with its
+    minTick. Warmed up at startup so an entry does not need any
+    reqSecDefOptParams / qualifyContracts / reqContractDetails round trip.
+    Entries are evicted once their expiry has passed and the cache can be
+    persisted to disk between sessions.
+    '''
+
+    def __init__(self, ib, path=None):
+        self.ib = ib
+        self.path = path
+        # (symbol, tradingClass, exchange) -> (expirations, strikes)
+        self.chains = {}
+        # (symbol, expiry, strike, right) -> qualified Option
+        self.contracts = {}
+        # conId -> minTick
+        self.min_ticks = {}
+        if path and os.path.exists(path):
+            self.load()
+
+    def warm_up(self, stock, price, tradingClass=None, exchange='SMART',
+                rights=('C', 'P'), strikes_around=2, n_expirations=3, base=5):
+        return self.ib.run(self.warm_up_async(
+            stock, price, tradingClass, exchange, rights, strikes_around, n_expirations, base))
+
+    async def warm_up_async(self, stock, price, tradingClass=None, exchange='SMART',
+                            rights=('C', 'P'), strikes_around=2, n_expirations=3, base=5):
+        # chain (always refreshed, new weeklies get listed) plus candidate strikes
+        # around the price for the next expirations:
+        self.chains.pop((stock.symbol, tradingClass or stock.symbol, exchange), None)
+        expirations, strikes = await self.chain_async(stock, tradingClass, exchange)
+        expirations = expirations[:n_expirations]
+        center = base * round(price/base)
+        candidates = [center + base * k for k in range(-strikes_around - 1, strikes_around + 1)]
+        candidates = [strike for strike in candidates if strike in strikes]
+        await self.get_contracts_async(stock.symbol, expirations, candidates, rights, tradingClass, exchange)
+
+    def chain(self, stock, tradingClass=None, exchange='SMART'):
+        return self.ib.run(self.chain_async(stock, tradingClass, exchange))
+
+    async def chain_async(self, stock, tradingClass=None, exchange='SMART'):
+        tradingClass = tradingClass or stock.symbol
+        key = (stock.symbol, tradingClass, exchange)
+        if key not in self.chains:
+            # The following request fetches a list of option chains:
+            options_chains = await self.ib.reqSecDefOptParamsAsync(
+                stock.symbol, '', stock.secType, stock.conId)
+            chain = next(c for c in options_chains
+                         if c.tradingClass == tradingClass and c.exchange == exchange)
+            self.chains[key] = (sorted(chain.expirations), frozenset(chain.strikes))
+            journal.chain(key, *self.chains[key])
+        return self.chains[key]
+
+    def expirations(self, stock, tradingClass=None, exchange='SMART'):
+        return self.chain(stock, tradingClass, exchange)[0]
+
+    async def expirations_async(self, stock, tradingClass=None, exchange='SMART'):
+        return (await self.chain_async(stock, tradingClass, exchange))[0]
+
+    def get_contracts(self, symbol, expirations, strikes, rights, tradingClass=None, exchange='SMART'):
+        return self.ib.run(self.get_contracts_async(
+            symbol, expirations, strikes, rights, tradingClass, exchange))
+
+    async def get_contracts_async(self, symbol, expirations, strikes, rights, tradingClass=None,
+                                  exchange='SMART'):
+        '''
+        Qualified contracts for every expiry / strike / right combination,
+        only the ones not cached yet are requested (concurrently, and their
+        contract details give the minTick in the same round trip).
+        '''
+        tradingClass = tradingClass or symbol
+        keys = [(symbol, expiration, strike, right)
+                for right in rights
+                for expiration in expirations
+                for strike in strikes]
+        missing = [key for key in keys if key not in self.contracts]
+        if missing:
+            contracts = [Option(symbol, expiration, strike, right, exchange, tradingClass=tradingClass)
+                         for symbol, expiration, strike, right in missing]
+            details_lists = await asyncio.gather(*[self.ib.reqContractDetailsAsync(c) for c in contracts])
+            for key, contract, details_list in zip(missing, contracts, details_lists):
+                if len(details_list) != 1:
+                    journal.event(f"Unknown or ambiguous contract: {contract}")
+                    continue
+                details = details_list[0]
+                util.dataclassUpdate(contract, details.contract)
+                contract.exchange = exchange
+                contract.lastTradeDateOrContractMonth = key[1]
+                self.contracts[key] = contract
+                self.min_ticks[contract.conId] = details.minTick
+                journal.contract(contract, details.minTick)
+        return [self.contracts[key] for key in keys if key in self.contracts]
+
+    def min_tick(self, contract):
+        return self.ib.run(self.min_tick_async(contract))
+
+    async def min_tick_async(self, contract):
+        if contract.conId not in self.min_ticks:
+            self.min_ticks[contract.conId] = (await self.ib.reqContractDetailsAsync(contract))[0].minTick
+            journal.contract(contract, self.min_ticks[contract.conId])
+        return self.min_ticks[contract.conId]
+
+    def evict_expired(self, today):
+        # today as 'YYYYMMDD', same format as the option expirations:
+        for key, contract in list(self.contracts.items()):
+            if key[1] < today:
+                del self.contracts[key]
+                self.min_ticks.pop(contract.conId, None)
+        for key, (expirations, strikes) in list(self.chains.items()):
+            self.chains[key] = ([exp for exp in expirations if exp >= today], strikes)
+
+    def record(self):
+        # journal the cached chains and contracts: they are served without
+        # any IB request, a replay of the session needs them all the same
+        for key, (expirations, strikes) in self.chains.items():
+            journal.chain(key, expirations, strikes)
+        for contract in self.contracts.values():
+            journal.contract(contract, self.min_ticks.get(contract.conId, float('nan')))
+
+    def save(self):
+        with open(self.path, 'wb') as f:
+            pickle.dump((self.chains, self.contracts, self.min_ticks), f)
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            self.chains, self.contracts, self.min_ticks = pickle.load(f)
@@ -0,0 +1,328 @@
+import asyncio
+import datetime
+from collections import deque
+
+from ib_insync import Event
+from ib_insync.objects import BarData
+
+from algotradebot.journal import journal
+from algotradebot.ring import BarRing
+from algotradebot.store import duration_since
+
+# 5 second real time bars in a 1 min candle
+REALTIME_BARS = 12
+MINUTE = datetime.timedelta(minutes=1)
+
+
+class BarEngine:
+    '''
+    Event driven bar engine.
+    -----------------------
+    Subscribes to a keepUpToDate historical bar stream and fires
+    barCloseEvent(bars, bar) as soon as IB reports that a new candle has
+    started, i.e. the previous candle has closed. The strategy reacts to that
+    event instead of waking up every N seconds with ib.sleep().
+
+    bars is the live BarDataList (the last element is the candle still being
+    formed) and bar is the candle that just closed.
+
+    With capacity set, the closed candles go to a fixed size BarRing of that
+    capacity and the BarDataList is cut down to the last closed and the
+    forming candle, so memory stays flat during the session.
+
+    resamplers (minutes -> BarResampler, see resample.roll_up) is set by the
+    owner of a 1 min stream: the closed candles are also rolled up into
+    those timeframes and candleCloseEvent(minutes, candle) fires for each
+    candle a closed 1 min candle completes, right after barCloseEvent, so
+    the strategies of every timeframe share the one stream.
+    '''
+
+    def __init__(self, ib, contract, barSizeSetting, durationStr,
+                 whatToShow="TRADES", useRTH=True, capacity=None, formatDate=1):
+        self.ib = ib
+        self.contract = contract
+        self.barSizeSetting = barSizeSetting
+        self.durationStr = durationStr
+        self.whatToShow = whatToShow
+        self.useRTH = useRTH
+        self.formatDate = formatDate
+        self.bars = None
+        self.ring = BarRing(capacity) if capacity else None
+        # minutes -> BarResampler of the timeframes rolled up
+        self.resamplers = {}
+        self.barCloseEvent = Event('barCloseEvent')
+        self.candleCloseEvent = Event('candleCloseEvent')
+
+    def start(self):
+        return self.ib.run(self.start_async())
+
+    async def start_async(self):
+        # For the 55 EMA we need historical candles as well, so the live stream is
+        # requested through reqHistoricalData with keepUpToDate=True:
+        self.bars = await self.ib.reqHistoricalDataAsync(
+            self.contract,
+            endDateTime='',
+            durationStr=self.durationStr,
+            barSizeSetting=self.barSizeSetting,
+            whatToShow=self.whatToShow,
+            useRTH=self.useRTH,
+            formatDate=self.formatDate,
+            keepUpToDate=True
+        )
+        self.bars.updateEvent += self._on_bar_update
+        history = self.bars[:]
+        if self.ring is not None:
+            self.ring.extend(history[:-1])
+            del self.bars[:-2]
+        return history
+
+    def stop(self):
+        if self.bars is not None:
+            self.bars.updateEvent -= self._on_bar_update
+            self.ib.cancelHistoricalData(self.bars)
+            self.bars = None
+
+    async def resume_async(self, between=None):
+        '''
+        After a reconnect: the keepUpToDate subscription went with the old
+        connection. Requests it again for the time since the last closed
+        candle only and emits the candles missed meanwhile, in order, before
+        the stream goes on; between (optional coroutine function) is awaited
+        after each of them. Returns the missed candles.
+        '''
+        if self.bars is None:
+            return []
+        self.bars.updateEvent -= self._on_bar_update
+        closed = self.completed_bars()
+        if not len(closed):
+            # only the forming candle so far, nothing to resume after:
+            # subscribed again like at the start
+            self.bars = None
+            await self.start_async()
+            return []
+        last = closed[-1].date
+        now = await self.ib.reqCurrentTimeAsync()
+        # TWS local time (formatDate=1) is the local time of this machine
+        since = last if last.tzinfo is not None else last.astimezone()
+        bars = await self.ib.reqHistoricalDataAsync(
+            self.contract, endDateTime='', durationStr=duration_since(since, now),
+            barSizeSetting=self.barSizeSetting, whatToShow=self.whatToShow, useRTH=self.useRTH,
+            formatDate=self.formatDate, keepUpToDate=True)
+        missed = [bar for bar in bars[:-1] if bar.date > last]
+        if self.ring is None:
+            # the candles from before the reconnect stay in front
+            bars[:-1] = list(closed) + missed
+        self.bars = bars
+        for bar in missed:
+            if self.ring is not None:
+                self.ring.append(bar)
+            self._closed(bars, bar)
+            if between is not None:
+                await between()
+        if self.ring is not None:
+            del bars[:-2]
+        bars.updateEvent += self._on_bar_update
+        return missed
+
+    def backfill(self, history):
+        # closed 1 min candles from before the stream's own history (bar
+        # store): completed_bars() then covers the whole warm up
+        closed = list(self.completed_bars())
+        older = [bar for bar in history if not closed or bar.date < closed[0].date]
+        if self.ring is not None:
+            self.ring = BarRing(self.ring.capacity)
+            self.ring.extend(older + closed)
+        else:
+            self._keep(older + closed)
+
+    def _keep(self, closed):
+        self.bars[:-1] = closed
+
+    def _on_bar_update(self, bars, hasNewBar):
+        # IB keeps updating the last (still forming) candle; hasNewBar tells us a
+        # new candle was appended, so bars[-2] is the candle that just closed:
+        if not hasNewBar or len(bars) < 2:
+            return
+        if self.ring is not None:
+            self.ring.append(bars[-2])
+            # ib_insync only ever looks at bars[-1], so the head can be dropped:
+            del bars[:-2]
+        self._closed(bars, bars[-2])
+
+    def _closed(self, bars, bar):
+        self.barCloseEvent.emit(bars, bar)
+        for minutes, resampler in self.resamplers.items():
+            for candle in resampler.update(bar):
+                self.candleCloseEvent.emit(minutes, candle)
+
+    def completed_bars(self):
+        # all (kept) candles except the one still being formed:
+        if self.ring is not None:
+            return self.ring
+        return self.bars[:-1] if self.bars else []
+
+    def run_until(self, end_time):
+        # Keep the event loop running (and thus the bar events flowing) until
+        # end_time, without any periodic wakeups:
+        remaining = (end_time - self.ib.reqCurrentTime()).total_seconds()
+        if remaining > 0:
+            self.ib.sleep(remaining)
+
+
+class RealTimeBarEngine(BarEngine):
+    '''
+    1 min candles from IB's 5 second real time bars.
+    -----------------------------------------------
+    The history is one reqHistoricalData without keepUpToDate; from then on
+    the 5 second bars of reqRealTimeBars are rolled up into 1 min candles
+    (UTC dates, formatDate=2) that go out through barCloseEvent and the
+    candleCloseEvent roll up like BarEngine's. A candle closes with its
+    5 second bar ending on the minute, there is no wait for IB's own 1 min
+    update. A candle missing 5 second bars (the minute the stream started
+    in, a gap) or coming after missed minutes is reconciled against
+    reqHistoricalData first: IB's candle replaces it and the missed ones
+    are backfilled, the candles still go out in order. resume_async() picks
+    the stream up again after a reconnect.
+    '''
+
+    def __init__(self, ib, contract, durationStr, whatToShow="TRADES", useRTH=True, capacity=None):
+        super().__init__(ib, contract, '1 min', durationStr, whatToShow, useRTH, capacity, 2)
+        self.realtime = None
+        # closed candles when there is no ring
+        self.closed = []
+        # 1 min candle being built and the 5 second bars it has
+        self.current = None
+        self.count = 0
+        # date of the last candle emitted
+        self.last = None
+        # (candle, complete) closed, waiting on the reconciliation
+        self._backlog = deque()
+        self._task = None
+
+    async def start_async(self):
+        history = await self.ib.reqHistoricalDataAsync(
+            self.contract, endDateTime='', durationStr=self.durationStr, barSizeSetting='1 min',
+            whatToShow=self.whatToShow, useRTH=self.useRTH, formatDate=2)
+        history = list(history)
+        # the last candle is still forming, the 5 second bars complete it:
+        if self.ring is not None:
+            self.ring.extend(history[:-1])
+        else:
+            self.closed = history[:-1]
+        self.last = history[-2].date if len(history) > 1 else None
+        self._subscribe()
+        return history
+
+    def _subscribe(self):
+        self.realtime = self.ib.reqRealTimeBars(self.contract, 5, self.whatToShow, self.useRTH)
+        self.realtime.updateEvent += self._on_realtime
+
+    def stop(self):
+        if self.realtime is not None:
+            self.realtime.updateEvent -= self._on_realtime
+            self.ib.cancelRealTimeBars(self.realtime)
+            self.realtime = None
+        if self._task is not None:
+            self._task.cancel()
+
+    async def resume_async(self, between=None):
+        # after a reconnect: the old subscription went with the connection and
+        # the candle in progress misses 5 second bars, it is reconciled when
+        # it closes. The minutes missed meanwhile are backfilled right away
+        # (see BarEngine.resume_async).
+        if self.realtime is None:
+            return []
+        self.realtime.updateEvent -= self._on_realtime
+        self.current = None
+        self._subscribe()
+        if self.last is None or self._backlog:
+            # the reconciliation under way backfills them
+            return []
+        missed = await self._fetch(self.last + MINUTE)
+        missed = [missed[date] for date in sorted(missed)]
+        for bar in missed:
+            self._emit(bar)
+            if between is not None:
+                await between()
+        return missed
+
+    def _on_realtime(self, bars, hasNewBar):
+        for bar in bars:
+            self._add(bar)
+        # the list would grow for the whole session otherwise:
+        bars.clear()
+
+    def _add(self, bar):
+        minute = bar.time.replace(second=0, microsecond=0)
+        if self.current is not None and self.current.date != minute:
+            # the 5 second bar that would have closed it never came
+            self._close()
+        if self.current is None:
+            self.current = BarData(date=minute, open=bar.open_, high=bar.high, low=bar.low,
+                                   close=bar.close, volume=bar.volume, average=bar.wap * bar.volume,
+                                   barCount=bar.count)
+            self.count = 1
+        else:
+            current = self.current
+            current.high = max(current.high, bar.high)
+            current.low = min(current.low, bar.low)
+            current.close = bar.close
+            current.volume += bar.volume
+            # average is kept as price * volume until the candle closes:
+            current.average += bar.wap * bar.volume
+            current.barCount += bar.count
+            self.count += 1
+        if bar.time.second == 55:
+            self._close()
+
+    def _close(self):
+        candle, self.current = self.current, None
+        candle.average = candle.average / candle.volume if candle.volume else candle.close
+        complete = self.count == REALTIME_BARS and (self.last is None or candle.date - self.last == MINUTE)
+        if complete and not self._backlog:
+            self._emit(candle)
+            return
+        self._backlog.append((candle, complete))
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._reconcile())
+
+    def _emit(self, candle):
+        if self.last is not None and candle.date <= self.last:
+            # backfilled already
+            return
+        self.last = candle.date
+        if self.ring is not None:
+            self.ring.append(candle)
+        else:
+            self.closed.append(candle)
+        self._closed(self.completed_bars(), candle)
+
+    async def _reconcile(self):
+        while self._backlog:
+            count = len(self._backlog)
+            since = self.last + MINUTE if self.last is not None else self._backlog[0][0].date
+            try:
+                official = await self._fetch(since)
+            except Exception as e:
+                # emit what was built rather than nothing
+                journal.event(f"{self.contract.symbol} 1 min candles not reconciled: {e!r}")
+                official = {}
+            for _ in range(count):
+                candle, complete = self._backlog.popleft()
+                for date in sorted(date for date in official if date < candle.date):
+                    self._emit(official[date])
+                self._emit(candle if complete else official.get(candle.date, candle))
+
+    async def _fetch(self, since):
+        # IB's closed 1 min candles from since on, by date
+        now = await self.ib.reqCurrentTimeAsync()
+        bars = await self.ib.reqHistoricalDataAsync(
+            self.contract, endDateTime='', durationStr=duration_since(since, now), barSizeSetting='1 min',
+            whatToShow=self.whatToShow, useRTH=self.useRTH, formatDate=2)
+        return {bar.date: bar for bar in bars[:-1] if bar.date >= since}
+
+    def _keep(self, closed):
+        self.closed = closed
+
+    def completed_bars(self):
+        return self.ring if self.ring is not None else self.closed
@@ -0,0 +1,138 @@
+import math
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+
+class EMA:
+    '''
+    Streaming Exponential Moving Average.
+    ------------------------------------
+    Seeded once from the historical closes and then updated in constant time
+    on every candle close. Gives the same values as
+    ta.trend.ema_indicator(close, window, fillna), i.e. pandas
+    ewm(span=window, adjust=False), NaN until `window` closes were seen
+    unless fillna is set.
+    '''
+    __slots__ = ('window', 'fillna', 'alpha', 'count', '_ema')
+
+    def __init__(self, window, fillna=False):
+        self.window = window
+        self.fillna = fillna
+        self.alpha = 2.0 / (window + 1)
+        self.count = 0
+        self._ema = math.nan
+
+    def seed(self, close):
+        # close: pandas Series / numpy array / list of historical closes
+        for x in close:
+            self.update(x)
+        return self.value
+
+    def update(self, close):
+        if self.count == 0:
+            self._ema = float(close)
+        else:
+            self._ema += self.alpha * (close - self._ema)
+        self.count += 1
+        return self.value
+
+    def peek(self, close):
+        # the value update(close) would give, without updating (forming candle)
+        if self.count + 1 < self.window and not self.fillna:
+            return math.nan
+        if self.count == 0:
+            return float(close)
+        return self._ema + self.alpha * (close - self._ema)
+
+    @property
+    def value(self):
+        if self.count < self.window and not self.fillna:
+            return math.nan
+        return self._ema
+
+
+class VWAP:
+    '''
+    Streaming windowed Volume Weighted Average Price.
+    ------------------------------------------------
+    Keeps running sums of typical price * volume and volume over the last
+    `window` candles, so each update is constant time. Gives the same values as
+    ta.volume.VolumeWeightedAveragePrice(high, low, close, volume, window, fillna).
+    '''
+    __slots__ = ('window', 'fillna', '_pv', '_volume', '_sum_pv', '_sum_volume', '_last')
+
+    def __init__(self, window=3, fillna=True):
+        self.window = window
+        self.fillna = fillna
+        self._pv = deque(maxlen=window)
+        self._volume = deque(maxlen=window)
+        self._sum_pv = 0.0
+        self._sum_volume = 0.0
+        # last valid value, carried forward over zero volume windows when fillna:
+        self._last = 0.0
+
+    def seed(self, market_data):
+        # market_data: DataFrame with high, low, close and volume columns
+        for high, low, close, volume in zip(market_data['high'], market_data['low'],
+                                            market_data['close'], market_data['volume']):
+            self.update(high, low, close, volume)
+        return self.value
+
+    def update(self, high, low, close, volume):
+        pv = (high + low + close) / 3.0 * volume
+        if len(self._pv) == self.window:
+            # the oldest candle drops out of the window:
+            self._sum_pv -= self._pv[0]
+            self._sum_volume -= self._volume[0]
+        self._pv.append(pv)
+        self._volume.append(volume)
+        self._sum_pv += pv
+        self._sum_volume += volume
+        if self._sum_volume != 0:
+            self._last = self._sum_pv / self._sum_volume
+        return self.value
+
+    def peek(self, high, low, close, volume):
+        # the value update() would give, without updating (forming candle)
+        sum_pv = self._sum_pv + (high + low + close) / 3.0 * volume
+        sum_volume = self._sum_volume + volume
+        if len(self._pv) == self.window:
+            sum_pv -= self._pv[0]
+            sum_volume -= self._volume[0]
+        elif len(self._pv) + 1 < self.window and not self.fillna:
+            return math.nan
+        if sum_volume == 0:
+            return self._last if self.fillna else math.nan
+        return sum_pv / sum_volume
+
+    @property
+    def value(self):
+        if len(self._pv) < self.window and not self.fillna:
+            return math.nan
+        if self._sum_volume == 0:
+            return self._last if self.fillna else math.nan
+        return self._sum_pv / self._sum_volume
+
+
+def ema_array(close, window, fillna=False):
+    # whole series at once (backtests), same values as EMA / ta.trend.ema_indicator:
+    close = pd.Series(np.asarray(close, dtype=float))
+    return close.ewm(span=window, min_periods=0 if fillna else window, adjust=False).mean().to_numpy()
+
+
+def vwap_array(high, low, close, volume, window=3, fillna=True):
+    # whole series at once (backtests), same values as VWAP / ta VolumeWeightedAveragePrice:
+    volume = np.asarray(volume, dtype=float)
+    pv = (np.asarray(high, dtype=float) + np.asarray(low, dtype=float) + np.asarray(close, dtype=float)) / 3.0 * volume
+    sum_pv = np.cumsum(pv)
+    sum_volume = np.cumsum(volume)
+    sum_pv[window:] = sum_pv[window:] - sum_pv[:-window]
+    sum_volume[window:] = sum_volume[window:] - sum_volume[:-window]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vwap = np.where(sum_volume != 0, sum_pv / sum_volume, np.nan)
+    if fillna:
+        return pd.Series(vwap).ffill().fillna(0.0).to_numpy()
+    vwap[:window - 1] = np.nan
+    return vwap
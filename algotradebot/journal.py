@@ -0,0 +1,387 @@
+import argparse
+import itertools
+import os
+import struct
+import threading
+from collections import deque
+from time import time_ns
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b'ATBJ\x01'
+
+# block kinds; a block is (kind u1, count u4) followed by count records
+(SESSION, STRINGS, BAR, SIGNAL, ORDER, STATUS, FILL, EVENT,
+ HISTORY, TICK, TICKER, TIME, CONTRACT, CHAIN, POSITION, STRATEGY, PARAMS) = range(17)
+BLOCK = struct.Struct('<BI')
+STRING = struct.Struct('<IH')
+
+# every record starts with a session wide sequence number and the wall clock
+# (ns since epoch) it was recorded at; str columns hold string table ids
+_HEAD = [('seq', '<u8'), ('time', '<i8')]
+_BAR = [('symbol', '<u4'), ('date', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'),
+        ('close', '<f8'), ('volume', '<f8'), ('average', '<f8'), ('barCount', '<i4')]
+_TICKER = [('conId', '<i8'), ('date', '<i8'), ('bid', '<f8'), ('ask', '<f8'), ('last', '<f8'), ('close', '<f8'),
+           ('model', '<f8'), ('iv', '<f8'), ('volume', '<f8')]
+DTYPES = {
+    SESSION: np.dtype(_HEAD),
+    # closed live 1 min bars
+    BAR: np.dtype(_HEAD + _BAR),
+    # decision: see DECISIONS, values: last_close and the signal's indicator values
+    SIGNAL: np.dtype(_HEAD + [('strategy', '<u4'), ('decision', 'u1'), ('last_close', '<f8'),
+                              ('value1', '<f8'), ('value2', '<f8')]),
+    ORDER: np.dtype(_HEAD + [('orderId', '<i4'), ('parentId', '<i4'), ('conId', '<i8'),
+                             ('contract', '<u4'), ('leg', '<u4'), ('action', '<u4'),
+                             ('orderType', '<u4'), ('qty', '<f8'), ('lmtPrice', '<f8'),
+                             ('auxPrice', '<f8')]),
+    STATUS: np.dtype(_HEAD + [('orderId', '<i4'), ('status', '<u4'), ('filled', '<f8'),
+                              ('remaining', '<f8'), ('avgFillPrice', '<f8')]),
+    FILL: np.dtype(_HEAD + [('orderId', '<i4'), ('execId', '<u4'), ('shares', '<f8'),
+                            ('price', '<f8')]),
+    EVENT: np.dtype(_HEAD + [('text', '<u4')]),
+    # what the session was fed besides the live bars, for the replay:
+    # history bars the strategies were seeded from
+    HISTORY: np.dtype(_HEAD + _BAR),
+    # streamed ticks of the underlying, reqTickers snapshots / streaming quotes
+    # an order was priced from (date: the ticker's time, 0 without one;
+    # model: IB's model price, iv: its implied vol, volume: the day volume)
+    TICK: np.dtype(_HEAD + _TICKER),
+    TICKER: np.dtype(_HEAD + _TICKER),
+    # reqCurrentTime
+    TIME: np.dtype(_HEAD + [('value', '<i8')]),
+    # qualified contracts (stocks and options) with their minTick
+    CONTRACT: np.dtype(_HEAD + [('conId', '<i8'), ('secType', '<u4'), ('symbol', '<u4'),
+                                ('expiry', '<u4'), ('strike', '<f8'), ('right', '<u4'),
+                                ('tradingClass', '<u4'), ('exchange', '<u4'), ('localSymbol', '<u4'),
+                                ('multiplier', '<u4'), ('currency', '<u4'), ('minTick', '<f8')]),
+    # option chains, expirations and strikes comma separated
+    CHAIN: np.dtype(_HEAD + [('symbol', '<u4'), ('tradingClass', '<u4'), ('exchange', '<u4'),
+                             ('expirations', '<u4'), ('strikes', '<u4')]),
+    POSITION: np.dtype(_HEAD + [('conId', '<i8'), ('position', '<f8'), ('avgCost', '<f8')]),
+    # the strategies run, in the order they were set up (confirm 0: candle
+    # close only, else intrabar ticks to confirm and band; delta and
+    # max_cost NaN: not set)
+    STRATEGY: np.dtype(_HEAD + [('symbol', '<u4'), ('tradingClass', '<u4'), ('barSizeSetting', '<u4'),
+                                ('signal', '<u4'), ('qty', '<f8'), ('delta', '<f8'),
+                                ('stop_loss_percent', '<f8'), ('profit_booking_percent', '<f8'),
+                                ('confirm', '<i4'), ('band', '<f8'), ('max_cost', '<f8')]),
+    # parameters of a symbol at its warm up and after every change
+    # (barSizeSetting '' and windows 0: not set)
+    PARAMS: np.dtype(_HEAD + [('symbol', '<u4'), ('stop_loss_percent', '<f8'),
+                              ('profit_booking_percent', '<f8'), ('qty', '<f8'), ('barSizeSetting', '<u4'),
+                              ('ema_fast', '<i4'), ('ema_slow', '<i4'), ('vwap_window', '<i4')]),
+}
+NAMES = {BAR: 'bars', SIGNAL: 'signals', ORDER: 'orders', STATUS: 'statuses', FILL: 'fills',
+         EVENT: 'events', HISTORY: 'history', TICK: 'ticks', TICKER: 'tickers', TIME: 'times',
+         CONTRACT: 'contracts', CHAIN: 'chains', POSITION: 'positions', STRATEGY: 'strategies',
+         PARAMS: 'parameters'}
+STRING_COLUMNS = {'symbol', 'strategy', 'contract', 'leg', 'action', 'orderType', 'status',
+                  'execId', 'text', 'secType', 'expiry', 'right', 'tradingClass', 'exchange',
+                  'localSymbol', 'multiplier', 'currency', 'expirations', 'strikes', 'barSizeSetting',
+                  'signal'}
+
+DECISIONS = ['', 'long_entry', 'long_exit', 'short_entry', 'short_exit']
+NONE, LONG_ENTRY, LONG_EXIT, SHORT_ENTRY, SHORT_EXIT = range(5)
+
+NAN = float('nan')
+
+
+class Journal:
+    '''
+    Append only binary journal of the trading session.
+    --------------------------------------------------
+    The trading path only appends a tuple to a deque (no formatting, no
+    I/O); a background thread drains it every interval and writes one block
+    per record kind as packed numpy records. Strings are interned into a
+    string table written ahead of the records using them. Every open()
+    starts a new session in the file; read_journal() loads it back into
+    DataFrames. Recording is a no-op until the journal is opened.
+    '''
+
+    def __init__(self):
+        self.path = None
+        self._queue = deque()
+        self._strings = {}
+        self._seq = None
+        self._file = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def open(self, path, interval=0.05):
+        self.close()
+        self.path = path
+        self._file = open(path, 'ab')
+        if not self._file.tell():
+            self._file.write(MAGIC)
+        self._strings = {}
+        self._seq = itertools.count()
+        self._stop.clear()
+        # written straight away: the string table of the session comes after it
+        self._file.write(BLOCK.pack(SESSION, 1) +
+                         np.array([(next(self._seq), time_ns())], DTYPES[SESSION]).tobytes())
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='journal', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        self._file = None
+
+    @property
+    def recording(self):
+        return self._thread is not None
+
+    # trading path
+
+    def _id(self, string):
+        # string table id, the string is queued on first use
+        sid = self._strings.get(string)
+        if sid is None:
+            sid = self._strings[string] = len(self._strings)
+            self._queue.append((STRINGS, (sid, string)))
+        return sid
+
+    def _append(self, kind, *values):
+        self._queue.append((kind, (next(self._seq), time_ns()) + values))
+
+    def bar(self, symbol, bar, kind=BAR):
+        if self._thread is None:
+            return
+        self._append(kind, self._id(symbol), int(bar.date.timestamp() * 1e9), bar.open, bar.high,
+                     bar.low, bar.close, bar.volume, bar.average, bar.barCount)
+
+    def history(self, symbol, bars):
+        for bar in bars:
+            self.bar(symbol, bar, HISTORY)
+
+    def ticker(self, ticker, kind=TICKER):
+        if self._thread is None:
+            return
+        greeks = ticker.modelGreeks
+        model = greeks.optPrice if greeks is not None and greeks.optPrice is not None else NAN
+        iv = greeks.impliedVol if greeks is not None and greeks.impliedVol is not None else NAN
+        date = int(ticker.time.timestamp() * 1e9) if ticker.time is not None else 0
+        self._append(kind, ticker.contract.conId, date, ticker.bid, ticker.ask, ticker.last, ticker.close,
+                     model, iv, ticker.volume)
+
+    def tick(self, ticker):
+        self.ticker(ticker, TICK)
+
+    def current_time(self, value):
+        if self._thread is None:
+            return
+        self._append(TIME, int(value.timestamp() * 1e9))
+
+    def contract(self, contract, minTick=NAN):
+        if self._thread is None:
+            return
+        self._append(CONTRACT, contract.conId, self._id(contract.secType), self._id(contract.symbol),
+                     self._id(contract.lastTradeDateOrContractMonth), float(contract.strike),
+                     self._id(contract.right), self._id(contract.tradingClass),
+                     self._id(contract.exchange), self._id(contract.localSymbol),
+                     self._id(contract.multiplier), self._id(contract.currency), float(minTick))
+
+    def chain(self, key, expirations, strikes):
+        if self._thread is None:
+            return
+        symbol, tradingClass, exchange = key
+        self._append(CHAIN, self._id(symbol), self._id(tradingClass), self._id(exchange),
+                     self._id(','.join(expirations)), self._id(','.join(map(repr, sorted(strikes)))))
+
+    def strategy(self, symbol, tradingClass, barSizeSetting, signal, qty, delta, stop_loss_percent,
+                 profit_booking_percent, confirm=0, band=0.0, max_cost=None):
+        if self._thread is None:
+            return
+        self._append(STRATEGY, self._id(symbol), self._id(tradingClass), self._id(barSizeSetting),
+                     self._id(signal), float(qty), NAN if delta is None else float(delta),
+                     float(stop_loss_percent), float(profit_booking_percent), confirm, float(band),
+                     NAN if max_cost is None else float(max_cost))
+
+    def parameters(self, symbol, params):
+        if self._thread is None:
+            return
+        self._append(PARAMS, self._id(symbol), float(params.stop_loss_percent),
+                     float(params.profit_booking_percent), float(params.qty), self._id(params.barSizeSetting or ''),
+                     params.ema_fast or 0, params.ema_slow or 0, params.vwap_window or 0)
+
+    def position(self, position):
+        if self._thread is None:
+            return
+        self._append(POSITION, position.contract.conId, float(position.position), float(position.avgCost))
+
+    def signal(self, strategy, decision, values):
+        if self._thread is None:
+            return
+        values = (*values.values(), NAN, NAN)
+        self._append(SIGNAL, self._id(strategy), decision, values[0], values[1], values[2])
+
+    def order(self, trade, leg):
+        if self._thread is None:
+            return
+        order = trade.order
+        self._append(ORDER, order.orderId, order.parentId, trade.contract.conId,
+                     self._id(trade.contract.localSymbol), self._id(leg), self._id(order.action),
+                     self._id(order.orderType), float(order.totalQuantity),
+                     _price(order.lmtPrice), _price(order.auxPrice))
+
+    def status(self, trade):
+        if self._thread is None:
+            return
+        orderStatus = trade.orderStatus
+        self._append(STATUS, trade.order.orderId, self._id(orderStatus.status), float(orderStatus.filled),
+                     float(orderStatus.remaining), float(orderStatus.avgFillPrice))
+
+    def fill(self, trade, fill):
+        if self._thread is None:
+            return
+        self._append(FILL, trade.order.orderId, self._id(fill.execution.execId),
+                     float(fill.execution.shares), float(fill.execution.price))
+
+    def event(self, text):
+        # free text, for the rare events that have no record of their own
+        if self._thread is None:
+            return
+        self._append(EVENT, self._id(text))
+
+    # writer thread
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        queue = self._queue
+        n = len(queue)
+        if not n:
+            return
+        strings = []
+        records = {}
+        for _ in range(n):
+            kind, values = queue.popleft()
+            if kind == STRINGS:
+                strings.append(values)
+            else:
+                records.setdefault(kind, []).append(values)
+        chunks = []
+        # the string table goes first, the records of this batch use it:
+        if strings:
+            chunks.append(BLOCK.pack(STRINGS, len(strings)))
+            for sid, string in strings:
+                encoded = str(string).encode()
+                chunks.append(STRING.pack(sid, len(encoded)) + encoded)
+        for kind, rows in records.items():
+            chunks.append(BLOCK.pack(kind, len(rows)))
+            chunks.append(np.array(rows, dtype=DTYPES[kind]).tobytes())
+        self._file.write(b''.join(chunks))
+        self._file.flush()
+
+
+def _price(price):
+    # unset order prices are sys.float_info.max in ib_insync
+    return price if price < 1e300 else NAN
+
+
+def read_journal(path, session=None):
+    '''
+    Loads a journal into one DataFrame per record kind ('bars', 'signals',
+    'orders', ... see NAMES), ordered by sequence number,
+    with a session column, decoded strings and UTC timestamps. session
+    selects one session (-1 for the last one), all of them by default. A
+    block cut short by a crash ends the read.
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a journal file")
+    # kind -> session -> record arrays
+    blocks = {kind: {} for kind in NAMES}
+    current = -1
+    strings = {}
+    pos = len(MAGIC)
+    while pos + BLOCK.size <= len(data):
+        kind, count = BLOCK.unpack_from(data, pos)
+        pos += BLOCK.size
+        if kind == STRINGS:
+            table = {}
+            for _ in range(count):
+                if pos + STRING.size > len(data):
+                    break
+                sid, length = STRING.unpack_from(data, pos)
+                pos += STRING.size
+                table[sid] = data[pos:pos + length].decode()
+                pos += length
+            strings[current].update(table)
+            continue
+        dtype = DTYPES[kind]
+        if pos + count * dtype.itemsize > len(data):
+            break
+        records = np.frombuffer(data, dtype, count, pos)
+        pos += count * dtype.itemsize
+        if kind == SESSION:
+            # string ids start over in every session:
+            current += 1
+            strings[current] = {}
+            continue
+        blocks[kind].setdefault(current, []).append(records)
+
+    if session is not None and session < 0:
+        session += len(strings)
+    frames = {}
+    for kind, name in NAMES.items():
+        parts = []
+        for number, records in blocks[kind].items():
+            if session is not None and number != session:
+                continue
+            frame = pd.DataFrame(np.concatenate(records))
+            frame.insert(0, 'session', number)
+            for column in STRING_COLUMNS.intersection(frame.columns):
+                frame[column] = frame[column].map(strings[number])
+            parts.append(frame)
+        frame = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['session', *DTYPES[kind].names])
+        frame = frame.sort_values(['session', 'seq'], ignore_index=True)
+        frame['time'] = pd.to_datetime(frame['time'].astype('int64'), utc=True)
+        if kind in (BAR, HISTORY):
+            frame['date'] = pd.to_datetime(frame['date'].astype('int64'), utc=True)
+        if kind in (TICK, TICKER):
+            dates = frame['date'].astype('int64')
+            frame['date'] = pd.to_datetime(dates, utc=True).where(dates != 0)
+        if kind == SIGNAL:
+            frame['decision'] = frame['decision'].map(dict(enumerate(DECISIONS)))
+        if kind == TIME:
+            frame['value'] = pd.to_datetime(frame['value'].astype('int64'), utc=True)
+        frames[name] = frame
+    return frames
+
+
+# process wide journal of the trading session
+journal = Journal()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='algotradebot.journal', description="Show a session journal")
+    parser.add_argument('path')
+    parser.add_argument('--kind', choices=list(NAMES.values()), help="print all the records of one kind")
+    args = parser.parse_args(argv)
+
+    frames = read_journal(args.path)
+    if args.kind:
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(frames[args.kind].to_string())
+        return
+    print(f"{args.path}: {os.path.getsize(args.path)} bytes")
+    for name, frame in frames.items():
+        print(f"{name:>10}: {len(frame)}")
+    trades = frames['signals'][frames['signals']['decision'] != '']
+    if len(trades):
+        print(trades.tail(20).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import asyncio
+import math
+import time
+
+from algotradebot.journal import journal
+from algotradebot.pricer import ChainPricer
+from algotradebot.quotes import OptionQuotes
+
+
+class StrikeLadder:
+    '''
+    Pre-computed ITM strike ladder.
+    ------------------------------
+    Streams the underlying price and keeps the call and put contracts for the
+    strikes around it (current strike +/- strikes_around) qualified in the
+    chain cache, for the next n_expirations. The contracts of the nearest
+    expiry are also subscribed to the streaming option quotes. Whenever the
+    price crosses a strike boundary the ladder is re-centered in the
+    background, so on a signal the ITM contract is a dictionary lookup
+    instead of a ticker snapshot plus qualification. The whole chain of the
+    n_expirations is also valued by a ChainPricer at the streaming price,
+    for picking contracts by target delta.
+    '''
+
+    def __init__(self, ib, stock, cache, tradingClass=None, exchange='SMART',
+                 strikes_around=2, n_expirations=3, base=5, quotes=None):
+        self.ib = ib
+        self.stock = stock
+        self.cache = cache
+        self.tradingClass = tradingClass or stock.symbol
+        self.exchange = exchange
+        self.strikes_around = strikes_around
+        self.n_expirations = n_expirations
+        self.base = base
+        self.ticker = None
+        self.center = None
+        self.expirations = []
+        self.quotes = quotes or OptionQuotes(ib)
+        # option contracts of the nearest expiry subscribed to the quotes
+        self.subscribed = set()
+        self.pricer = None
+        self._task = None
+
+    def start(self):
+        return self.ib.run(self.start_async())
+
+    async def start_async(self, price=None):
+        # price: centers the ladder (and subscribes its quotes) right away
+        # instead of on the first tick
+        expirations = await self.cache.expirations_async(self.stock, self.tradingClass, self.exchange)
+        self.expirations = expirations[:self.n_expirations]
+        _, strikes = await self.cache.chain_async(self.stock, self.tradingClass, self.exchange)
+        self.pricer = ChainPricer(self.stock.symbol, self.expirations, strikes, quotes=self.quotes)
+        self.ticker = self.ib.reqMktData(self.stock)
+        self.ticker.updateEvent += self._on_price
+        if price is not None:
+            self._task = asyncio.ensure_future(self.recenter(self.base * round(price/self.base)))
+            await self._task
+
+    def stop(self):
+        if self.ticker is not None:
+            self.ticker.updateEvent -= self._on_price
+            self.ib.cancelMktData(self.stock)
+            self.ticker = None
+        for contract in self.subscribed:
+            self.quotes.unsubscribe(contract)
+        self.subscribed = set()
+
+    def resume(self):
+        # after a reconnect: streams the underlying again (the option quotes
+        # are resumed by their OptionQuotes)
+        if self.ticker is None:
+            return
+        self.ticker.updateEvent -= self._on_price
+        self.ticker = self.ib.reqMktData(self.stock)
+        self.ticker.updateEvent += self._on_price
+
+    def price(self):
+        return self.ticker.marketPrice() if self.ticker else math.nan
+
+    def _on_price(self, ticker):
+        journal.tick(ticker)
+        price = ticker.marketPrice()
+        if math.isnan(price):
+            return
+        center = self.base * round(price/self.base)
+        if center != self.center and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self.recenter(center))
+
+    async def recenter(self, center):
+        _, strikes = await self.cache.chain_async(self.stock, self.tradingClass, self.exchange)
+        ladder = [center + self.base * k for k in range(-self.strikes_around - 1, self.strikes_around + 1)]
+        ladder = [strike for strike in ladder if strike in strikes]
+        await self.cache.get_contracts_async(
+            self.stock.symbol, self.expirations, ladder, ('C', 'P'), self.tradingClass, self.exchange)
+        # keep the nearest expiry subscribed:
+        wanted = set()
+        if self.expirations:
+            for strike in ladder:
+                for right in ('C', 'P'):
+                    contract = self.cache.contracts.get((self.stock.symbol, self.expirations[0], strike, right))
+                    if contract is not None:
+                        wanted.add(contract)
+        for contract in self.subscribed - wanted:
+            self.quotes.unsubscribe(contract)
+        for contract in wanted - self.subscribed:
+            self.quotes.subscribe(contract)
+        self.subscribed = wanted
+        self.center = center
+
+    def itm_contract(self, right, expiry_index=0):
+        '''
+        First ITM contract, same rule as the bots: CALLS one strike below the
+        rounded price, PUTS the rounded price. None when not ready.
+        '''
+        if self.center is None or len(self.expirations) <= expiry_index:
+            return None
+        price = self.price()
+        strike = self.base * round(price/self.base) if not math.isnan(price) else self.center
+        if right == 'C':
+            strike -= self.base
+        return self.cache.contracts.get((self.stock.symbol, self.expirations[expiry_index], strike, right))
+
+    async def delta_contract(self, right, delta, max_cost=None, expiry_index=None):
+        '''
+        Contract of the ladder expirations whose delta at the streaming price
+        is closest to delta (at most max_cost when given), see ChainPricer.pick.
+        Qualified on the spot when it is outside the ladder. None when not ready.
+        '''
+        price = self.price()
+        if self.pricer is None or math.isnan(price):
+            return None
+        self.pricer.value(price, self.ticker.time or time.time())
+        pick = self.pricer.pick(right, delta, max_cost, expiry_index)
+        if pick is None:
+            return None
+        expiry, strike = pick
+        contracts = await self.cache.get_contracts_async(
+            self.stock.symbol, [expiry], [strike], [right], self.tradingClass, self.exchange)
+        return contracts[0] if contracts else None
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter_ns
+
+# sub buckets per power of 2 (log2), i.e. a relative bucket width of 1/16 (~6%)
+SUB_BITS = 5
+# enough buckets for any int64 nanosecond value
+N_BUCKETS = ((64 - SUB_BITS) << (SUB_BITS - 1)) + (1 << SUB_BITS)
+
+QUANTILES = (0.5, 0.99)
+
+
+def _bucket_bounds(index):
+    # inverse of the bucket index computed in Histogram.record: [lower, upper]
+    if index < 1 << SUB_BITS:
+        return index, index
+    shift = (index >> (SUB_BITS - 1)) - 1
+    sub = index - (shift << (SUB_BITS - 1))
+    return sub << shift, ((sub + 1) << shift) - 1
+
+
+class Histogram:
+    '''
+    HDR style log-linear latency histogram (nanoseconds).
+    -----------------------------------------------------
+    Values below 32ns get their own bucket, above that every power of 2 is
+    split in 16 buckets. Recording is a bit_length, a shift and a list
+    increment; count, max and the quantiles are worked out on export.
+    '''
+    __slots__ = ('name', 'counts', 'total')
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * N_BUCKETS
+        self.total = 0
+
+    # (the shifts are spelled out for SUB_BITS = 5, this runs once per sample)
+    def record(self, ns):
+        shift = ns.bit_length() - 5
+        self.counts[(shift << 4) + (ns >> shift) if shift > 0 else ns] += 1
+        self.total += ns
+
+    def since(self, start):
+        # record the time elapsed since a perf_counter_ns() start
+        ns = perf_counter_ns() - start
+        shift = ns.bit_length() - 5
+        self.counts[(shift << 4) + (ns >> shift) if shift > 0 else ns] += 1
+        self.total += ns
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    @property
+    def max(self):
+        # upper bound of the highest non empty bucket
+        for index in range(N_BUCKETS - 1, -1, -1):
+            if self.counts[index]:
+                return _bucket_bounds(index)[1]
+        return 0
+
+    def percentile(self, q):
+        # upper bound of the bucket holding the q quantile (0 <= q <= 1)
+        count = self.count
+        if not count:
+            return 0
+        rank = max(1, round(q * count))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return _bucket_bounds(index)[1]
+        return 0
+
+    def reset(self):
+        self.counts = [0] * N_BUCKETS
+        self.total = 0
+
+
+class LatencyMetrics:
+    '''
+    Per stage latency histograms of the trading path.
+    ------------------------------------------------
+    The hot path gets its Histogram once (at import) and records into it
+    directly. Gauges (queue depths) are read when exported. The figures
+    are exported in the Prometheus text format, to a file (node exporter
+    textfile collector) and/or over http.
+    '''
+
+    def __init__(self):
+        # stage -> Histogram, in registration order
+        self.histograms = {}
+        # gauge -> (help, read), read() -> {kind: value}
+        self.gauges = {}
+        self._server = None
+
+    def histogram(self, stage):
+        if stage not in self.histograms:
+            self.histograms[stage] = Histogram(stage)
+        return self.histograms[stage]
+
+    def gauge(self, name, help, read):
+        self.gauges[name] = (help, read)
+
+    async def timed(self, stage, awaitable):
+        # await and record how long it took
+        histogram = self.histogram(stage)
+        start = perf_counter_ns()
+        try:
+            return await awaitable
+        finally:
+            histogram.since(start)
+
+    def snapshot(self):
+        # stage -> {'count', 'p50_us', 'p99_us', 'max_us'} of the recorded stages
+        return {stage: {'count': h.count,
+                        **{f"p{round(q * 100)}_us": h.percentile(q) / 1e3 for q in QUANTILES},
+                        'max_us': h.max / 1e3}
+                for stage, h in self.histograms.items() if h.count}
+
+    def prometheus(self):
+        lines = ["# HELP algotradebot_stage_latency_seconds Latency of the trading path stages.",
+                 "# TYPE algotradebot_stage_latency_seconds summary"]
+        for stage, h in self.histograms.items():
+            for q in QUANTILES:
+                lines.append(f'algotradebot_stage_latency_seconds{{stage="{stage}",quantile="{q}"}} '
+                             f'{h.percentile(q) / 1e9:.9f}')
+            lines.append(f'algotradebot_stage_latency_seconds_sum{{stage="{stage}"}} {h.total / 1e9:.9f}')
+            lines.append(f'algotradebot_stage_latency_seconds_count{{stage="{stage}"}} {h.count}')
+        for name, (help, read) in self.gauges.items():
+            lines += [f"# HELP algotradebot_{name} {help}", f"# TYPE algotradebot_{name} gauge"]
+            lines += [f'algotradebot_{name}{{kind="{kind}"}} {value}' for kind, value in read().items()]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # written aside and renamed, so a scraper never reads half a file:
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+    async def export(self, path, interval=10):
+        # keep the metrics file up to date for the whole session
+        while True:
+            self.write(path)
+            await asyncio.sleep(interval)
+
+    def serve(self, port, host=''):
+        # /metrics endpoint on a daemon thread, off the event loop
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+# process wide registry of the trading path stages
+latency = LatencyMetrics()
@@ -0,0 +1,541 @@
+import argparse
+import asyncio
+import copy
+import datetime
+import itertools
+import time
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+from ib_insync import Event, util
+from ib_insync.contract import ContractDetails
+from ib_insync.objects import (
+    BarData, BarDataList, CommissionReport, Execution, Fill, OptionChain, Position, RealTimeBar,
+    RealTimeBarList, TradeLogEntry)
+from ib_insync.order import BracketOrder, LimitOrder, OrderStatus, StopOrder, Trade
+from ib_insync.ticker import Ticker
+
+NEW_YORK = ZoneInfo('America/New_York')
+
+# RTH 1 min candles in a trading day, to turn 'N D' durations into bar counts
+BARS_PER_DAY = 390
+# 5 second real time bars a 1 min bar is split into
+REALTIME_BARS = 12
+
+
+def _duration_bars(durationStr):
+    count, unit = durationStr.split()
+    if unit == 'S':
+        return max(int(count) // 60, 1)
+    if unit == 'D':
+        return int(count) * BARS_PER_DAY
+    if unit == 'W':
+        return int(count) * 5 * BARS_PER_DAY
+    raise ValueError(f"unsupported durationStr {durationStr!r}")
+
+
+async def settle():
+    # run the event loop until every other task is done
+    current = asyncio.current_task()
+    while True:
+        pending = [task for task in asyncio.all_tasks() if task is not current and not task.done()]
+        if not pending:
+            return
+        await asyncio.wait(pending)
+
+
+class MockIB:
+    '''
+    Network free stand in for ib_insync's IB.
+    ----------------------------------------
+    Replays recorded 1 min bars (one DataFrame per symbol, same timestamps)
+    through the IB methods the bots use: keepUpToDate reqHistoricalData,
+    reqRealTimeBars (each 1 min bar split into twelve 5 second bars that
+    add up to it), reqMktData / reqTickers, reqSecDefOptParams, qualifyContracts,
+    reqContractDetails, bracketOrder / placeOrder / cancelOrder and
+    reqCurrentTime (the replay clock).
+
+    The first `history` bars are served as history, the rest are released
+    one by one from sleep() / run_until style waits: at `speed` times real
+    time (60 -> one 1 min bar per second) or as fast as possible when speed
+    is None. Option prices follow a deterministic intrinsic + time value
+    model of the underlying close and orders fill deterministically against
+    it on the next bar. signal_to_order records the time between a bar being
+    released and each placeOrder call made in response.
+
+    schedule_outage() simulates connection drops: from a given bar on,
+    nothing comes in (the bar, ticker and order events are lost, orders
+    keep filling) for a number of bars, then the drop is noticed
+    (disconnectedEvent) and the next connection attempts can be refused.
+    The subscriptions have to be made again after reconnecting, the fills
+    and positions are there to be requested.
+    '''
+
+    def __init__(self, bars, history=BARS_PER_DAY, speed=None, min_tick=0.05, time_value=2.0):
+        # plain numpy columns per symbol, the replay reads them bar by bar
+        self.columns = {}
+        for symbol, frame in bars.items():
+            columns = {column: frame[column].to_numpy(dtype=float)
+                       for column in ('open', 'high', 'low', 'close', 'volume')}
+            columns['average'] = frame['average'].to_numpy(dtype=float) if 'average' in frame else columns['close']
+            columns['barCount'] = frame['barCount'].to_numpy() if 'barCount' in frame else np.zeros(len(frame), int)
+            # the underlying ticker's day volume (not reset at night, only its changes are used)
+            columns['cumVolume'] = np.cumsum(columns['volume'])
+            self.columns[symbol] = columns
+        dates = pd.DatetimeIndex(next(iter(bars.values()))['date'])
+        dates = dates.tz_localize('UTC') if dates.tz is None else dates.tz_convert('UTC')
+        self.dates = list(dates.to_pydatetime())
+        self.cursor = min(history, len(self.dates) - 1)
+        self.clock = self.dates[self.cursor]
+        self.speed = speed
+        self.min_tick = min_tick
+        self.time_value = time_value
+        self.connected = False
+        self.subscriptions = []
+        self.realtime = []
+        self.tickers = {}
+        self.trades = []
+        # orderId -> Trade for the orders still working, ids of the filled ones
+        self._working = {}
+        self._filled = set()
+        self.positions = {}
+        self.signal_to_order = []
+        self._released_at = None
+        self._order_ids = itertools.count(1)
+        self._con_ids = {}
+        self._exec_ids = itertools.count(1)
+        self.fills = []
+        # bar index -> (bars, refused connection attempts) of the outages to come
+        self._outages = {}
+        # bars left in the current outage, connection attempts still refused
+        self._dark = 0
+        self._refuse = 0
+        # same events as IB, for order / position tracking:
+        self.connectedEvent = Event('connectedEvent')
+        self.disconnectedEvent = Event('disconnectedEvent')
+        self.orderStatusEvent = Event('orderStatusEvent')
+        self.execDetailsEvent = Event('execDetailsEvent')
+        self.positionEvent = Event('positionEvent')
+        self.errorEvent = Event('errorEvent')
+
+    # connection
+
+    def connect(self, host='127.0.0.1', port=7497, clientId=1, **kwargs):
+        if self._refuse:
+            self._refuse -= 1
+            raise ConnectionRefusedError("mock TWS is down")
+        self.connected = True
+        self.connectedEvent.emit()
+        return self
+
+    async def connectAsync(self, host='127.0.0.1', port=7497, clientId=1, **kwargs):
+        return self.connect(host, port, clientId)
+
+    def schedule_outage(self, at, bars=1, refuse=0):
+        self._outages[at] = (bars, refuse)
+
+    def _emit(self, event, *args):
+        # what IB sends is lost while the connection is down
+        if self.connected and not self._dark:
+            event.emit(*args)
+
+    def disconnect(self):
+        if self.connected:
+            self.connected = False
+            self.disconnectedEvent.emit()
+
+    def isConnected(self):
+        return self.connected
+
+    def reqMarketDataType(self, marketDataType):
+        pass
+
+    # clock and replay
+
+    def reqCurrentTime(self):
+        return self.clock
+
+    async def reqCurrentTimeAsync(self):
+        return self.reqCurrentTime()
+
+    @staticmethod
+    def run(*awaitables, timeout=None):
+        return util.run(*awaitables, timeout=timeout)
+
+    def sleep(self, secs=0.02):
+        # replay the bars falling within the next secs of replay time:
+        self.run(self._replay(self.reqCurrentTime() + datetime.timedelta(seconds=secs)))
+        return True
+
+    async def _replay(self, until):
+        while self.cursor + 1 < len(self.dates) and self.dates[self.cursor + 1] <= until:
+            await asyncio.sleep(60 / self.speed if self.speed else 0)
+            # IB answers within milliseconds, long before the next message:
+            # what the ticks set off (intrabar entries) completes before the
+            # bar closes, the entries made on this bar before the next one
+            self.tick()
+            await settle()
+            self.close_bars()
+            await settle()
+        # the clock moves on even when there are no bars (nights, week ends):
+        if not self.done():
+            self.clock = max(self.clock, until)
+
+    def done(self):
+        return self.cursor + 1 >= len(self.dates)
+
+    def step(self):
+        # release the next bar: fills first, then tickers, then the bar streams
+        self.tick()
+        self.close_bars()
+
+    def tick(self):
+        self.cursor += 1
+        if self._dark:
+            self._dark -= 1
+            if not self._dark:
+                # the drop is noticed
+                self.disconnect()
+        if self.cursor in self._outages:
+            self._dark, self._refuse = self._outages.pop(self.cursor)
+            # the server side subscriptions are gone
+            self.subscriptions, self.realtime, self.tickers = [], [], {}
+        self.clock = self.dates[self.cursor]
+        self._released_at = time.perf_counter()
+        self._fill_orders()
+        for contract, ticker in self.tickers.items():
+            self._update_ticker(ticker)
+            ticker.updateEvent.emit(ticker)
+
+    def close_bars(self):
+        for bars in list(self.subscriptions):
+            if bars and bars[-1].date == self.dates[self.cursor]:
+                # subscribed in this step (a reconnect), the bar is forming already
+                continue
+            bars.append(self._bar(bars.contract.symbol, self.cursor, bars.formatDate))
+            bars.updateEvent.emit(bars, True)
+        # the 5 second bars of the 1 min bar that just closed
+        for bars in list(self.realtime):
+            for bar in self._realtime_bars(bars.contract.symbol, self.cursor - 1):
+                bars.append(bar)
+                bars.updateEvent.emit(bars, True)
+
+    def _bar(self, symbol, i, formatDate=2):
+        columns = self.columns[symbol]
+        date = self.dates[i]
+        if formatDate == 1:
+            # TWS local time, taken as New York
+            date = date.astimezone(NEW_YORK)
+        return BarData(date=date, open=float(columns['open'][i]), high=float(columns['high'][i]),
+                       low=float(columns['low'][i]), close=float(columns['close'][i]),
+                       volume=float(columns['volume'][i]), average=float(columns['average'][i]),
+                       barCount=int(columns['barCount'][i]))
+
+    def _realtime_bars(self, symbol, i):
+        # prices go open -> high -> low -> close, volume and trades spread evenly
+        bar = self._bar(symbol, i)
+        path = np.interp(np.arange(REALTIME_BARS + 1), [0, 4, 8, REALTIME_BARS],
+                         [bar.open, bar.high, bar.low, bar.close])
+        volumes = np.diff(np.floor(np.arange(REALTIME_BARS + 1) * bar.volume / REALTIME_BARS))
+        counts = np.diff(np.arange(REALTIME_BARS + 1) * bar.barCount // REALTIME_BARS)
+        return [RealTimeBar(time=bar.date + datetime.timedelta(seconds=5 * k), endTime=-1,
+                            open_=float(path[k]), high=float(max(path[k], path[k + 1])),
+                            low=float(min(path[k], path[k + 1])), close=float(path[k + 1]),
+                            volume=float(volumes[k]), wap=bar.average, count=int(counts[k]))
+                for k in range(REALTIME_BARS)]
+
+    # market data
+
+    def reqHistoricalData(self, contract, endDateTime, durationStr, barSizeSetting, whatToShow,
+                          useRTH, formatDate=1, keepUpToDate=False, chartOptions=[], timeout=60):
+        if barSizeSetting != '1 min':
+            raise ValueError("MockIB only replays the recorded 1 min bars")
+        bars = BarDataList()
+        bars.contract = contract
+        bars.durationStr = durationStr
+        bars.barSizeSetting = barSizeSetting
+        bars.formatDate = formatDate
+        bars.keepUpToDate = keepUpToDate
+        start = max(self.cursor + 1 - _duration_bars(durationStr), 0)
+        bars.extend(self._bar(contract.symbol, i, formatDate) for i in range(start, self.cursor + 1))
+        if keepUpToDate:
+            self.subscriptions.append(bars)
+        return bars
+
+    async def reqHistoricalDataAsync(self, *args, **kwargs):
+        return self.reqHistoricalData(*args, **kwargs)
+
+    def cancelHistoricalData(self, bars):
+        if bars in self.subscriptions:
+            self.subscriptions.remove(bars)
+
+    def reqRealTimeBars(self, contract, barSize, whatToShow, useRTH, realTimeBarsOptions=[]):
+        bars = RealTimeBarList()
+        bars.contract = contract
+        bars.barSize = barSize
+        bars.whatToShow = whatToShow
+        bars.useRTH = useRTH
+        self.realtime.append(bars)
+        return bars
+
+    def cancelRealTimeBars(self, bars):
+        if bars in self.realtime:
+            self.realtime.remove(bars)
+
+    def price(self, contract):
+        # underlying: last close, option: intrinsic value plus a flat time value
+        close = float(self.columns[contract.symbol]['close'][self.cursor])
+        if contract.secType != 'OPT':
+            return close
+        intrinsic = close - contract.strike if contract.right == 'C' else contract.strike - close
+        return round(max(intrinsic, 0.0) + self.time_value, 2)
+
+    def _update_ticker(self, ticker):
+        price = self.price(ticker.contract)
+        spread = self.min_tick if ticker.contract.secType == 'OPT' else 0.01
+        ticker.time = self.reqCurrentTime()
+        ticker.last = ticker.close = price
+        ticker.bid, ticker.ask = price - spread, price + spread
+        ticker.bidSize = ticker.askSize = ticker.lastSize = 100
+        if ticker.contract.secType != 'OPT':
+            ticker.volume = float(self.columns[ticker.contract.symbol]['cumVolume'][self.cursor])
+
+    def reqMktData(self, contract, genericTickList='', snapshot=False, regulatorySnapshot=False,
+                   mktDataOptions=[]):
+        if contract not in self.tickers:
+            self.tickers[contract] = Ticker(contract=contract)
+            self._update_ticker(self.tickers[contract])
+        return self.tickers[contract]
+
+    def cancelMktData(self, contract):
+        self.tickers.pop(contract, None)
+
+    def reqTickers(self, *contracts, regulatorySnapshot=False):
+        tickers = []
+        for contract in contracts:
+            ticker = Ticker(contract=contract)
+            self._update_ticker(ticker)
+            tickers.append(ticker)
+        return tickers
+
+    async def reqTickersAsync(self, *contracts, regulatorySnapshot=False):
+        return self.reqTickers(*contracts)
+
+    # reference data
+
+    def reqSecDefOptParams(self, underlyingSymbol, futFopExchange, underlyingSecType, underlyingConId):
+        # weekly expirations (Fridays) for the next 8 weeks and 5 wide strikes around the price:
+        today = self.reqCurrentTime().date()
+        friday = today + datetime.timedelta(days=(4 - today.weekday()) % 7)
+        expirations = [(friday + datetime.timedelta(weeks=k)).strftime('%Y%m%d') for k in range(8)]
+        close = float(self.columns[underlyingSymbol]['close'][self.cursor])
+        strikes = [float(k) for k in range(int(close * 0.5) // 5 * 5, int(close * 1.5), 5)]
+        return [OptionChain('SMART', underlyingConId, underlyingSymbol, '100', expirations, strikes)]
+
+    async def reqSecDefOptParamsAsync(self, *args):
+        return self.reqSecDefOptParams(*args)
+
+    def _qualified(self, contract):
+        contract = copy.copy(contract)
+        key = (contract.secType, contract.symbol, contract.lastTradeDateOrContractMonth,
+               contract.strike, contract.right)
+        contract.conId = self._con_ids.setdefault(key, len(self._con_ids) + 1)
+        if contract.secType == 'OPT':
+            contract.multiplier = '100'
+            contract.localSymbol = f"{contract.symbol} {contract.lastTradeDateOrContractMonth[2:]}" \
+                                   f"{contract.right}{int(contract.strike * 1000):08d}"
+        else:
+            contract.localSymbol = contract.symbol
+        return contract
+
+    def reqContractDetails(self, contract):
+        return [ContractDetails(contract=self._qualified(contract),
+                                minTick=self.min_tick if contract.secType == 'OPT' else 0.01)]
+
+    async def reqContractDetailsAsync(self, contract):
+        return self.reqContractDetails(contract)
+
+    def qualifyContracts(self, *contracts):
+        for contract in contracts:
+            util.dataclassUpdate(contract, self._qualified(contract))
+        return list(contracts)
+
+    async def qualifyContractsAsync(self, *contracts):
+        return self.qualifyContracts(*contracts)
+
+    # orders
+
+    def bracketOrder(self, action, quantity, limitPrice, takeProfitPrice, stopLossPrice, **kwargs):
+        reverseAction = 'BUY' if action == 'SELL' else 'SELL'
+        parent = LimitOrder(action, quantity, limitPrice, orderId=next(self._order_ids),
+                            transmit=False, **kwargs)
+        takeProfit = LimitOrder(reverseAction, quantity, takeProfitPrice, orderId=next(self._order_ids),
+                                transmit=False, parentId=parent.orderId, **kwargs)
+        stopLoss = StopOrder(reverseAction, quantity, stopLossPrice, orderId=next(self._order_ids),
+                             transmit=True, parentId=parent.orderId, **kwargs)
+        return BracketOrder(parent, takeProfit, stopLoss)
+
+    def placeOrder(self, contract, order):
+        if self._released_at is not None:
+            self.signal_to_order.append(time.perf_counter() - self._released_at)
+        if not order.orderId:
+            order.orderId = next(self._order_ids)
+        trade = Trade(contract, order, OrderStatus(orderId=order.orderId, status='Submitted',
+                                                   remaining=order.totalQuantity))
+        trade.log.append(TradeLogEntry(self.reqCurrentTime(), 'Submitted'))
+        self.trades.append(trade)
+        self._working[order.orderId] = trade
+        self._emit(self.orderStatusEvent, trade)
+        return trade
+
+    def cancelOrder(self, order):
+        trade = self._working.get(order.orderId)
+        if trade is None:
+            return None
+        self._set_status(trade, 'Cancelled')
+        # like TWS, cancelling a parent cancels its children:
+        for child in [t for t in self._working.values() if t.order.parentId == order.orderId]:
+            self._set_status(child, 'Cancelled')
+        return trade
+
+    def openTrades(self):
+        return list(self._working.values())
+
+    def reqPositions(self):
+        return [position for position in self.positions.values() if position.position]
+
+    async def reqPositionsAsync(self):
+        return self.reqPositions()
+
+    async def reqExecutionsAsync(self, execFilter=None):
+        return list(self.fills)
+
+    def _set_status(self, trade, status):
+        trade.orderStatus.status = status
+        if trade.isDone():
+            self._working.pop(trade.order.orderId, None)
+            if status == 'Filled':
+                self._filled.add(trade.order.orderId)
+        trade.log.append(TradeLogEntry(self.reqCurrentTime(), status))
+        self._emit(self.orderStatusEvent, trade)
+
+    def _fill_orders(self):
+        # market orders fill at the model price and parents at their limit on
+        # the bar after they were placed, their
+        # children from the next bar on when the option price crosses their
+        # limit / stop; the other child of the bracket is then cancelled
+        filled = set(self._filled)
+        for trade in list(self._working.values()):
+            order = trade.order
+            if trade.isDone():
+                continue
+            if not order.parentId:
+                self._fill(trade, self.price(trade.contract) if order.orderType == 'MKT' else order.lmtPrice)
+                continue
+            if order.parentId not in filled:
+                continue
+            price = self.price(trade.contract)
+            if order.orderType == 'LMT':
+                level = order.lmtPrice
+                hit = price >= level if order.action == 'SELL' else price <= level
+            else:
+                level = order.auxPrice
+                hit = price <= level if order.action == 'SELL' else price >= level
+            if not hit:
+                continue
+            self._fill(trade, level)
+            for sibling in list(self._working.values()):
+                if sibling.order.parentId == order.parentId:
+                    self._set_status(sibling, 'Cancelled')
+
+    def _fill(self, trade, price):
+        order = trade.order
+        execution = Execution(
+            execId=f'mock.{next(self._exec_ids)}', time=self.reqCurrentTime(), side=order.action,
+            shares=order.totalQuantity, price=price, orderId=order.orderId,
+            cumQty=order.totalQuantity, avgPrice=price)
+        fill = Fill(trade.contract, execution, CommissionReport(), self.reqCurrentTime())
+        trade.fills.append(fill)
+        self.fills.append(fill)
+        trade.orderStatus.filled = order.totalQuantity
+        trade.orderStatus.remaining = 0
+        trade.orderStatus.avgFillPrice = price
+        self._set_status(trade, 'Filled')
+        self._emit(self.execDetailsEvent, trade, fill)
+        quantity = order.totalQuantity if order.action == 'BUY' else -order.totalQuantity
+        current = self.positions.get(trade.contract.conId)
+        position = (current.position if current else 0) + quantity
+        self.positions[trade.contract.conId] = Position('MOCK', trade.contract, position, price)
+        self._emit(self.positionEvent, self.positions[trade.contract.conId])
+
+    def latency_stats(self):
+        latencies = np.array(self.signal_to_order) * 1e6
+        if not len(latencies):
+            return {'orders': 0}
+        return {'orders': len(latencies), 'p50_us': float(np.percentile(latencies, 50)),
+                'p99_us': float(np.percentile(latencies, 99)), 'max_us': float(latencies.max())}
+
+
+def main(argv=None):
+    from algotradebot.backtest import load_bars
+    from algotradebot.journal import journal
+    from algotradebot.metrics import latency
+    from algotradebot.pacing import PacedIB
+    from algotradebot.runner import StrategyRunner, parse_strategy
+    from algotradebot.supervisor import ConnectionSupervisor
+
+    parser = argparse.ArgumentParser(prog='algotradebot.mock',
+                                     description="Replay a bar file through the bot on the mock IB")
+    parser.add_argument('bars', help="csv or parquet 1 min bar file")
+    parser.add_argument('--symbol', default='TSLA')
+    parser.add_argument('--strategy', action='append', type=parse_strategy)
+    parser.add_argument('--history', type=int, default=4 * BARS_PER_DAY, help="bars served as history")
+    parser.add_argument('--speed', type=float, help="replay speed (x real time), default as fast as possible")
+    parser.add_argument('--journal', help="record the replayed session to this journal")
+    parser.add_argument('--delta', type=float, help="target delta of the option contracts")
+    parser.add_argument('--max-cost', type=float, help="highest option price (per share) of the contracts")
+    parser.add_argument('--realtime', action='store_true', help="1 min candles from 5 second real time bars")
+    parser.add_argument('--intrabar', action='store_true', help="evaluate the forming candles on every tick")
+    parser.add_argument('--confirm', type=int, default=1, help="intrabar ticks a decision has to hold for")
+    parser.add_argument('--band', type=float, default=0.0, help="intrabar price margin beyond the level, percent")
+    parser.add_argument('--outage-every', type=int, help="drop the connection every N bars")
+    parser.add_argument('--outage-bars', type=int, default=3, help="bars an outage lasts before it is noticed")
+    parser.add_argument('--refuse', type=int, default=1, help="reconnect attempts refused after an outage")
+    parser.add_argument('--paced', action='store_true', help="requests through the pacing scheduler")
+    args = parser.parse_args(argv)
+
+    if args.journal:
+        journal.open(args.journal)
+    ib = MockIB({args.symbol: load_bars(args.bars)}, history=args.history, speed=args.speed)
+    ib.connect()
+    # the bot's view of IB, the mock itself drives the replay:
+    bot = PacedIB(ib) if args.paced else ib
+    runner = StrategyRunner(bot, [(args.symbol, args.symbol)],
+                            args.strategy or [parse_strategy('15 mins:ema')], 50, 100, delta=args.delta,
+                            max_cost=args.max_cost, realtime=args.realtime, intrabar=args.intrabar,
+                            confirm=args.confirm, band=args.band / 100)
+    runner.start()
+    print(runner.readiness())
+    supervisor = ConnectionSupervisor(ib, '127.0.0.1', 7497, 1, runner.resume_async, heartbeat=0, backoff=0.01)
+    supervisor.start()
+    if args.outage_every:
+        for at in range(args.history + args.outage_every, len(ib.dates), args.outage_every):
+            ib.schedule_outage(at, args.outage_bars, args.refuse)
+    start = time.perf_counter()
+    while not ib.done():
+        ib.sleep(3600)
+    supervisor.stop()
+    runner.stop()
+    journal.close()
+    print(f"replayed {ib.cursor + 1 - args.history} bars in {time.perf_counter() - start:.2f}s, "
+          f"{len(ib.trades)} orders, {supervisor.reconnects} reconnects")
+    print("signal to order latency:", ib.latency_stats())
+    if args.paced:
+        print("IB requests:", bot.scheduler.stats())
+    for stage, stats in latency.snapshot().items():
+        print(f"  {stage:>10}: {stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+from ib_insync.objects import Position
+from ib_insync.order import MarketOrder
+
+from algotradebot.journal import journal
+from algotradebot.metrics import latency
+
+# bracket states
+PENDING = 'PENDING'    # entry order working
+OPEN = 'OPEN'          # entry filled, take profit / stop loss working
+EXITING = 'EXITING'    # flattening: legs cancelled, exit order(s) sent for what was filled
+CLOSED = 'CLOSED'      # no position and no working order left
+
+# which leg of the bracket an orderId belongs to
+ENTRY, TAKE_PROFIT, STOP_LOSS, EXIT = 'entry', 'take_profit', 'stop_loss', 'exit'
+
+# entry order statuses that show TWS has the order
+ACKED = ('PreSubmitted', 'Submitted', 'Filled')
+
+_ACK = latency.histogram('ack')
+
+
+class Bracket:
+    '''
+    One bracket trade of a strategy (LONG or SHORT side) and its state.
+    '''
+    __slots__ = ('side', 'contract', 'action', 'trades', 'state', 'filled', 'exited', 'placed')
+
+    def __init__(self, side, contract, action, trades, placed=0):
+        self.side = side
+        self.contract = contract
+        self.action = action
+        # leg -> Trade
+        self.trades = dict(zip((ENTRY, TAKE_PROFIT, STOP_LOSS), trades))
+        self.state = PENDING
+        self.filled = 0
+        # quantity the exit orders were sent for
+        self.exited = 0
+        # perf_counter_ns() at placement until the entry is acknowledged
+        self.placed = placed
+
+    def __repr__(self):
+        return f"{self.side} {self.contract.localSymbol} {self.state}"
+
+    @property
+    def holding(self):
+        # entered (or entering) and not on the way out:
+        return self.state in (PENDING, OPEN)
+
+
+class OrderTracker:
+    '''
+    Order state machine driven by the IB order / fill / position events.
+    -------------------------------------------------------------------
+    Every placed order is mapped from its orderId to its bracket and leg, so
+    an IB event updates the owning bracket in O(1):
+    entry Filled -> OPEN, entry Cancelled without fill -> CLOSED,
+    take profit / stop loss / exit Filled -> CLOSED, and a position event
+    showing no position for an OPEN bracket closes it as well.
+    flatten() exits straight away: cancels the working legs and sends a
+    market order for whatever was filled. The bracket stays tracked
+    (EXITING) until the entry is done, as a cancel is only a request: a
+    fill of the entry that comes in before the cancel lands gets its own
+    market exit. It is CLOSED once the entry and every other leg are done.
+    resync_async() catches up with what happened while the connection was
+    down, from the open orders, the day's executions and the positions.
+    '''
+
+    def __init__(self, ib):
+        self.ib = ib
+        # orderId -> (Bracket, leg)
+        self.legs = {}
+        # conId -> position
+        self.positions = {}
+        # conId -> Bracket holding that contract
+        self.brackets = {}
+        ib.orderStatusEvent += self._on_order_status
+        ib.execDetailsEvent += self._on_exec_details
+        ib.positionEvent += self._on_position
+
+    def stop(self):
+        self.ib.orderStatusEvent -= self._on_order_status
+        self.ib.execDetailsEvent -= self._on_exec_details
+        self.ib.positionEvent -= self._on_position
+
+    def track(self, side, contract, action, trades, placed=0):
+        bracket = Bracket(side, contract, action, trades, placed)
+        for leg, trade in bracket.trades.items():
+            self.legs[trade.order.orderId] = (bracket, leg)
+            journal.order(trade, leg)
+        self.brackets[contract.conId] = bracket
+        # events may have come in while the legs were being placed:
+        for trade in trades:
+            self._on_order_status(trade)
+        return bracket
+
+    def flatten(self, bracket):
+        if bracket.state == CLOSED or bracket.state == EXITING:
+            return
+        # before the cancels: their status events may come back right away
+        bracket.state = EXITING
+        for leg, trade in list(bracket.trades.items()):
+            if not _done(trade):
+                self.ib.cancelOrder(trade.order)
+        if bracket.state == EXITING:
+            self._exit(bracket)
+            self._exited(bracket)
+
+    def _exit(self, bracket):
+        # market order for what was filled and is not on its way out yet
+        quantity = bracket.filled - bracket.exited
+        if quantity <= 0:
+            return
+        # the first exit is EXIT, the ones for later fills 'exit+<quantity before>'
+        leg = f"{EXIT}+{bracket.exited:g}" if bracket.exited else EXIT
+        reverseAction = 'BUY' if bracket.action == 'SELL' else 'SELL'
+        bracket.exited += quantity
+        trade = self.ib.placeOrder(bracket.contract, MarketOrder(reverseAction, quantity))
+        bracket.trades[leg] = trade
+        self.legs[trade.order.orderId] = (bracket, leg)
+        journal.order(trade, leg)
+
+    def _exited(self, bracket):
+        # an EXITING bracket is closed once all that was filled went out and
+        # nothing of it is working any more
+        if (bracket.state == EXITING and bracket.exited >= bracket.filled
+                and all(_done(trade) for trade in bracket.trades.values())):
+            self._close(bracket)
+
+    async def resync_async(self):
+        # after a reconnect: the events of the orders that filled or were
+        # cancelled meanwhile never came
+        fills = await self.ib.reqExecutionsAsync()
+        positions = await self.ib.reqPositionsAsync()
+        working = {trade.order.orderId: trade for trade in self.ib.openTrades()}
+        filled = {}
+        for fill in fills:
+            orderId = fill.execution.orderId
+            filled[orderId] = filled.get(orderId, 0) + fill.execution.shares
+        for orderId, (bracket, leg) in list(self.legs.items()):
+            if orderId in working:
+                # the new connection's Trade of the order
+                bracket.trades[leg] = working[orderId]
+                continue
+            trade = bracket.trades[leg]
+            if trade.isDone():
+                continue
+            # not working any more: filled (as far as it was) or cancelled
+            orderStatus = trade.orderStatus
+            orderStatus.filled = filled.get(orderId, orderStatus.filled)
+            orderStatus.remaining = trade.order.totalQuantity - orderStatus.filled
+            orderStatus.status = 'Filled' if not orderStatus.remaining else 'Cancelled'
+            self._on_order_status(trade)
+        held = {position.contract.conId for position in positions}
+        for position in positions:
+            self._on_position(position)
+        for conId, bracket in list(self.brackets.items()):
+            if conId not in held:
+                self._on_position(Position('', bracket.contract, 0.0, 0.0))
+
+    def _close(self, bracket):
+        bracket.state = CLOSED
+        for trade in bracket.trades.values():
+            self.legs.pop(trade.order.orderId, None)
+        if self.brackets.get(bracket.contract.conId) is bracket:
+            del self.brackets[bracket.contract.conId]
+        journal.event(f"Position closed: {bracket}")
+
+    def _on_order_status(self, trade):
+        entry = self.legs.get(trade.order.orderId)
+        if entry is None:
+            return
+        bracket, leg = entry
+        journal.status(trade)
+        status = trade.orderStatus.status
+        if leg == ENTRY:
+            if bracket.placed and status in ACKED:
+                _ACK.since(bracket.placed)
+                bracket.placed = 0
+            bracket.filled = trade.orderStatus.filled
+            if bracket.state == EXITING:
+                # filled before the cancel landed: out with that as well
+                self._exit(bracket)
+                self._exited(bracket)
+            elif status == 'Filled' and bracket.state == PENDING:
+                bracket.state = OPEN
+            elif trade.isDone() and not bracket.filled and bracket.state != CLOSED:
+                self._close(bracket)
+        elif bracket.state == EXITING:
+            self._exited(bracket)
+        elif status == 'Filled' and bracket.state != CLOSED:
+            self._close(bracket)
+
+    def _on_exec_details(self, trade, fill):
+        entry = self.legs.get(trade.order.orderId)
+        if entry is None:
+            return
+        journal.fill(trade, fill)
+        bracket, leg = entry
+        if leg == ENTRY:
+            bracket.filled = trade.orderStatus.filled or trade.filled()
+            if bracket.state == EXITING:
+                self._exit(bracket)
+
+    def _on_position(self, position):
+        journal.position(position)
+        self.positions[position.contract.conId] = position.position
+        bracket = self.brackets.get(position.contract.conId)
+        if bracket is None or position.position:
+            return
+        # flat while EXITING: only once the entry can not fill any more
+        if bracket.state == OPEN or (bracket.state == EXITING and _done(bracket.trades[ENTRY])):
+            self._close(bracket)
+
+
+def _done(trade):
+    # not working any more (Inactive: rejected or held by TWS)
+    return trade.isDone() or trade.orderStatus.status == 'Inactive'
@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import itertools
+import time
+from time import perf_counter_ns
+
+from algotradebot.metrics import latency
+
+# request priorities, the lowest first
+ORDER, MARKET_DATA, REFERENCE, HISTORICAL = range(4)
+PRIORITIES = ('order', 'market_data', 'reference', 'historical')
+
+# IB disconnects above 50 messages a second, keep some headroom
+MESSAGE_RATE = 45
+# historical data pacing: 60 requests every 10 minutes
+HISTORICAL_RATE = 60 / 600
+HISTORICAL_BURST = 60
+
+# request queued -> sent, per priority (orders are never queued)
+_WAIT = {priority: latency.histogram(f'wait_{PRIORITIES[priority]}')
+         for priority in (MARKET_DATA, REFERENCE, HISTORICAL)}
+
+
+def contract_key(contract):
+    # the same contract, qualified (conId) or not
+    if contract.conId:
+        return contract.conId
+    return (contract.secType, contract.symbol, contract.lastTradeDateOrContractMonth, contract.strike,
+            contract.right, contract.exchange, contract.currency, contract.tradingClass)
+
+
+class TokenBucket:
+    '''
+    Token bucket rate limit.
+    -----------------------
+    rate tokens a second, at most capacity of them saved up for a burst.
+    take() spends one whether there is one or not: traffic that must not
+    wait (orders) can take the level below zero, which makes what is queued
+    wait longer instead.
+    '''
+    __slots__ = ('rate', 'capacity', 'tokens', 'stamp')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait(self):
+        # seconds until a token is there
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class RequestScheduler:
+    '''
+    Central pacing of the IB requests.
+    ---------------------------------
+    Every message to IB takes a token of the messages bucket, historical
+    data requests one of the historical bucket as well, so bursts (many
+    symbols warming up or resuming at once) are spread out instead of
+    running into IB's pacing violations. Requests wait in one priority
+    queue, market data before reference data before historical data, in
+    arrival order within a priority; send() is for what must not wait
+    (orders, subscriptions): it goes out right away and only delays the
+    queue. A request with a key identical to one still in flight is not
+    sent again, it gets the same answer. The queue is drained by a task
+    that only runs while there is something queued; waiting on a token it
+    is woken by every new request, so one more urgent than the head goes
+    out right away instead of after the head's wait (up to 10s for
+    historical data).
+    '''
+
+    def __init__(self, rate=MESSAGE_RATE, burst=MESSAGE_RATE, historical_rate=HISTORICAL_RATE,
+                 historical_burst=HISTORICAL_BURST):
+        self.messages = TokenBucket(rate, burst)
+        self.historical = TokenBucket(historical_rate, historical_burst)
+        # heap of (priority, seq, historical, queued at, call, args, kwargs, future)
+        self._queue = []
+        self._seq = itertools.count()
+        # key -> future of the request in flight
+        self._inflight = {}
+        self._task = None
+        # set by every request queued, wakes the dispatcher up
+        self._wake = asyncio.Event()
+        # per priority: requests sent / queued at most at once, and the ones coalesced
+        self.sent = [0] * len(PRIORITIES)
+        self.max_depth = [0] * len(PRIORITIES)
+        self.coalesced = 0
+        latency.gauge('request_queue_depth', "IB requests waiting to be sent.", self.depth)
+
+    def depth(self):
+        # priority name -> requests waiting
+        depth = dict.fromkeys(PRIORITIES, 0)
+        for entry in self._queue:
+            depth[PRIORITIES[entry[0]]] += 1
+        return depth
+
+    def stats(self):
+        return {'sent': dict(zip(PRIORITIES, self.sent)), 'max_depth': dict(zip(PRIORITIES, self.max_depth)),
+                'coalesced': self.coalesced}
+
+    def send(self, priority, call, *args, **kwargs):
+        self.messages.take()
+        self.sent[priority] += 1
+        return call(*args, **kwargs)
+
+    async def request(self, priority, call, *args, key=None, historical=False, **kwargs):
+        future = self._inflight.get(key) if key is not None else None
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (priority, next(self._seq), historical, perf_counter_ns(), call, args,
+                                         kwargs, future))
+            depth = sum(entry[0] == priority for entry in self._queue)
+            self.max_depth[priority] = max(self.max_depth[priority], depth)
+            if key is not None:
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self._wake.set()
+            if self._task is None or self._task.done():
+                self._task = asyncio.ensure_future(self._dispatch())
+        # a caller giving up must not cancel the request for the others
+        return await asyncio.shield(future)
+
+    async def _dispatch(self):
+        while self._queue:
+            historical = self._queue[0][2]
+            delay = max(self.messages.wait(), self.historical.wait() if historical else 0.0)
+            if delay > 0:
+                # the head is looked at again when its token is there or a
+                # request (maybe a more urgent one) comes in, whichever is first
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            priority, _, historical, queued, call, args, kwargs, future = heapq.heappop(self._queue)
+            self.messages.take()
+            if historical:
+                self.historical.take()
+            self.sent[priority] += 1
+            _WAIT[priority].since(queued)
+            # sent, not awaited: the answers come back concurrently
+            task = asyncio.ensure_future(call(*args, **kwargs))
+            task.add_done_callback(lambda task, future=future: _resolve(future, task))
+        self._task = None
+
+
+def _resolve(future, task):
+    if future.done():
+        return
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+
+class PacedIB:
+    '''
+    IB with every request going through a RequestScheduler.
+    ------------------------------------------------------
+    Stands in for the IB instance it wraps: orders and subscriptions are
+    sent right away (orders ahead of everything else), the snapshot,
+    reference and historical requests are queued and paced, and the
+    identical ones in flight coalesced. qualifyContracts fills in the
+    contracts it is given and keepUpToDate history is a live subscription,
+    those are never coalesced. Everything else (events, connection,
+    run / sleep) is the wrapped IB's.
+    '''
+
+    def __init__(self, ib, scheduler=None):
+        self.ib = ib
+        self.scheduler = scheduler or RequestScheduler()
+
+    def __getattr__(self, name):
+        return getattr(self.ib, name)
+
+    # never queued
+
+    def placeOrder(self, contract, order):
+        return self.scheduler.send(ORDER, self.ib.placeOrder, contract, order)
+
+    def cancelOrder(self, order):
+        return self.scheduler.send(ORDER, self.ib.cancelOrder, order)
+
+    def reqMktData(self, contract, *args, **kwargs):
+        return self.scheduler.send(MARKET_DATA, self.ib.reqMktData, contract, *args, **kwargs)
+
+    def cancelMktData(self, contract):
+        return self.scheduler.send(MARKET_DATA, self.ib.cancelMktData, contract)
+
+    def reqRealTimeBars(self, contract, *args, **kwargs):
+        return self.scheduler.send(MARKET_DATA, self.ib.reqRealTimeBars, contract, *args, **kwargs)
+
+    def cancelRealTimeBars(self, bars):
+        return self.scheduler.send(MARKET_DATA, self.ib.cancelRealTimeBars, bars)
+
+    def cancelHistoricalData(self, bars):
+        return self.scheduler.send(MARKET_DATA, self.ib.cancelHistoricalData, bars)
+
+    def reqMarketDataType(self, marketDataType):
+        return self.scheduler.send(MARKET_DATA, self.ib.reqMarketDataType, marketDataType)
+
+    def reqCurrentTime(self):
+        return self.scheduler.send(MARKET_DATA, self.ib.reqCurrentTime)
+
+    # queued
+
+    async def reqCurrentTimeAsync(self):
+        # the clock: cheap and time critical (the connection heartbeat goes
+        # around the scheduler, see ConnectionSupervisor)
+        return await self.scheduler.request(MARKET_DATA, self.ib.reqCurrentTimeAsync, key=('time',))
+
+    async def reqTickersAsync(self, *contracts, regulatorySnapshot=False):
+        return await self.scheduler.request(
+            MARKET_DATA, self.ib.reqTickersAsync, *contracts, regulatorySnapshot=regulatorySnapshot,
+            key=('tickers', regulatorySnapshot, *map(contract_key, contracts)))
+
+    async def reqSecDefOptParamsAsync(self, underlyingSymbol, futFopExchange, underlyingSecType,
+                                      underlyingConId):
+        return await self.scheduler.request(
+            REFERENCE, self.ib.reqSecDefOptParamsAsync, underlyingSymbol, futFopExchange, underlyingSecType,
+            underlyingConId, key=('secdef', underlyingSymbol, futFopExchange, underlyingSecType, underlyingConId))
+
+    async def reqContractDetailsAsync(self, contract):
+        return await self.scheduler.request(REFERENCE, self.ib.reqContractDetailsAsync, contract,
+                                            key=('details', contract_key(contract)))
+
+    async def qualifyContractsAsync(self, *contracts):
+        return await self.scheduler.request(REFERENCE, self.ib.qualifyContractsAsync, *contracts)
+
+    async def reqExecutionsAsync(self, execFilter=None):
+        return await self.scheduler.request(REFERENCE, self.ib.reqExecutionsAsync, execFilter,
+                                            key=('executions',) if execFilter is None else None)
+
+    async def reqPositionsAsync(self):
+        return await self.scheduler.request(REFERENCE, self.ib.reqPositionsAsync, key=('positions',))
+
+    async def reqHistoricalDataAsync(self, contract, endDateTime, durationStr, barSizeSetting, whatToShow,
+                                     useRTH, formatDate=1, keepUpToDate=False, **kwargs):
+        key = None if keepUpToDate else ('history', contract_key(contract), str(endDateTime), durationStr,
+                                         barSizeSetting, whatToShow, useRTH, formatDate)
+        return await self.scheduler.request(
+            HISTORICAL, self.ib.reqHistoricalDataAsync, contract, endDateTime, durationStr, barSizeSetting,
+            whatToShow, useRTH, formatDate=formatDate, keepUpToDate=keepUpToDate, key=key, historical=True,
+            **kwargs)
@@ -0,0 +1,167 @@
+import asyncio
+import os
+
+import pandas as pd
+from ib_insync import Event
+
+from algotradebot.journal import journal
+from algotradebot.resample import bar_minutes
+from algotradebot.signals import SIGNALS
+
+# parameters csv name -> (Parameters field, conversion)
+PARAMETERS = {
+    'Stop-Loss %': ('stop_loss_percent', float),
+    'Take Profit %': ('profit_booking_percent', float),
+    'Qty': ('qty', lambda value: int(float(value))),
+    'Bar Size': ('barSizeSetting', str.strip),
+    'EMA Fast': ('ema_fast', lambda value: int(float(value))),
+    'EMA Slow': ('ema_slow', lambda value: int(float(value))),
+    'VWAP Window': ('vwap_window', lambda value: int(float(value))),
+}
+FIELDS = tuple(field for field, _ in PARAMETERS.values())
+# read on every entry, a reload applies to the next one; the others shape the
+# candles and indicators, a reload rebuilds the symbol's strategies
+LIVE = ('stop_loss_percent', 'profit_booking_percent', 'qty')
+
+# signal type -> {signal argument: Parameters field}
+SIGNAL_PARAMETERS = {
+    'ema': {'fast': 'ema_fast', 'slow': 'ema_slow'},
+    'vwap': {'window': 'vwap_window'},
+}
+
+
+class Parameters:
+    '''
+    Parameter values of one symbol. Never modified once built (a reload
+    builds new ones), so they can be shared with the trading path freely.
+    None: not set, the strategy config / signal default applies.
+    '''
+    __slots__ = FIELDS
+
+    def __init__(self, stop_loss_percent=None, profit_booking_percent=None, qty=1, barSizeSetting=None,
+                 ema_fast=None, ema_slow=None, vwap_window=None):
+        if stop_loss_percent is None or profit_booking_percent is None:
+            raise ValueError("Stop-Loss % and Take Profit % are required")
+        if not 0 < stop_loss_percent <= 100 or not profit_booking_percent > 0:
+            raise ValueError(f"bad Stop-Loss % / Take Profit %: {stop_loss_percent} / {profit_booking_percent}")
+        if qty < 1:
+            raise ValueError(f"bad Qty: {qty}")
+        if barSizeSetting is not None:
+            bar_minutes(barSizeSetting)
+        for window in (ema_fast, ema_slow, vwap_window):
+            if window is not None and window < 1:
+                raise ValueError(f"bad indicator window: {window}")
+        self.stop_loss_percent = stop_loss_percent
+        self.profit_booking_percent = profit_booking_percent
+        self.qty = qty
+        self.barSizeSetting = barSizeSetting
+        self.ema_fast = ema_fast
+        self.ema_slow = ema_slow
+        self.vwap_window = vwap_window
+
+    def __repr__(self):
+        values = ', '.join(f"{field}={getattr(self, field)!r}" for field in FIELDS
+                           if getattr(self, field) is not None)
+        return f"Parameters({values})"
+
+    def __eq__(self, other):
+        return isinstance(other, Parameters) and self.changes(other) == []
+
+    def changes(self, other):
+        return [field for field in FIELDS if getattr(self, field) != getattr(other, field)]
+
+    def values(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def strategies(self, strategies):
+        # the (barSizeSetting, signal) strategy config with the bar size override applied
+        if self.barSizeSetting is None:
+            return list(strategies)
+        return list(dict.fromkeys((self.barSizeSetting, signal) for _, signal in strategies))
+
+    def signal(self, name):
+        # new signal of that type, with the indicator window overrides
+        kwargs = {argument: getattr(self, field) for argument, field in SIGNAL_PARAMETERS[name].items()
+                  if getattr(self, field) is not None}
+        return SIGNALS[name](**kwargs)
+
+
+class ParameterStore:
+    '''
+    Hot reloadable strategy parameters.
+    ----------------------------------
+    Reads the parameters csv (Parameters, Value and an optional Symbol
+    column: rows with a symbol override the global value for that symbol)
+    and, while watch() runs, loads it again whenever its mtime changes.
+    A reload builds a whole new symbol -> Parameters table and swaps it in
+    with a single assignment: get() on the trading path takes no lock and
+    always sees either the old or the new values, never a mix. A file that
+    doesn't parse is reported and the values in use are kept.
+    changeEvent is emitted with the store after every swap.
+    '''
+
+    def __init__(self, path=None, **defaults):
+        self.path = path
+        # values the file doesn't set (keyword arguments of Parameters)
+        self.defaults = defaults
+        self.mtime = None
+        self.changeEvent = Event('changeEvent')
+        # None -> global Parameters, symbol -> its overridden ones
+        self._table = {None: Parameters(**defaults)} if path is None else {}
+        if path is not None:
+            self.load()
+
+    def get(self, symbol=None):
+        table = self._table
+        return table.get(symbol) or table[None]
+
+    def load(self):
+        self.mtime = os.stat(self.path).st_mtime_ns
+        frame = pd.read_csv(self.path, dtype=str, keep_default_na=False)
+        symbols = frame['Symbol'] if 'Symbol' in frame else [''] * len(frame)
+        overrides = {}
+        for name, value, symbol in zip(frame['Parameters'], frame['Value'], symbols):
+            if name.strip() not in PARAMETERS:
+                raise ValueError(f"unknown parameter {name!r} in {self.path}")
+            field, convert = PARAMETERS[name.strip()]
+            overrides.setdefault(symbol.strip() or None, {})[field] = convert(value)
+        base = dict(self.defaults, **overrides.pop(None, {}))
+        table = {None: Parameters(**base)}
+        for symbol, values in overrides.items():
+            table[symbol] = Parameters(**dict(base, **values))
+        self._table = table
+
+    def set(self, symbol, parameters):
+        # symbol's Parameters (None: the global ones), swapped in like a reload
+        table = dict(self._table)
+        table[symbol] = parameters
+        self._table = table
+        self.changeEvent.emit(self)
+
+    def reload(self):
+        '''
+        Loads the file again if its mtime changed. Returns True when new
+        values were swapped in.
+        '''
+        try:
+            if os.stat(self.path).st_mtime_ns == self.mtime:
+                return False
+            self.load()
+        except OSError as e:
+            # file being replaced: tried again on the next poll, reported once
+            if self.mtime is not None:
+                journal.event(f"parameters {self.path} not reloaded: {e!r}")
+                self.mtime = None
+            return False
+        except (ValueError, KeyError) as e:
+            # bad file: trading goes on with the current values until it changes again
+            journal.event(f"parameters {self.path} not reloaded: {e!r}")
+            return False
+        self.changeEvent.emit(self)
+        return True
+
+    async def watch(self, interval=1):
+        # mtime polling, for the whole session
+        while True:
+            await asyncio.sleep(interval)
+            self.reload()
@@ -0,0 +1,179 @@
+import argparse
+import datetime
+import math
+import time
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from algotradebot.quotes import implied_vol
+
+NEW_YORK = ZoneInfo('America/New_York')
+YEAR = 365 * 24 * 3600
+RIGHTS = ('C', 'P')
+
+# Abramowitz & Stegun 26.2.17 (|error| < 7.5e-8), numpy has no erf
+_A = (0.319381530, -0.356563782, 1.781477937, -1.821255978, 1.330274429)
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+
+def norm_cdf(x):
+    k = 1.0 / (1.0 + 0.2316419 * np.abs(x))
+    upper = 1.0 - norm_pdf(x) * k * (_A[0] + k * (_A[1] + k * (_A[2] + k * (_A[3] + k * _A[4]))))
+    return np.where(x >= 0, upper, 1.0 - upper)
+
+
+def black_scholes(spot, strike, years, vol, rate=0.0):
+    '''
+    Black-Scholes price, delta and theta (per calendar day) of European
+    calls and puts, the arguments broadcast. Each result is stacked
+    [calls, puts] along a new first axis: the puts come from the same d1 / d2
+    (put-call parity), not from a second pass. An expired option
+    (years <= 0) is worth its intrinsic value.
+    '''
+    years = np.maximum(years, 1e-9)
+    sqrt_years = np.sqrt(years)
+    root = vol * sqrt_years
+    d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * years) / root
+    n1, n2 = norm_cdf(d1), norm_cdf(d1 - root)
+    discounted = strike * np.exp(-rate * years)
+    call = spot * n1 - discounted * n2
+    decay = spot * norm_pdf(d1) * vol / (-2 * sqrt_years)
+    carry = rate * discounted
+    price = np.stack((call, call - spot + discounted))
+    delta = np.stack((n1, n1 - 1))
+    theta = np.stack((decay - carry * n2, decay + carry * (1 - n2))) / 365
+    return price, delta, theta
+
+
+def expiry_time(expiry):
+    # 'YYYYMMDD' -> epoch seconds of that day's 16:00 New York close
+    date = datetime.datetime.strptime(expiry, '%Y%m%d')
+    return date.replace(hour=16, tzinfo=NEW_YORK).timestamp()
+
+
+class ChainPricer:
+    '''
+    Black-Scholes valuation of a whole option chain.
+    -----------------------------------------------
+    Every right / expiry / strike of the chain is one cell of the
+    (2 x expirations x strikes) price, delta and theta arrays, valued in a
+    single vectorized pass from the underlying price, so contracts can be
+    picked by target delta or cost without any IB request. Volatilities
+    (expirations x strikes, shared by the call and the put) are the implied
+    vols of the streaming option quotes where there are some; the other
+    strikes of an expiry take the mean of its streamed ones, the expirations
+    without any the mean of all of them, and vol without any quote at all.
+    '''
+
+    def __init__(self, symbol, expirations, strikes, rate=0.0, vol=0.3, quotes=None):
+        self.symbol = symbol
+        self.expirations = list(expirations)
+        self.strikes = np.array(sorted(strikes), dtype=float)
+        self.rate = rate
+        self.vol = vol
+        self.quotes = quotes
+        shape = (len(RIGHTS), len(self.expirations), len(self.strikes))
+        self.expiry_times = np.array([expiry_time(expiry) for expiry in self.expirations])
+        self._expiry_index = {expiry: i for i, expiry in enumerate(self.expirations)}
+        self._strike_index = {strike: j for j, strike in enumerate(self.strikes)}
+        self.vols = np.full(shape[1:], vol)
+        self.price = np.full(shape, np.nan)
+        self.delta = np.full(shape, np.nan)
+        self.theta = np.full(shape, np.nan)
+
+    def __len__(self):
+        return self.price.size
+
+    def update_vols(self):
+        '''
+        Volatility grid from the implied vols of the streaming quotes (a
+        handful of contracts, the rest is filled in vectorized).
+        '''
+        # calls and puts quoted: the call / put mean of a strike
+        quoted = np.full((len(RIGHTS),) + self.vols.shape, np.nan)
+        if self.quotes is not None:
+            for ticker in self.quotes.tickers.values():
+                contract = ticker.contract
+                i = self._expiry_index.get(contract.lastTradeDateOrContractMonth)
+                j = self._strike_index.get(contract.strike)
+                if contract.symbol == self.symbol and i is not None and j is not None:
+                    quoted[RIGHTS.index(contract.right), i, j] = implied_vol(ticker)
+        known = ~np.isnan(quoted)
+        if not known.any():
+            self.vols.fill(self.vol)
+            return self.vols
+        counts = known.sum(axis=0)
+        strike_vols = np.nansum(quoted, axis=0) / np.maximum(counts, 1)
+        quoted_strikes = counts.sum(axis=1)
+        expiry_vols = np.where(quoted_strikes > 0,
+                               np.nansum(quoted, axis=(0, 2)) / np.maximum(quoted_strikes, 1),
+                               np.nanmean(quoted))
+        np.copyto(self.vols, np.where(counts > 0, strike_vols, expiry_vols[:, None]))
+        return self.vols
+
+    def value(self, spot, now=None):
+        '''
+        Values the chain at the underlying price spot; now: datetime or epoch
+        seconds (current time by default).
+        '''
+        if now is None:
+            now = time.time()
+        elif isinstance(now, datetime.datetime):
+            now = now.timestamp()
+        self.update_vols()
+        years = ((self.expiry_times - now) / YEAR)[:, None]
+        self.price, self.delta, self.theta = black_scholes(spot, self.strikes, years, self.vols, self.rate)
+        return self
+
+    def pick(self, right, delta=None, max_cost=None, expiry_index=None):
+        '''
+        (expiry, strike) of the last valuation: delta closest to the target
+        (an absolute value, for puts too) or, without a target, the highest
+        delta one; only the contracts priced at most max_cost (per share)
+        when given. expiry_index limits the pick to one expiration. None
+        when nothing qualifies.
+        '''
+        r = RIGHTS.index(right)
+        deltas = np.abs(self.delta[r])
+        eligible = ~np.isnan(deltas)
+        if max_cost is not None:
+            eligible &= self.price[r] <= max_cost
+        if expiry_index is not None:
+            eligible[np.arange(len(self.expirations)) != expiry_index] = False
+        if not eligible.any():
+            return None
+        score = np.abs(deltas - delta) if delta is not None else -deltas
+        i, j = np.unravel_index(np.argmin(np.where(eligible, score, np.inf)), score.shape)
+        return self.expirations[i], float(self.strikes[j])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='algotradebot.pricer',
+                                     description="Time the chain pricer on a synthetic chain")
+    parser.add_argument('--expirations', type=int, default=8)
+    parser.add_argument('--strikes', type=int, default=250)
+    parser.add_argument('--runs', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    today = datetime.date.today()
+    expirations = [(today + datetime.timedelta(weeks=k + 1)).strftime('%Y%m%d') for k in range(args.expirations)]
+    strikes = [100.0 + 2.5 * k for k in range(args.strikes)]
+    pricer = ChainPricer('TEST', expirations, strikes)
+    spot = strikes[len(strikes) // 2]
+    timings = []
+    for k in range(args.runs):
+        start = time.perf_counter()
+        pricer.value(spot * (1 + 1e-4 * (k % 7)))
+        pricer.pick('C', 0.6)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1e3
+    print(f"{len(pricer)} contracts: p50 {np.percentile(timings, 50):.3f}ms "
+          f"p99 {np.percentile(timings, 99):.3f}ms per valuation + pick")
+
+
+if __name__ == '__main__':
+    main()
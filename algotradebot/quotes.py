@@ -0,0 +1,71 @@
+import math
+
+
+def live_price(ticker):
+    '''
+    Live price of an option ticker: the bid / ask mid when both sides are
+    quoted, else IB's model price, NaN when there is neither.
+    '''
+    bid, ask = ticker.bid, ticker.ask
+    if bid > 0 and ask > 0:
+        return (bid + ask) / 2
+    greeks = ticker.modelGreeks
+    if greeks is not None and greeks.optPrice is not None and greeks.optPrice > 0:
+        return greeks.optPrice
+    return math.nan
+
+
+def quote_price(ticker):
+    # live price, falling back on the last trade and then the previous close
+    price = live_price(ticker)
+    if math.isnan(price):
+        price = ticker.last if ticker.last > 0 else ticker.close
+    return price
+
+
+def implied_vol(ticker):
+    greeks = ticker.modelGreeks
+    if greeks is None or greeks.impliedVol is None:
+        return math.nan
+    return greeks.impliedVol
+
+
+class OptionQuotes:
+    '''
+    Streaming option quotes.
+    -----------------------
+    Keeps a market data subscription (bid / ask and IB's model greeks) for
+    the candidate option contracts, so the live mid and implied volatility
+    of a contract are read straight from its ticker when the bracket is
+    priced, instead of waiting on a reqTickers snapshot.
+    '''
+
+    def __init__(self, ib):
+        self.ib = ib
+        # conId -> streaming Ticker
+        self.tickers = {}
+
+    def subscribe(self, contract):
+        if contract.conId not in self.tickers:
+            self.tickers[contract.conId] = self.ib.reqMktData(contract)
+        return self.tickers[contract.conId]
+
+    def unsubscribe(self, contract):
+        if self.tickers.pop(contract.conId, None) is not None:
+            self.ib.cancelMktData(contract)
+
+    def resume(self):
+        # after a reconnect: the old tickers went with the connection
+        self.tickers = {conId: self.ib.reqMktData(ticker.contract) for conId, ticker in self.tickers.items()}
+
+    def stop(self):
+        for ticker in self.tickers.values():
+            self.ib.cancelMktData(ticker.contract)
+        self.tickers = {}
+
+    def ticker(self, contract):
+        # the streaming ticker when it has a live price, else None
+        ticker = self.tickers.get(contract.conId)
+        if ticker is None or math.isnan(live_price(ticker)):
+            return None
+        return ticker
@@ -0,0 +1,394 @@
+import argparse
+import copy
+import itertools
+import math
+import time
+from collections import defaultdict, deque
+
+import pandas as pd
+from ib_insync import Event, util
+from ib_insync.contract import Contract, ContractDetails
+from ib_insync.objects import (
+    BarData, BarDataList, CommissionReport, Execution, Fill, OptionChain, OptionComputation, Position)
+from ib_insync.order import OrderStatus, Trade
+from ib_insync.ticker import Ticker
+
+from algotradebot.journal import journal, read_journal
+from algotradebot.mock import NEW_YORK, MockIB, settle
+from algotradebot.params import ParameterStore, Parameters
+
+# the recorded inputs fed back in sequence order, the rest is served on request
+TIMELINE = ('bars', 'ticks', 'statuses', 'fills', 'positions', 'parameters')
+
+# what has to come out the same
+DIFF_COLUMNS = {
+    'signals': ['strategy', 'decision', 'last_close', 'value1', 'value2'],
+    'orders': ['contract', 'leg', 'action', 'orderType', 'qty', 'lmtPrice', 'auxPrice'],
+}
+
+
+class _Answers:
+    # recorded answers served in order, the last one is repeated once exhausted
+    __slots__ = ('answers', 'last')
+
+    def __init__(self):
+        self.answers = deque()
+        self.last = None
+
+    def append(self, answer):
+        self.answers.append(answer)
+
+    def next(self):
+        if self.answers:
+            self.last = self.answers.popleft()
+        return self.last
+
+
+def _contract(row):
+    return Contract.create(
+        secType=row.secType, conId=int(row.conId), symbol=row.symbol,
+        lastTradeDateOrContractMonth=row.expiry, strike=row.strike, right=row.right,
+        multiplier=row.multiplier, exchange=row.exchange, currency=row.currency,
+        localSymbol=row.localSymbol, tradingClass=row.tradingClass)
+
+
+def _bar(row):
+    return BarData(date=row.date.to_pydatetime(), open=row.open, high=row.high, low=row.low,
+                   close=row.close, volume=row.volume, average=row.average, barCount=int(row.barCount))
+
+
+class ReplayIB:
+    '''
+    Stand in for ib_insync's IB answering from a recorded journal session.
+    ---------------------------------------------------------------------
+    History, reqCurrentTime, ticker snapshots, contract details and option
+    chains are served from the session's records, in the order they were
+    received; the option quotes orders were priced from are served the same
+    way (nothing streams on the option contracts in a replay). The live
+    inputs (bars, underlying ticks, order statuses, fills and positions)
+    are fed back by replay() in their recorded sequence, the order events to
+    the orders placed in the replay (the n-th placed order stands for the
+    n-th recorded one). Nothing is fetched or
+    sent anywhere, so the strategies make their decisions on exactly what
+    the live session saw.
+    '''
+
+    bracketOrder = MockIB.bracketOrder
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.connected = False
+        self.subscriptions = []
+        # conId -> streaming Ticker
+        self.tickers = {}
+        self.trades = []
+        # orderId -> replayed Trade
+        self._placed = {}
+        self._order_ids = itertools.count(1)
+        # recorded orderId -> replayed Trade
+        self._recorded_ids = list(frames['orders']['orderId'])
+        self._trades = {}
+        self._times = _Answers()
+        for value in frames['times']['value']:
+            self._times.append(value.to_pydatetime())
+        self._history = defaultdict(list)
+        for row in frames['history'].itertuples():
+            self._history[row.symbol].append(_bar(row))
+        self._tickers = defaultdict(_Answers)
+        for row in frames['tickers'].itertuples():
+            self._tickers[row.conId].append(row)
+        # (secType, symbol, expiry, strike, right) / conId -> (Contract, minTick)
+        self._details = {}
+        self._con_ids = {}
+        for row in frames['contracts'].itertuples():
+            contract = _contract(row)
+            key = (row.secType, row.symbol, row.expiry, row.strike, row.right)
+            minTick = row.minTick if row.minTick == row.minTick else self._details.get(key, (None, 0.01))[1]
+            self._details[key] = self._con_ids[contract.conId] = (contract, minTick)
+        self._chains = defaultdict(_Answers)
+        for row in frames['chains'].itertuples():
+            self._chains[row.symbol].append(row)
+        self.connectedEvent = Event('connectedEvent')
+        self.disconnectedEvent = Event('disconnectedEvent')
+        self.orderStatusEvent = Event('orderStatusEvent')
+        self.execDetailsEvent = Event('execDetailsEvent')
+        self.positionEvent = Event('positionEvent')
+        self.errorEvent = Event('errorEvent')
+
+    # connection
+
+    def connect(self, *args, **kwargs):
+        self.connected = True
+        self.connectedEvent.emit()
+        return self
+
+    async def connectAsync(self, *args, **kwargs):
+        return self.connect()
+
+    def disconnect(self):
+        self.connected = False
+
+    def isConnected(self):
+        return self.connected
+
+    @staticmethod
+    def run(*awaitables, timeout=None):
+        return util.run(*awaitables, timeout=timeout)
+
+    def reqMarketDataType(self, marketDataType):
+        pass
+
+    def reqCurrentTime(self):
+        return self._times.next()
+
+    async def reqCurrentTimeAsync(self):
+        return self.reqCurrentTime()
+
+    # market data
+
+    async def reqHistoricalDataAsync(self, contract, endDateTime, durationStr, barSizeSetting, whatToShow,
+                                     useRTH, formatDate=1, keepUpToDate=False, **kwargs):
+        bars = BarDataList()
+        bars.contract = contract
+        bars.barSizeSetting = barSizeSetting
+        bars.formatDate = formatDate
+        bars.keepUpToDate = keepUpToDate
+        bars.extend(self._date(copy.copy(bar), formatDate) for bar in self._history[contract.symbol])
+        # the candle still forming when the history came in:
+        if bars:
+            bars.append(copy.copy(bars[-1]))
+        if keepUpToDate:
+            self.subscriptions.append(bars)
+        return bars
+
+    def cancelHistoricalData(self, bars):
+        if bars in self.subscriptions:
+            self.subscriptions.remove(bars)
+
+    @staticmethod
+    def _date(bar, formatDate):
+        if formatDate == 1:
+            # TWS local time, taken as New York
+            bar.date = bar.date.astimezone(NEW_YORK)
+        return bar
+
+    def reqMktData(self, contract, *args, **kwargs):
+        if contract.conId not in self.tickers:
+            self.tickers[contract.conId] = Ticker(contract=contract)
+        return self.tickers[contract.conId]
+
+    def cancelMktData(self, contract):
+        self.tickers.pop(contract.conId, None)
+
+    async def reqTickersAsync(self, *contracts, regulatorySnapshot=False):
+        tickers = []
+        for contract in contracts:
+            row = self._tickers[contract.conId].next()
+            ticker = Ticker(contract=contract)
+            if row is not None:
+                ticker.bid, ticker.ask, ticker.last, ticker.close = row.bid, row.ask, row.last, row.close
+                if row.model == row.model or row.iv == row.iv:
+                    ticker.modelGreeks = OptionComputation(
+                        0, None if row.iv != row.iv else row.iv, None,
+                        None if row.model != row.model else row.model, None, None, None, None, None)
+            tickers.append(ticker)
+        return tickers
+
+    # reference data
+
+    async def reqSecDefOptParamsAsync(self, underlyingSymbol, futFopExchange, underlyingSecType,
+                                      underlyingConId):
+        row = self._chains[underlyingSymbol].next()
+        if row is None:
+            return []
+        return [OptionChain(row.exchange, underlyingConId, row.tradingClass, '100',
+                            row.expirations.split(','), [float(strike) for strike in row.strikes.split(',')])]
+
+    def _lookup(self, contract):
+        if contract.conId:
+            return self._con_ids.get(contract.conId)
+        return self._details.get((contract.secType, contract.symbol, contract.lastTradeDateOrContractMonth,
+                                  float(contract.strike), contract.right))
+
+    async def reqContractDetailsAsync(self, contract):
+        found = self._lookup(contract)
+        if found is None:
+            return []
+        return [ContractDetails(contract=copy.copy(found[0]), minTick=found[1])]
+
+    async def qualifyContractsAsync(self, *contracts):
+        for contract in contracts:
+            found = self._lookup(contract)
+            if found is not None:
+                util.dataclassUpdate(contract, found[0])
+        return list(contracts)
+
+    # orders
+
+    def placeOrder(self, contract, order):
+        if not order.orderId:
+            order.orderId = next(self._order_ids)
+        trade = Trade(contract, order, OrderStatus(orderId=order.orderId, status='PendingSubmit',
+                                                   remaining=order.totalQuantity))
+        if len(self.trades) < len(self._recorded_ids):
+            self._trades[self._recorded_ids[len(self.trades)]] = trade
+        self.trades.append(trade)
+        self._placed[order.orderId] = trade
+        return trade
+
+    def cancelOrder(self, order):
+        # the Cancelled statuses come from the recording
+        return self._placed.get(order.orderId)
+
+    # recorded inputs
+
+    def timeline(self):
+        # (kind, row) of the live inputs in recorded sequence order
+        rows = [(row.seq, kind, row) for kind in TIMELINE for row in self.frames[kind].itertuples()]
+        rows.sort(key=lambda item: item[0])
+        return [(kind, row) for _, kind, row in rows]
+
+    def emit(self, kind, row):
+        if kind == 'bars':
+            for bars in self.subscriptions:
+                if bars.contract.symbol == row.symbol:
+                    # the recorded candle closes, the next one starts forming:
+                    bars[-1] = self._date(_bar(row), bars.formatDate)
+                    bars.append(copy.copy(bars[-1]))
+                    bars.updateEvent.emit(bars, True)
+        elif kind == 'ticks':
+            ticker = self.tickers.get(row.conId)
+            if ticker is not None:
+                ticker.bid, ticker.ask, ticker.last, ticker.close = row.bid, row.ask, row.last, row.close
+                ticker.volume = row.volume
+                ticker.time = None if pd.isna(row.date) else row.date.to_pydatetime(warn=False)
+                ticker.updateEvent.emit(ticker)
+        elif kind == 'statuses':
+            trade = self._trades.get(row.orderId)
+            if trade is not None:
+                orderStatus = trade.orderStatus
+                orderStatus.status = row.status
+                orderStatus.filled, orderStatus.remaining = row.filled, row.remaining
+                orderStatus.avgFillPrice = row.avgFillPrice
+                self.orderStatusEvent.emit(trade)
+        elif kind == 'fills':
+            trade = self._trades.get(row.orderId)
+            if trade is not None:
+                execution = Execution(execId=row.execId, time=row.time.to_pydatetime(warn=False),
+                                      side=trade.order.action, shares=row.shares, price=row.price,
+                                      orderId=trade.order.orderId)
+                fill = Fill(trade.contract, execution, CommissionReport(), row.time.to_pydatetime(warn=False))
+                trade.fills.append(fill)
+                self.execDetailsEvent.emit(trade, fill)
+        elif kind == 'positions':
+            found = self._con_ids.get(row.conId)
+            contract = found[0] if found else Contract(conId=int(row.conId))
+            self.positionEvent.emit(Position('', contract, row.position, row.avgCost))
+
+
+def _parameters(row):
+    return Parameters(stop_loss_percent=row.stop_loss_percent, profit_booking_percent=row.profit_booking_percent,
+                      qty=int(row.qty), barSizeSetting=row.barSizeSetting or None, ema_fast=row.ema_fast or None,
+                      ema_slow=row.ema_slow or None, vwap_window=row.vwap_window or None)
+
+
+def session_config(frames):
+    '''
+    (symbols, strategies, params, options) of a recorded session, in the
+    StrategyRunner argument format: params is a ParameterStore with the
+    parameters each symbol was warmed up with, options the keyword
+    arguments (delta, max_cost, intrabar confirmation) it ran with.
+    '''
+    strategies = frames['strategies']
+    symbols = list(dict.fromkeys(zip(strategies['symbol'], strategies['tradingClass'])))
+    row = strategies.iloc[0]
+    params = ParameterStore(stop_loss_percent=row['stop_loss_percent'],
+                            profit_booking_percent=row['profit_booking_percent'], qty=int(row['qty']))
+    first = symbols[0][0]
+    for parameters in frames['parameters'].drop_duplicates('symbol').itertuples():
+        params.set(parameters.symbol, _parameters(parameters))
+        if not parameters.barSizeSetting:
+            # strategies of a symbol without a bar size override: the configured ones
+            first = parameters.symbol
+    first = strategies[strategies['symbol'] == first]
+    options = {'delta': None if math.isnan(row['delta']) else row['delta'],
+               'max_cost': None if math.isnan(row['max_cost']) else row['max_cost'],
+               'intrabar': bool(row['confirm']), 'confirm': max(int(row['confirm']), 1), 'band': row['band']}
+    return symbols, list(zip(first['barSizeSetting'], first['signal'])), params, options
+
+
+async def replay_async(ib, runner):
+    await runner.start_async()
+    for kind, row in ib.timeline():
+        # whatever the previous input set off (entries, ladder updates)
+        # completed before the next one came in:
+        await settle()
+        if kind == 'parameters':
+            runner.params.set(row.symbol, _parameters(row))
+        else:
+            ib.emit(kind, row)
+    await settle()
+    runner.stop()
+
+
+def replay(path, session=-1, output=None):
+    '''
+    Runs a recorded session again through the StrategyRunner on a ReplayIB.
+    Returns the recorded and the replayed frames (the replay is journaled to
+    output when given).
+    '''
+    from algotradebot.runner import StrategyRunner
+
+    recorded = read_journal(path, session)
+    symbols, strategies, params, options = session_config(recorded)
+    ib = ReplayIB(recorded)
+    if output:
+        journal.open(output)
+    runner = StrategyRunner(ib, symbols, strategies, params=params, **options)
+    ib.run(replay_async(ib, runner))
+    runner.tracker.stop()
+    if not output:
+        return recorded, None
+    journal.close()
+    return recorded, read_journal(output, -1)
+
+
+def diff(recorded, replayed):
+    '''
+    Compares the decisions (signals) and orders of two sessions record by
+    record. Returns {'signals': DataFrame, 'orders': DataFrame} of the
+    differing records, recorded_* / replayed_* columns side by side.
+    '''
+    differences = {}
+    for name, columns in DIFF_COLUMNS.items():
+        a = recorded[name][columns].reset_index(drop=True)
+        b = replayed[name][columns].reset_index(drop=True)
+        index = range(max(len(a), len(b)))
+        a, b = a.reindex(index), b.reindex(index)
+        same = ((a == b) | (a.isna() & b.isna())).all(axis=1)
+        differences[name] = pd.concat([a[~same].add_prefix('recorded_'), b[~same].add_prefix('replayed_')],
+                                      axis=1)
+    return differences
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='algotradebot.replay',
+                                     description="Replay a recorded session and diff it with the recording")
+    parser.add_argument('journal', help="journal of the recorded session")
+    parser.add_argument('--session', type=int, default=-1, help="session of the journal, default the last one")
+    parser.add_argument('--output', help="journal of the replay, default <journal>.replay")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    recorded, replayed = replay(args.journal, args.session, args.output or f"{args.journal}.replay")
+    print(f"replayed {len(recorded['bars'])} bars in {time.perf_counter() - start:.2f}s")
+    for name, differences in diff(recorded, replayed).items():
+        print(f"{name}: {len(recorded[name])} recorded, {len(replayed[name])} replayed, "
+              f"{len(differences)} different")
+        if len(differences):
+            with pd.option_context('display.width', 200):
+                print(differences.head(10).to_string())
+
+
+if __name__ == '__main__':
+    main()
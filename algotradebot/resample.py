@@ -0,0 +1,127 @@
+import datetime
+import math
+
+from ib_insync.objects import BarData
+
+
+def bar_minutes(barSizeSetting):
+    # '1 min' -> 1, '3 mins' -> 3, '15 mins' -> 15, '1 hour' -> 60
+    count, unit = barSizeSetting.split()
+    if unit.startswith('min'):
+        return int(count)
+    if unit.startswith('hour'):
+        return int(count) * 60
+    raise ValueError(f"bar size {barSizeSetting!r} can't be built from 1 min bars")
+
+
+def roll_up(bars, minutes):
+    # BarResamplers of the minutes timeframes started from closed 1 minute
+    # candles -> ({minutes: resampler}, {minutes: candles they complete})
+    resamplers = {m: BarResampler(m) for m in sorted(set(minutes))}
+    return resamplers, {m: resampler.resample(bars) for m, resampler in resamplers.items()}
+
+
+class BarResampler:
+    '''
+    Builds N minute candles from closed 1 minute candles.
+    ----------------------------------------------------
+    Candles are aligned on the clock (9:30, 9:45, ... for 15 mins) like the
+    ones IB returns. update() returns the N minute candles a 1 minute candle
+    completes: the one it ends, and before it the one still open from an
+    earlier period when the minute that would have ended it never came (no
+    trade in it, a gap after a reconnect).
+    '''
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.current = None
+
+    def _period(self, date):
+        return date.date(), (date.hour * 60 + date.minute) // self.minutes
+
+    def update(self, bar):
+        if self.minutes == 1:
+            return [bar]
+        candles = []
+        if self.current is not None and self._period(self.current.date) != self._period(bar.date):
+            candles.append(self._close())
+        if self.current is None:
+            self.current = BarData(
+                date=bar.date, open=bar.open, high=bar.high, low=bar.low, close=bar.close,
+                volume=bar.volume, average=bar.average * bar.volume, barCount=bar.barCount)
+        else:
+            current = self.current
+            current.high = max(current.high, bar.high)
+            current.low = min(current.low, bar.low)
+            current.close = bar.close
+            current.volume += bar.volume
+            # average is kept as price * volume until the candle closes:
+            current.average += bar.average * bar.volume
+            current.barCount += bar.barCount
+        end = bar.date + datetime.timedelta(minutes=1)
+        if not (end.hour * 60 + end.minute) % self.minutes:
+            candles.append(self._close())
+        return candles
+
+    def _close(self):
+        candle, self.current = self.current, None
+        candle.average = candle.average / candle.volume if candle.volume else candle.close
+        return candle
+
+    def resample(self, bars):
+        # all the candles completed by a list of 1 minute candles (e.g. history):
+        return [candle for bar in bars for candle in self.update(bar)]
+
+    def forming(self, minute):
+        # the N minute candle so far, minute: its 1 minute candle still forming (a TickCandle)
+        current = self.current
+        if current is None:
+            return BarData(date=minute.date, open=minute.open, high=minute.high, low=minute.low,
+                           close=minute.close, volume=minute.volume)
+        return BarData(date=current.date, open=current.open, high=max(current.high, minute.high),
+                       low=min(current.low, minute.low), close=minute.close,
+                       volume=current.volume + minute.volume)
+
+
+class TickCandle:
+    '''
+    Forming 1 minute candle from the trade ticks.
+    --------------------------------------------
+    update(ticker) takes a streaming ticker update and returns True when it
+    carried a trade (a new last price or volume): open / high / low / close
+    are the trade prices since the last reset() (a 1 minute candle closed),
+    volume the growth of the ticker's cumulative day volume since then (the
+    lot units of IB's bars). date is the time of the last trade.
+    '''
+    __slots__ = ('date', 'open', 'high', 'low', 'close', 'volume', '_last', '_volume', '_base')
+
+    def __init__(self):
+        self._last = self._volume = math.nan
+        self._base = math.nan
+        self.date = None
+        self.reset()
+
+    def reset(self):
+        self.open = self.high = self.low = self.close = math.nan
+        self.volume = 0.0
+        self._base = self._volume
+
+    def update(self, ticker):
+        last, volume = ticker.last, ticker.volume
+        if not last > 0:
+            return False
+        if last == self._last and (volume == self._volume or math.isnan(volume) and math.isnan(self._volume)):
+            # quote update only
+            return False
+        self._last, self._volume = last, volume
+        if math.isnan(self._base):
+            self._base = volume
+        if math.isnan(self.open):
+            self.open = self.high = self.low = last
+        else:
+            self.high = max(self.high, last)
+            self.low = min(self.low, last)
+        self.close = last
+        self.volume = volume - self._base if not math.isnan(volume - self._base) else 0.0
+        self.date = ticker.time
+        return True
@@ -0,0 +1,72 @@
+import numpy as np
+from ib_insync.objects import BarData
+
+FIELDS = ('date', 'open', 'high', 'low', 'close', 'volume', 'average', 'barCount')
+
+
+class BarRing:
+    '''
+    Fixed capacity bar container.
+    ----------------------------
+    One preallocated array per bar field, so memory stays flat however long
+    the session runs. Every bar is written twice, at i and i + capacity:
+    the latest `capacity` bars are then always contiguous and
+    ring['close'] / ring.view('close', n) return numpy views (no copy) in
+    time order.
+    Integer indexing and iteration give BarData like a BarDataList.
+    '''
+    __slots__ = ('capacity', 'count', '_head') + FIELDS
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        # next slot to write, in [0, capacity)
+        self._head = 0
+        self.date = np.empty(2 * capacity, dtype=object)
+        for field in ('open', 'high', 'low', 'close', 'volume', 'average'):
+            setattr(self, field, np.zeros(2 * capacity))
+        self.barCount = np.zeros(2 * capacity, dtype=np.int64)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, bar):
+        i = self._head
+        j = i + self.capacity
+        self.date[i] = self.date[j] = bar.date
+        self.open[i] = self.open[j] = bar.open
+        self.high[i] = self.high[j] = bar.high
+        self.low[i] = self.low[j] = bar.low
+        self.close[i] = self.close[j] = bar.close
+        self.volume[i] = self.volume[j] = bar.volume
+        self.average[i] = self.average[j] = bar.average
+        self.barCount[i] = self.barCount[j] = bar.barCount
+        self._head = (i + 1) % self.capacity
+        self.count += 1
+
+    def extend(self, bars):
+        for bar in list(bars)[-self.capacity:]:
+            self.append(bar)
+
+    def view(self, field, n=None):
+        # the last n values of a field (all the kept ones by default), oldest first
+        n = len(self) if n is None else min(n, len(self))
+        end = self._head + self.capacity
+        return getattr(self, field)[end - n:end]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.view(key)
+        size = len(self)
+        if key < 0:
+            key += size
+        if not 0 <= key < size:
+            raise IndexError("BarRing index out of range")
+        i = self._head + self.capacity - size + key
+        return BarData(date=self.date[i], open=float(self.open[i]), high=float(self.high[i]),
+                       low=float(self.low[i]), close=float(self.close[i]), volume=float(self.volume[i]),
+                       average=float(self.average[i]), barCount=int(self.barCount[i]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
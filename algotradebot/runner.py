@@ -0,0 +1,529 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, perf_counter_ns
+from functools import partial
+
+import pandas as pd
+from ib_insync.contract import Stock
+from ib_insync import util
+from ib_insync.ib import IB
+
+from algotradebot.chains import OptionChainCache
+from algotradebot.engine import BarEngine, RealTimeBarEngine
+from algotradebot.journal import journal
+from algotradebot.ladder import StrikeLadder
+from algotradebot.metrics import latency
+from algotradebot.orders import OrderTracker
+from algotradebot.pacing import PacedIB, RequestScheduler
+from algotradebot.params import LIVE, ParameterStore
+from algotradebot.quotes import OptionQuotes
+from algotradebot.resample import TickCandle, bar_minutes, roll_up
+from algotradebot.signals import SIGNALS
+from algotradebot.store import BarStore, duration_since
+from algotradebot.strategy import Strategy
+from algotradebot.supervisor import ConnectionSupervisor
+
+# closed 1 min bar -> candle handed to a strategy (roll up)
+_BAR = latency.histogram('bar')
+
+# warm up stages of a symbol, in order
+STAGES = ('history', 'options', 'ladder', 'strategies')
+
+
+def load_symbols(path):
+    # symbol list csv with a "Symbol" column (and optional "Trading Class"):
+    symbols = pd.read_csv(path)
+    if 'Trading Class' not in symbols:
+        symbols['Trading Class'] = symbols['Symbol']
+    return list(zip(symbols['Symbol'], symbols['Trading Class'].fillna(symbols['Symbol'])))
+
+
+def parse_strategy(config):
+    # "15 mins:ema" -> ('15 mins', 'ema')
+    barSizeSetting, _, signal = config.partition(':')
+    bar_minutes(barSizeSetting)
+    if signal not in SIGNALS:
+        raise ValueError(f"unknown signal type {signal!r}, expected one of {list(SIGNALS)}")
+    return barSizeSetting.strip(), signal
+
+
+class SymbolState:
+    '''
+    Per symbol state: the shared 1 min bar subscription, the ITM strike ladder
+    and the strategies (one per configured bar size / signal) fed from them,
+    and how far the warm up got.
+    '''
+    __slots__ = ('symbol', 'tradingClass', 'stock', 'engine', 'ladder', 'strategies', 'params', 'stages',
+                 'error', 'tick')
+
+    def __init__(self, symbol, tradingClass):
+        self.symbol = symbol
+        self.tradingClass = tradingClass
+        self.stock = Stock(symbol, 'SMART', 'USD')
+        self.engine = None
+        self.ladder = None
+        # list of (timeframe minutes, Strategy)
+        self.strategies = []
+        # Parameters the symbol was warmed up with
+        self.params = None
+        # warm up stage -> seconds it took, for the completed ones
+        self.stages = {}
+        # exception the warm up failed on
+        self.error = None
+        # 1 min candle forming from the trade ticks (intrabar mode)
+        self.tick = None
+
+    def ready(self):
+        return self.error is None and len(self.stages) == len(STAGES) and self.ladder.center is not None
+
+
+class StrategyRunner:
+    '''
+    Multi symbol, multi timeframe strategy runner.
+    ---------------------------------------------
+    Runs every configured strategy for a whole symbol list on one shared IB
+    connection. Each symbol has a single 1 min bar subscription (IB's
+    keepUpToDate bars, or 5 second real time bars with realtime); its engine
+    rolls 3 min, 15 min, ... candles up from it, so adding timeframes costs
+    no extra IB requests. All symbols are evaluated from the same event
+    loop on candle close; the symbols are started concurrently.
+    start_async() is the warm up: history and seeded indicators, option
+    chains, qualified candidate contracts, streaming underlying and option
+    quotes. A symbol failing it is reported and left out, the others trade.
+    Bars before open_time (when set) are not traded: the warm up can run
+    pre-market. Parameters come from a ParameterStore (a fixed one of
+    stop_loss_percent, profit_booking_percent and qty when none is given);
+    per symbol overrides of the bar size and indicator windows shape the
+    symbol's strategies (a change rebuilds them in the session), stop loss,
+    take profit and qty are read on every entry. With intrabar, the
+    strategies also evaluate their forming candle on every trade tick of
+    the underlying (see Strategy.on_tick for confirm and band).
+    '''
+
+    def __init__(self, ib, symbols, strategies, stop_loss_percent=None, profit_booking_percent=None,
+                 durationStr='4 D', qty=1, cache=None, store=None, warmup_bars=1560, delta=None,
+                 params=None, realtime=False, intrabar=False, confirm=1, band=0.0, max_cost=None):
+        self.ib = ib
+        self.cache = cache or OptionChainCache(ib)
+        # one order / position tracker for all the symbols on the connection
+        self.tracker = OrderTracker(ib)
+        # streaming quotes of the ladders' option contracts
+        self.quotes = OptionQuotes(ib)
+        self.states = [SymbolState(symbol, tradingClass) for symbol, tradingClass in symbols]
+        self.strategies = strategies
+        self.params = params or ParameterStore(stop_loss_percent=stop_loss_percent,
+                                               profit_booking_percent=profit_booking_percent, qty=qty)
+        self.params.changeEvent += self._on_parameters
+        self.durationStr = durationStr
+        self.delta = delta
+        self.max_cost = max_cost
+        # optional local BarStore: warm up history from disk, only the gap from IB
+        self.store = store
+        # the live bars are appended to it from one thread, in order and off
+        # the bar close path
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='bar_store') if store is not None else None
+        self.warmup_bars = warmup_bars
+        # 1 min candles kept per symbol (BarRing): as many as a warm up seeds
+        # from. The indicators keep their own state and never read them, the
+        # engine resumes after the last one
+        self.capacity = warmup_bars
+        self.open_time = None
+        # 1 min candles built from 5 second real time bars instead of IB's keepUpToDate ones
+        self.realtime = realtime
+        self.intrabar = intrabar
+        self.confirm = confirm
+        self.band = band
+        self._closed_at = None
+
+    def start(self):
+        return self.ib.run(self.start_async())
+
+    async def start_async(self):
+        # qualify all underlyings in one go:
+        await self.ib.qualifyContractsAsync(*[state.stock for state in self.states])
+        now = await self.ib.reqCurrentTimeAsync()
+        for state in self.states:
+            journal.contract(state.stock)
+        journal.current_time(now)
+        today = pd.to_datetime(now).tz_convert('America/New_York').strftime('%Y%m%d')
+        self.cache.evict_expired(today)
+        self.cache.record()
+        # the symbols don't depend on each other, their requests run concurrently:
+        await asyncio.gather(*[self._start_symbol(state) for state in self.states])
+        if self.cache.path:
+            self.cache.save()
+
+    async def _start_symbol(self, state):
+        try:
+            await self._warm_up(state)
+        except Exception as e:
+            # one symbol failing (unknown contract, no chain, ...) does not stop the others
+            state.error = e
+            journal.event(f"{state.symbol} warm up failed in {STAGES[len(state.stages)]}: {e!r}")
+
+    async def _warm_up(self, state):
+        start = perf_counter()
+        history = await self.history(state)
+        journal.history(state.symbol, history)
+        state.stages['history'] = perf_counter() - start
+        # option chain and candidate contracts around the last close:
+        start = perf_counter()
+        await self.cache.warm_up_async(state.stock, history[-1].close, state.tradingClass)
+        state.stages['options'] = perf_counter() - start
+        start = perf_counter()
+        state.ladder = StrikeLadder(self.ib, state.stock, self.cache, state.tradingClass,
+                                    quotes=self.quotes)
+        await state.ladder.start_async(history[-1].close)
+        state.stages['ladder'] = perf_counter() - start
+        start = perf_counter()
+        params = state.params = self.params.get(state.symbol)
+        journal.parameters(state.symbol, params)
+        # the 1 min candles that closed during the warm up only went to the
+        # engine (nothing handled its events yet): seeded from like the
+        # history, right before the handlers take over
+        closed = [bar for bar in state.engine.completed_bars() if bar.date > history[-1].date]
+        if closed:
+            journal.history(state.symbol, closed)
+            if self.store is not None:
+                self.store.append(state.symbol, '1 min', closed)
+            history = history + closed
+        state.engine.resamplers, state.strategies = self._strategies(state, params, history)
+        state.engine.barCloseEvent += partial(self.on_bar_close, state)
+        state.engine.candleCloseEvent += partial(self.on_candle_close, state)
+        if self.intrabar:
+            state.tick = TickCandle()
+            state.ladder.ticker.updateEvent += partial(self.on_tick, state)
+        state.stages['strategies'] = perf_counter() - start
+
+    def _strategies(self, state, params, history, record=True):
+        # the symbol's strategies for params, seeded from the closed 1 min
+        # candles of history -> (roll ups feeding them, [(minutes, Strategy)]);
+        # record: journaled as the session's strategy config (warm up)
+        strategies = params.strategies(self.strategies)
+        # one roll up per timeframe, shared by its strategies:
+        resamplers, candles = roll_up(history, [bar_minutes(barSizeSetting) for barSizeSetting, _ in strategies])
+        built = []
+        for barSizeSetting, signal in strategies:
+            if record:
+                journal.strategy(state.symbol, state.tradingClass, barSizeSetting, signal, params.qty, self.delta,
+                                 params.stop_loss_percent, params.profit_booking_percent,
+                                 self.confirm if self.intrabar else 0, self.band, self.max_cost)
+            minutes = bar_minutes(barSizeSetting)
+            strategy = Strategy(
+                self.ib, state.stock, params.signal(signal), barSizeSetting,
+                params.stop_loss_percent, params.profit_booking_percent,
+                qty=params.qty, tradingClass=state.tradingClass, cache=self.cache,
+                ladder=state.ladder, tracker=self.tracker, quotes=self.quotes, delta=self.delta,
+                params=self.params, confirm=self.confirm, band=self.band, max_cost=self.max_cost)
+            # seed indicators from the closed candles:
+            strategy.seed(candles[minutes])
+            built.append((minutes, strategy))
+        return resamplers, built
+
+    def ready(self):
+        return all(state.ready() for state in self.states)
+
+    def _on_parameters(self, store):
+        for state in self.states:
+            if state.params is None:
+                continue
+            params = store.get(state.symbol)
+            changes = params.changes(state.params)
+            if not changes:
+                continue
+            journal.parameters(state.symbol, params)
+            rebuild = [field for field in changes if field not in LIVE]
+            if rebuild and state.error is None:
+                self._rebuild(state, params, rebuild)
+            state.params = params
+
+    def _rebuild(self, state, params, changes):
+        '''
+        Bar size / indicator window change: the symbol's strategies are
+        built again and seeded from the closed 1 min candles the engine
+        keeps (the warm up's history and the session since), then swapped
+        in together with their roll ups. All of it runs in one event loop
+        callback, so no bar or tick sees half of the change. A position (or
+        entry in flight) carries over to the new strategy of the same signal
+        type, whose exit rules then apply to it. The journal has the change
+        (parameters record), a replay rebuilds the same way.
+        '''
+        start = perf_counter()
+        resamplers, strategies = self._strategies(state, params, state.engine.completed_bars(), record=False)
+        held = {}
+        for _, strategy in state.strategies:
+            if strategy.holding():
+                held.setdefault(type(strategy.signal), strategy)
+        for _, strategy in strategies:
+            old = held.pop(type(strategy.signal), None)
+            if old is not None:
+                strategy.take_over(old)
+        for old in held.values():
+            journal.event(f"{old} dropped by the parameter change, its {old.position} stays with its bracket")
+        state.engine.resamplers, state.strategies = resamplers, strategies
+        journal.event(f"{state.symbol} strategies rebuilt for {changes} in {perf_counter() - start:.3f}s: "
+                      f"{[strategy.name for _, strategy in strategies]}")
+
+    def readiness(self):
+        '''
+        Warm up report, one line per symbol: the time each stage took, the
+        option quotes streaming, or where it failed.
+        '''
+        lines = []
+        for state in self.states:
+            stages = ' '.join(f"{stage} {seconds:.2f}s" for stage, seconds in state.stages.items())
+            if state.error is not None:
+                status = f"FAILED in {STAGES[len(state.stages)]}: {state.error!r}"
+            elif state.ready():
+                status = f"ready, {len(state.ladder.subscribed)} option quotes"
+            else:
+                status = "warming up"
+            lines.append(f"{state.symbol}: {status} ({stages})")
+        return '\n'.join(lines)
+
+    def _engine(self, state, durationStr):
+        # UTC dates (formatDate=2), always: with TWS local time (formatDate=1)
+        # ib_insync gives naive datetimes, which do not compare with open_time
+        if self.realtime:
+            return RealTimeBarEngine(self.ib, state.stock, durationStr, capacity=self.capacity)
+        return BarEngine(self.ib, state.stock, '1 min', durationStr, capacity=self.capacity, formatDate=2)
+
+    async def history(self, state):
+        # start the 1 min stream and return the closed 1 min candles to seed from
+        if self.store is None:
+            state.engine = self._engine(state, self.durationStr)
+            return (await state.engine.start_async())[:-1]
+        # download the missing tail into the store, serve the rest from disk:
+        await self.store.update_async(self.ib, state.stock, '1 min', self.durationStr)
+        history = self.store.bars(state.symbol, '1 min', self.warmup_bars)
+        durationStr = self.durationStr
+        if history:
+            now = await self.ib.reqCurrentTimeAsync()
+            journal.current_time(now)
+            durationStr = duration_since(history[-1].date, now)
+        state.engine = self._engine(state, durationStr)
+        live = (await state.engine.start_async())[:-1]
+        history = history + [bar for bar in live if not history or bar.date > history[-1].date]
+        # the engine keeps what the strategies are seeded from (parameter changes reseed from it)
+        state.engine.backfill(history)
+        return history
+
+    async def resume_async(self):
+        '''
+        Picks the session up again after a reconnect: the order tracker
+        catches up with the fills and positions first, the tickers and bar
+        streams are subscribed again and the bars missed meanwhile go
+        through the strategies like any other (nothing is reloaded), each
+        one's entries done before the next.
+        '''
+        await self.tracker.resync_async()
+        self.quotes.resume()
+        await asyncio.gather(*[self._resume_symbol(state) for state in self.states if state.ready()])
+
+    async def _resume_symbol(self, state):
+        missed = await state.engine.resume_async(partial(self._entries_done, state))
+        if missed:
+            journal.event(f"{state.symbol} {len(missed)} missed 1 min bars backfilled")
+        # after the backfill: a new ticker has no price until its first tick
+        state.ladder.resume()
+        if state.tick is not None:
+            state.ladder.ticker.updateEvent += partial(self.on_tick, state)
+
+    @staticmethod
+    async def _entries_done(state):
+        entries = [strategy.entry for _, strategy in state.strategies
+                   if strategy.entry is not None and not strategy.entry.done()]
+        if entries:
+            await asyncio.wait(entries)
+
+    def stop(self):
+        for state in self.states:
+            if state.engine is not None:
+                state.engine.stop()
+            if state.ladder is not None:
+                state.ladder.stop()
+        self.quotes.stop()
+        if self._writer is not None:
+            # the bars still queued are written
+            self._writer.shutdown()
+        if self.cache.path:
+            self.cache.save()
+
+    def run_until(self, end_time):
+        remaining = (end_time - self.ib.reqCurrentTime()).total_seconds()
+        if remaining > 0:
+            self.ib.sleep(remaining)
+
+    async def run_until_async(self, end_time):
+        remaining = (end_time - await self.ib.reqCurrentTimeAsync()).total_seconds()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+    def on_bar_close(self, state, bars, bar):
+        # every closed 1 min candle, before the timeframes it completes
+        self._closed_at = perf_counter_ns()
+        if state.tick is not None:
+            state.tick.reset()
+        if self.open_time is not None and bar.date < self.open_time:
+            return
+        journal.bar(state.symbol, bar)
+        if self.store is not None:
+            # disk I/O: the candles it completes go to the strategies meanwhile
+            written = asyncio.get_event_loop().run_in_executor(self._writer, self.store.append, state.symbol,
+                                                               '1 min', [bar])
+            written.add_done_callback(partial(self._stored, state))
+
+    @staticmethod
+    def _stored(state, written):
+        if not written.cancelled() and written.exception() is not None:
+            journal.event(f"{state.symbol} 1 min bar not stored: {written.exception()!r}")
+
+    def on_candle_close(self, state, minutes, candle):
+        if self.open_time is not None and candle.date < self.open_time:
+            return
+        for strategy_minutes, strategy in state.strategies:
+            if strategy_minutes == minutes:
+                _BAR.since(self._closed_at)
+                strategy.on_bar(candle)
+                self._closed_at = perf_counter_ns()
+
+    def on_tick(self, state, ticker):
+        # intrabar: every strategy evaluates its forming candle on a trade
+        if not state.tick.update(ticker):
+            return
+        if self.open_time is not None and (ticker.time is None or ticker.time < self.open_time):
+            return
+        for minutes, strategy in state.strategies:
+            strategy.on_tick(state.engine.resamplers[minutes].forming(state.tick))
+
+
+async def warm_up_for_open(ib, runner, lead=15*60):
+    '''
+    Pre-market schedule: sleeps until `lead` seconds before the 9:30 open,
+    warms the runner up, reports its readiness and waits for the open, so
+    the first decision after it runs from memory. Past the open (or closer
+    to it than lead) the warm up starts right away.
+    '''
+    TimeNow = pd.to_datetime(await ib.reqCurrentTimeAsync()).tz_convert('America/New_York')
+    StartTime = TimeNow.normalize() + pd.Timedelta(hours=9, minutes=30)
+    runner.open_time = StartTime
+    wait = (StartTime - TimeNow).total_seconds() - lead
+    if wait > 0:
+        print(f"Warming up {lead/60:g} minutes before the open, sleeping for {wait:.0f} seconds")
+        await asyncio.sleep(wait)
+    await runner.start_async()
+    print(runner.readiness())
+    wait = (StartTime - pd.to_datetime(await ib.reqCurrentTimeAsync())).total_seconds()
+    if wait > 0:
+        print("Waiting for Market to Open..")
+        await asyncio.sleep(wait)
+
+
+async def run(args, symbols, strategies, params):
+    if args.journal:
+        journal.open(args.journal)
+    # Logging into Interactive Broker TWS, one session for all the symbols:
+    connection = IB()
+    await connection.connectAsync(args.host, args.port, clientId=args.client_id)
+    # every request paced (IB's message and historical data limits), orders first:
+    ib = PacedIB(connection, RequestScheduler(rate=args.message_rate))
+
+    runner = StrategyRunner(ib, symbols, strategies, params=params,
+                            durationStr=args.duration, delta=args.delta, max_cost=args.max_cost,
+                            realtime=args.realtime, intrabar=args.intrabar, confirm=args.confirm,
+                            band=args.band / 100,
+                            cache=OptionChainCache(ib, args.chain_cache),
+                            store=BarStore(args.bar_store) if args.bar_store else None)
+    if args.wait_for_open:
+        await warm_up_for_open(ib, runner, args.warm_up_lead * 60)
+    else:
+        await runner.start_async()
+        print(runner.readiness())
+    # reconnects (TWS restarts, drops) and resumes the session:
+    # (on the unpaced connection: its heartbeat must not queue behind a backfill)
+    supervisor = ConnectionSupervisor(connection, args.host, args.port, args.client_id, runner.resume_async,
+                                      heartbeat=args.heartbeat)
+    supervisor.recoveredEvent += lambda seconds: print(f"IB connection recovered in {seconds:.2f}s")
+    supervisor.start()
+    if args.metrics_port:
+        latency.serve(args.metrics_port)
+    export = asyncio.ensure_future(latency.export(args.metrics_file)) if args.metrics_file else None
+    # parameters csv edits are picked up during the session:
+    watch = asyncio.ensure_future(params.watch(args.reload_interval))
+
+    # Run the algorithm on each candle close till the daily time frame exhausts:
+    EndTime = pd.to_datetime("16:30").tz_localize('America/New_York')
+    await runner.run_until_async(EndTime)
+    supervisor.stop()
+    runner.stop()
+    watch.cancel()
+    if export is not None:
+        export.cancel()
+        latency.write(args.metrics_file)
+    latency.stop()
+    print("stage latencies:", latency.snapshot())
+    print("IB requests:", ib.scheduler.stats())
+    journal.close()
+
+    # Disconnect IB API service after market or trades over:
+    ib.disconnect()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='algotradebot', description="Interactive Brokers AlgoTrading bot")
+    parser.add_argument('--symbols', default='Yaz_Trading_Bot_Symbols.csv', help="symbol list csv")
+    parser.add_argument('--symbol', action='append', help="trade this symbol instead of the symbol list")
+    parser.add_argument('--strategy', action='append', type=parse_strategy,
+                        help="bar size and signal type, e.g. '15 mins:ema' or '1 min:vwap'")
+    parser.add_argument('--duration', default='4 D', help="durationStr of the 1 min history")
+    parser.add_argument('--parameters', default='Yaz_Trading_Bot_Parameters.csv',
+                        help="parameters csv, reloaded when it changes (optional Symbol column for overrides)")
+    parser.add_argument('--reload-interval', type=float, default=1,
+                        help="seconds between checks of the parameters csv")
+    parser.add_argument('--qty', type=int, default=1, help="option contracts per entry, unless the csv sets Qty")
+    parser.add_argument('--delta', type=float,
+                        help="target delta of the option contracts (default: first ITM strike)")
+    parser.add_argument('--max-cost', type=float,
+                        help="highest option price (per share) to pick a contract at, the highest delta one "
+                             "without --delta")
+    parser.add_argument('--realtime', action='store_true',
+                        help="build the 1 min candles from 5 second real time bars (closes without IB's delay)")
+    parser.add_argument('--intrabar', action='store_true',
+                        help="also evaluate the forming candles on every trade tick of the underlying")
+    parser.add_argument('--confirm', type=int, default=1,
+                        help="intrabar ticks in a row a decision has to hold for before it is acted on")
+    parser.add_argument('--band', type=float, default=0.0,
+                        help="intrabar margin of the price beyond the EMA / VWAP level, percent")
+    parser.add_argument('--bar-store', help="directory of the local bar store (history from disk)")
+    parser.add_argument('--chain-cache', help="file to persist the option chain / contract cache")
+    parser.add_argument('--wait-for-open', action='store_true',
+                        help="warm up before the 9:30 open and start trading at it")
+    parser.add_argument('--warm-up-lead', type=float, default=15,
+                        help="minutes before the open the warm up starts (with --wait-for-open)")
+    parser.add_argument('--journal', default='algotradebot.journal',
+                        help="session journal of bars, signals, orders and fills ('' to disable)")
+    parser.add_argument('--metrics-file', help="Prometheus text file of the stage latencies, kept up to date")
+    parser.add_argument('--metrics-port', type=int, help="serve the stage latencies on http://:port/metrics")
+    parser.add_argument('--host', default='127.0.0.1')
+    # port for IB gateway : 4002
+    # port for IB TWS : 7497
+    parser.add_argument('--port', type=int, default=7497)
+    parser.add_argument('--client-id', type=int, default=1)
+    parser.add_argument('--heartbeat', type=float, default=10,
+                        help="seconds between connection checks, an unanswered one reconnects (0: off)")
+    parser.add_argument('--message-rate', type=float, default=45,
+                        help="IB messages a second at most (IB's limit is 50)")
+    args = parser.parse_args(argv)
+
+    # read parameters from csv:
+    params = ParameterStore(args.parameters, qty=args.qty)
+
+    symbols = [(symbol, symbol) for symbol in args.symbol] if args.symbol else load_symbols(args.symbols)
+    strategies = args.strategy or [parse_strategy('15 mins:ema')]
+
+    util.run(run(args, symbols, strategies, params))
+
+
+if __name__ == '__main__':
+    main()
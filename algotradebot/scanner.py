@@ -0,0 +1,154 @@
+import argparse
+import time
+
+import numpy as np
+
+# bar fields of the ring buffer
+OPEN, HIGH, LOW, CLOSE, VOLUME = range(5)
+
+CONDITIONS = ('ema_long', 'ema_short', 'vwap_long', 'vwap_short')
+
+
+class SignalScanner:
+    '''
+    EMA cross and VWAP signal scanner over a whole symbol universe.
+    --------------------------------------------------------------
+    The latest `capacity` bars of every symbol are kept in one preallocated
+    (symbols x bars x OHLCV) ring buffer. On each bar close update() takes
+    the new bar of every symbol as one (symbols x OHLCV) array and updates
+    the EMAs, the windowed VWAP and the long / short conditions of all the
+    symbols in a handful of vectorized steps:
+    ema_long: close > fast EMA > slow EMA, ema_short: close < fast EMA < slow EMA,
+    vwap_long: close > VWAP, vwap_short: close < VWAP.
+    Indicator values are the same as EMACrossSignal / VWAPSignal give. A row
+    of NaN marks a symbol without a bar this interval: it is stored as such,
+    adds nothing to the VWAP window and leaves the symbol's EMAs and
+    conditions unchanged.
+    '''
+
+    def __init__(self, symbols, capacity=64, fast=4, slow=55, vwap_window=3):
+        if capacity < vwap_window:
+            raise ValueError("capacity must hold at least the VWAP window")
+        self.symbols = np.asarray(symbols, dtype=object)
+        n = len(self.symbols)
+        self.capacity = capacity
+        self.bars = np.full((n, capacity, 5), np.nan)
+        # next slot to write, number of bars written (all symbols move together)
+        self.head = 0
+        self.count = 0
+        self.fast, self.slow = fast, slow
+        self.alpha_fast = 2.0 / (fast + 1)
+        self.alpha_slow = 2.0 / (slow + 1)
+        # raw EMA recursions and closes seen per symbol (NaN until `window` closes)
+        self._ema_fast = np.full(n, np.nan)
+        self._ema_slow = np.full(n, np.nan)
+        self.seen = np.zeros(n, dtype=np.int64)
+        self.vwap_window = vwap_window
+        self._sum_pv = np.zeros(n)
+        self._sum_volume = np.zeros(n)
+        # last valid VWAP, carried over zero volume windows (fillna)
+        self.vwap = np.zeros(n)
+        self.state = {name: np.zeros(n, dtype=bool) for name in CONDITIONS}
+
+    @property
+    def ema_fast(self):
+        return np.where(self.seen >= self.fast, self._ema_fast, np.nan)
+
+    @property
+    def ema_slow(self):
+        return np.where(self.seen >= self.slow, self._ema_slow, np.nan)
+
+    def seed(self, history):
+        # history: (symbols x bars x OHLCV) array, oldest bar first
+        for i in range(history.shape[1]):
+            self.update(history[:, i])
+
+    def update(self, bar):
+        '''
+        bar: (symbols x OHLCV) array of the bar that just closed. Returns
+        {condition: symbols whose condition flipped}; the current conditions
+        are in self.state.
+        '''
+        bar = np.asarray(bar, dtype=float)
+        close = bar[:, CLOSE]
+        valid = ~np.isnan(close)
+
+        # windowed VWAP: the bar leaving the window drops out of the running sums
+        if self.count >= self.vwap_window:
+            old = self.bars[:, (self.head - self.vwap_window) % self.capacity]
+            old_volume = np.nan_to_num(old[:, VOLUME])
+            self._sum_pv -= np.nan_to_num((old[:, HIGH] + old[:, LOW] + old[:, CLOSE]) / 3.0 * old[:, VOLUME])
+            self._sum_volume -= old_volume
+        self.bars[:, self.head] = bar
+        self.head = (self.head + 1) % self.capacity
+        self.count += 1
+        volume = np.where(valid, bar[:, VOLUME], 0.0)
+        self._sum_pv += np.where(valid, (bar[:, HIGH] + bar[:, LOW] + close) / 3.0 * bar[:, VOLUME], 0.0)
+        self._sum_volume += volume
+        traded = self._sum_volume != 0
+        np.divide(self._sum_pv, self._sum_volume, out=self.vwap, where=traded)
+
+        # EMAs: first close seeds, then ema += alpha * (close - ema)
+        first = valid & (self.seen == 0)
+        self._ema_fast[first] = close[first]
+        self._ema_slow[first] = close[first]
+        later = valid & ~first
+        self._ema_fast[later] += self.alpha_fast * (close[later] - self._ema_fast[later])
+        self._ema_slow[later] += self.alpha_slow * (close[later] - self._ema_slow[later])
+        self.seen += valid
+
+        ema_fast, ema_slow = self.ema_fast, self.ema_slow
+        new = {
+            'ema_long': (close > ema_fast) & (ema_fast > ema_slow),
+            'ema_short': (close < ema_fast) & (ema_fast < ema_slow),
+            'vwap_long': close > self.vwap,
+            'vwap_short': close < self.vwap,
+        }
+        flipped = {}
+        for name, condition in new.items():
+            state = self.state[name]
+            condition = np.where(valid, condition, state)
+            flipped[name] = self.symbols[condition != state]
+            self.state[name] = condition
+        return flipped
+
+    def latest(self, n=None):
+        # the last n bars of every symbol in time order, (symbols x n x OHLCV)
+        n = min(n or self.capacity, self.count, self.capacity)
+        return self.bars[:, (self.head - n + np.arange(n)) % self.capacity]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='algotradebot.scanner',
+                                     description="Time the signal scanner on a random walk universe")
+    parser.add_argument('--symbols', type=int, default=5000)
+    parser.add_argument('--bars', type=int, default=390, help="bars timed after the warm up")
+    parser.add_argument('--warmup', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    n, t = args.symbols, args.warmup + args.bars
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 1e-3, (n, t + 1)), axis=1))
+    bars = np.empty((n, t, 5))
+    bars[:, :, OPEN] = close[:, :-1]
+    bars[:, :, CLOSE] = close[:, 1:]
+    bars[:, :, HIGH] = np.maximum(close[:, :-1], close[:, 1:]) * 1.0005
+    bars[:, :, LOW] = np.minimum(close[:, :-1], close[:, 1:]) * 0.9995
+    bars[:, :, VOLUME] = rng.integers(0, 10000, (n, t))
+
+    scanner = SignalScanner([f"S{i}" for i in range(n)])
+    scanner.seed(bars[:, :args.warmup])
+    timings = []
+    flips = 0
+    for i in range(args.warmup, t):
+        start = time.perf_counter()
+        flipped = scanner.update(bars[:, i])
+        timings.append(time.perf_counter() - start)
+        flips += sum(len(symbols) for symbols in flipped.values())
+    timings = np.array(timings) * 1e3
+    print(f"{n} symbols, {args.bars} bars: p50 {np.percentile(timings, 50):.3f}ms "
+          f"p99 {np.percentile(timings, 99):.3f}ms per bar, {flips} flips")
+
+
+if __name__ == '__main__':
+    main()
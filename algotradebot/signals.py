@@ -0,0 +1,130 @@
+import math
+
+import numpy as np
+
+from algotradebot.indicators import EMA, VWAP, ema_array, vwap_array
+
+
+class EMACrossSignal:
+    '''
+    EMA cross signal.
+    ----------------
+    Long Entry: the candle has closed ABOVE the 4EMA and 4EMA > 55EMA,
+    exit the long when 4EMA < 55EMA.
+    Short Entry: the candle has closed BELOW the 4EMA and 4EMA < 55EMA,
+    exit the short when 4EMA > 55EMA.
+    intrabar() evaluates the forming candle at its last price instead, the
+    entries then need the price beyond the 4EMA by band (a fraction).
+    '''
+
+    def __init__(self, fast=4, slow=55):
+        self.ema_fast = EMA(window=fast)
+        self.ema_slow = EMA(window=slow)
+        self.last_close = None
+        # values the rules are evaluated on: the last closed candle's, or the
+        # forming one's after intrabar()
+        self.fast = self.slow = math.nan
+        self.band = 0.0
+
+    def seed(self, bars):
+        for bar in bars:
+            self.update(bar)
+
+    def update(self, bar):
+        self.last_close = bar.close
+        self.fast = self.ema_fast.update(bar.close)
+        self.slow = self.ema_slow.update(bar.close)
+        self.band = 0.0
+
+    def intrabar(self, candle, band=0.0):
+        # the forming candle as if it closed at its last price; the EMAs are not updated
+        self.last_close = candle.close
+        self.fast = self.ema_fast.peek(candle.close)
+        self.slow = self.ema_slow.peek(candle.close)
+        self.band = band
+
+    def values(self):
+        return {'last_close': self.last_close, 'ema_fast': self.fast, 'ema_slow': self.slow}
+
+    def long_entry(self):
+        return self.last_close > self.fast * (1 + self.band) and self.fast > self.slow
+
+    def long_exit(self):
+        return self.fast < self.slow
+
+    def short_entry(self):
+        return self.last_close < self.fast * (1 - self.band) and self.fast < self.slow
+
+    def short_exit(self):
+        return self.fast > self.slow
+
+    def conditions(self, bars):
+        # vectorized version of the rules above over a whole bar history (backtests),
+        # returns long_entry, long_exit, short_entry, short_exit boolean arrays:
+        close = np.asarray(bars['close'], dtype=float)
+        ema_fast = ema_array(close, self.ema_fast.window)
+        ema_slow = ema_array(close, self.ema_slow.window)
+        return ((close > ema_fast) & (ema_fast > ema_slow), ema_fast < ema_slow,
+                (close < ema_fast) & (ema_fast < ema_slow), ema_fast > ema_slow)
+
+
+class VWAPSignal:
+    '''
+    VWAP signal.
+    -----------
+    Long Entry: the candle has closed ABOVE the vwap, exit when it closes below.
+    Short Entry: the candle has closed BELOW the vwap, exit when it closes above.
+    intrabar() evaluates the forming candle at its last price instead, which
+    then has to be beyond the vwap by band (a fraction).
+    '''
+
+    def __init__(self, window=3):
+        self.vwap = VWAP(window=window, fillna=True)
+        self.last_close = None
+        # vwap the rules are evaluated on (see EMACrossSignal)
+        self.level = math.nan
+        self.band = 0.0
+
+    def seed(self, bars):
+        for bar in bars:
+            self.update(bar)
+
+    def update(self, bar):
+        self.last_close = bar.close
+        self.level = self.vwap.update(bar.high, bar.low, bar.close, bar.volume)
+        self.band = 0.0
+
+    def intrabar(self, candle, band=0.0):
+        self.last_close = candle.close
+        self.level = self.vwap.peek(candle.high, candle.low, candle.close, candle.volume)
+        self.band = band
+
+    def values(self):
+        return {'last_close': self.last_close, 'vwap': self.level}
+
+    def long_entry(self):
+        return self.last_close > self.level * (1 + self.band)
+
+    def long_exit(self):
+        return self.last_close < self.level * (1 - self.band)
+
+    def short_entry(self):
+        return self.last_close < self.level * (1 - self.band)
+
+    def short_exit(self):
+        return self.last_close > self.level * (1 + self.band)
+
+    def conditions(self, bars):
+        # vectorized version of the rules above over a whole bar history (backtests),
+        # returns long_entry, long_exit, short_entry, short_exit boolean arrays:
+        close = np.asarray(bars['close'], dtype=float)
+        vwap = vwap_array(bars['high'], bars['low'], close, bars['volume'],
+                          self.vwap.window, self.vwap.fillna)
+        return close > vwap, close < vwap, close < vwap, close > vwap
+
+
+# signal types selectable from the strategy config:
+SIGNALS = {
+    'ema': EMACrossSignal,
+    'vwap': VWAPSignal,
+}
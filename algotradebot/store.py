@@ -0,0 +1,146 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+from ib_insync.objects import BarData
+
+from algotradebot.resample import bar_minutes
+
+# column -> dtype of the raw column files; dates are UTC epoch nanoseconds
+COLUMNS = {
+    'date': np.dtype('int64'),
+    'open': np.dtype('float64'),
+    'high': np.dtype('float64'),
+    'low': np.dtype('float64'),
+    'close': np.dtype('float64'),
+    'volume': np.dtype('float64'),
+    'average': np.dtype('float64'),
+    'barCount': np.dtype('int64'),
+}
+
+
+def _epoch_ns(date):
+    if not isinstance(date, datetime.datetime):
+        # daily bars come as dates
+        date = datetime.datetime(date.year, date.month, date.day, tzinfo=datetime.timezone.utc)
+    elif date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return int(date.timestamp()) * 1_000_000_000
+
+
+def duration_since(last, now):
+    # smallest IB durationStr that covers the time since the last stored bar:
+    seconds = int((now - last).total_seconds()) + 60
+    if seconds <= 86400:
+        return f'{seconds} S'
+    return f'{seconds // 86400 + 1} D'
+
+
+class BarStore:
+    '''
+    Local historical bar store.
+    --------------------------
+    One directory per symbol and bar size under root, holding one raw
+    contiguous file per column (date, open, high, low, close, volume,
+    average, barCount). New bars are appended to the column files, reads are
+    numpy memory maps, so warm up history costs no download and no parsing.
+    update() only asks IB for the bars after the last stored one.
+    '''
+
+    def __init__(self, root='bar_store'):
+        self.root = root
+
+    def path(self, symbol, barSizeSetting):
+        return os.path.join(self.root, symbol, barSizeSetting.replace(' ', '_'))
+
+    def count(self, symbol, barSizeSetting):
+        file = os.path.join(self.path(symbol, barSizeSetting), 'date')
+        return os.path.getsize(file) // COLUMNS['date'].itemsize if os.path.exists(file) else 0
+
+    def read(self, symbol, barSizeSetting):
+        # memory mapped, read only column arrays (dates as datetime64[ns] UTC):
+        n = self.count(symbol, barSizeSetting)
+        path = self.path(symbol, barSizeSetting)
+        columns = {}
+        for column, dtype in COLUMNS.items():
+            if n:
+                columns[column] = np.memmap(os.path.join(path, column), dtype=dtype, mode='r', shape=(n,))
+            else:
+                columns[column] = np.empty(0, dtype=dtype)
+        columns['date'] = columns['date'].view('datetime64[ns]')
+        return columns
+
+    def frame(self, symbol, barSizeSetting):
+        return pd.DataFrame(self.read(symbol, barSizeSetting))
+
+    def last_date(self, symbol, barSizeSetting):
+        n = self.count(symbol, barSizeSetting)
+        if not n:
+            return None
+        last = np.memmap(os.path.join(self.path(symbol, barSizeSetting), 'date'),
+                         dtype=COLUMNS['date'], mode='r', offset=(n - 1) * 8, shape=(1,))
+        return datetime.datetime.fromtimestamp(int(last[0]) / 1e9, datetime.timezone.utc)
+
+    def append(self, symbol, barSizeSetting, bars):
+        '''
+        Appends bars (BarData) newer than the last stored one, returns how
+        many were written.
+        '''
+        last = self.last_date(symbol, barSizeSetting)
+        last_ns = _epoch_ns(last) if last else None
+        rows = [bar for bar in bars if last_ns is None or _epoch_ns(bar.date) > last_ns]
+        if not rows:
+            return 0
+        path = self.path(symbol, barSizeSetting)
+        os.makedirs(path, exist_ok=True)
+        n = self.count(symbol, barSizeSetting)
+        # the date column is written last: it defines how many rows are complete
+        for column in list(COLUMNS)[1:] + ['date']:
+            dtype = COLUMNS[column]
+            if column == 'date':
+                values = np.fromiter((_epoch_ns(bar.date) for bar in rows), dtype, len(rows))
+            else:
+                values = np.fromiter((getattr(bar, column) for bar in rows), dtype, len(rows))
+            with open(os.path.join(path, column), 'ab') as f:
+                # drop a partial write left over from an interrupted append:
+                f.truncate(n * dtype.itemsize)
+                f.write(values.tobytes())
+        return len(rows)
+
+    def bars(self, symbol, barSizeSetting, n):
+        # the last n stored bars as BarData (UTC dates), e.g. to seed the indicators:
+        columns = self.read(symbol, barSizeSetting)
+        start = max(len(columns['date']) - n, 0)
+        dates = columns['date'][start:].astype('int64')
+        return [BarData(date=datetime.datetime.fromtimestamp(date / 1e9, datetime.timezone.utc),
+                        open=float(o), high=float(h), low=float(lo), close=float(c),
+                        volume=float(v), average=float(a), barCount=int(bc))
+                for date, o, h, lo, c, v, a, bc in zip(
+                    dates, columns['open'][start:], columns['high'][start:], columns['low'][start:],
+                    columns['close'][start:], columns['volume'][start:], columns['average'][start:],
+                    columns['barCount'][start:])]
+
+    def update(self, ib, contract, barSizeSetting, durationStr, useRTH=True):
+        return ib.run(self.update_async(ib, contract, barSizeSetting, durationStr, useRTH))
+
+    async def update_async(self, ib, contract, barSizeSetting, durationStr, useRTH=True):
+        '''
+        Downloads the bars missing after the last stored one (the whole
+        durationStr when nothing is stored yet). Only completed bars are
+        stored. Returns the number of new bars.
+        '''
+        now = await ib.reqCurrentTimeAsync()
+        last = self.last_date(contract.symbol, barSizeSetting)
+        bars = await ib.reqHistoricalDataAsync(
+            contract,
+            endDateTime='',
+            durationStr=duration_since(last, now) if last else durationStr,
+            barSizeSetting=barSizeSetting,
+            whatToShow="TRADES",
+            useRTH=useRTH,
+            formatDate=2
+        )
+        length = datetime.timedelta(minutes=bar_minutes(barSizeSetting))
+        completed = [bar for bar in bars if bar.date + length <= now]
+        return self.append(contract.symbol, barSizeSetting, completed)
@@ -0,0 +1,183 @@
+import asyncio
+from time import perf_counter_ns
+
+from algotradebot import journal as events
+from algotradebot.journal import journal
+from algotradebot.metrics import latency
+from algotradebot.orders import OrderTracker
+from algotradebot.trading import place_bracket_order, select_option_contract
+
+_INDICATOR = latency.histogram('indicator')
+_SIGNAL = latency.histogram('signal')
+_ENTRY = latency.histogram('entry')
+# trade tick -> intrabar decision
+_INTRABAR = latency.histogram('intrabar')
+
+
+class Strategy:
+    '''
+    Option trading strategy for one underlying and one bar size.
+    -----------------------------------------------------------
+    On every closed candle the signal is updated and:
+    1. LONG ENTRY: CALL BUY bracket order when signal.long_entry()
+    2. SHORT ENTRY: PUT BUY bracket order when signal.short_entry()
+    and the position is flattened when the matching exit condition is met.
+    The position state is kept by the OrderTracker from the IB order events,
+    so a take profit / stop loss fill frees the strategy for the next entry.
+    Entries run as tasks on the event loop: while one is waiting on IB, the
+    candles of the other symbols keep being evaluated; this strategy decides
+    nothing until the entry is placed. One decision per evaluation at most.
+    on_tick() evaluates the forming candle on every trade tick as well
+    (intrabar mode): a decision is acted on once it held for confirm ticks
+    in a row, with the price at least band (a fraction) beyond the
+    indicator level. The candle close is evaluated as usual.
+    '''
+
+    def __init__(self, ib, stock, signal, barSizeSetting, stop_loss_percent,
+                 profit_booking_percent, qty=1, tradingClass=None, cache=None, ladder=None,
+                 tracker=None, quotes=None, delta=None, params=None, confirm=1, band=0.0,
+                 max_cost=None):
+        self.ib = ib
+        self.stock = stock
+        self.tradingClass = tradingClass or stock.symbol
+        self.signal = signal
+        self.barSizeSetting = barSizeSetting
+        self.stop_loss_percent = stop_loss_percent
+        self.profit_booking_percent = profit_booking_percent
+        self.qty = qty
+        # optional ParameterStore: its stop loss, take profit and qty for the
+        # symbol, read on every entry, take over from the three above
+        self.params = params
+        self.cache = cache
+        self.ladder = ladder
+        # streaming option quotes to price the bracket from
+        self.quotes = quotes
+        # target delta of the option contracts, None: first ITM strike
+        self.delta = delta
+        # highest option price (per share) of the contract picked by the chain pricer
+        self.max_cost = max_cost
+        # intrabar confirmation: ticks in a row and price margin
+        self.confirm = confirm
+        self.band = band
+        # intrabar decision of the last ticks and for how many in a row
+        self._candidate = events.NONE
+        self._count = 0
+        self.tracker = tracker or OrderTracker(ib)
+        # current Bracket (LONG or SHORT side), None when never traded
+        self.position = None
+        # entry task in flight (contract selection + bracket order)
+        self.entry = None
+        self.name = f"{stock.symbol} {barSizeSetting} {type(signal).__name__}"
+
+    def __repr__(self):
+        return self.name
+
+    def seed(self, candles):
+        self.signal.seed(candles)
+        journal.event(f"{self} seeded: {self.signal.values()}")
+
+    def on_bar(self, bar):
+        start = perf_counter_ns()
+        self.signal.update(bar)
+        _INDICATOR.since(start)
+        start = perf_counter_ns()
+        self._candidate, self._count = events.NONE, 0
+        self.evaluate()
+        _SIGNAL.since(start)
+
+    def on_tick(self, candle):
+        # candle: the forming candle, up to the last trade
+        start = perf_counter_ns()
+        self.signal.intrabar(candle, self.band)
+        decision = self.decision()
+        if decision != self._candidate:
+            self._candidate, self._count = decision, 0
+        self._count += 1
+        # acted on once per run of ticks, not again on every following one
+        if decision != events.NONE and self._count == self.confirm:
+            self.evaluate(intrabar=True)
+        _INTRABAR.since(start)
+
+    def entering(self):
+        return self.entry is not None and not self.entry.done()
+
+    def take_over(self, other):
+        # the position (or entry in flight) of the strategy this one replaces
+        self.position, self.entry = other.position, other.entry
+        if other.entry is not None and not other.entry.done():
+            other.entry.add_done_callback(self._entered)
+
+    def _entered(self, entry):
+        # enter() returns the bracket it placed (and never raises)
+        if not entry.cancelled() and entry.result() is not None:
+            self.position = entry.result()
+
+    def holding(self):
+        if self.entering():
+            return True
+        return self.position is not None and self.position.holding
+
+    def decision(self):
+        # at most one decision per evaluation; none while an entry is in
+        # flight: self.position is still the previous bracket then
+        signal = self.signal
+        position = self.position
+        if self.entering():
+            return events.NONE
+        if position is None or not position.holding:
+            if signal.long_entry():
+                return events.LONG_ENTRY
+            if signal.short_entry():
+                return events.SHORT_ENTRY
+        elif position.side == 'LONG' and signal.long_exit():
+            return events.LONG_EXIT
+        elif position.side == 'SHORT' and signal.short_exit():
+            return events.SHORT_EXIT
+        return events.NONE
+
+    def evaluate(self, intrabar=False):
+        decision = self.decision()
+
+        ##### CALLS ####
+        if decision == events.LONG_ENTRY:
+            self.entry = asyncio.ensure_future(self.enter('LONG', 'C', 'BUY'))
+        elif decision == events.LONG_EXIT:
+            self.tracker.flatten(self.position)
+
+        ##### PUTS ####
+        elif decision == events.SHORT_ENTRY:
+            self.entry = asyncio.ensure_future(self.enter('SHORT', 'P', 'BUY'))
+        elif decision == events.SHORT_EXIT:
+            self.tracker.flatten(self.position)
+
+        # every candle close is journaled, the ticks only when they decide something
+        if not intrabar or decision != events.NONE:
+            journal.signal(self.name, decision, self.signal.values())
+
+    def bracket_parameters(self):
+        if self.params is None:
+            return self.stop_loss_percent, self.profit_booking_percent, self.qty
+        params = self.params.get(self.stock.symbol)
+        return params.stop_loss_percent, params.profit_booking_percent, params.qty
+
+    async def enter(self, side, right, action):
+        start = perf_counter_ns()
+        try:
+            option_contract = await select_option_contract(
+                self.ib, self.stock, right, self.tradingClass, cache=self.cache, ladder=self.ladder,
+                delta=self.delta, max_cost=self.max_cost)
+            if option_contract is None:
+                return None
+            stop_loss_percent, profit_booking_percent, qty = self.bracket_parameters()
+            entry_trades = await place_bracket_order(
+                self.ib, option_contract, action, qty,
+                stop_loss_percent, profit_booking_percent, cache=self.cache,
+                quotes=self.quotes)
+        except Exception as e:
+            # a failed entry must not take the event loop (and the other symbols) down
+            journal.event(f"{self} entry failed: {e!r}")
+            return None
+        _ENTRY.since(start)
+        self.position = self.tracker.track(side, option_contract, action, entry_trades,
+                                           placed=perf_counter_ns())
+        return self.position
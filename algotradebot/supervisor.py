@@ -0,0 +1,110 @@
+import asyncio
+from time import perf_counter_ns
+
+from ib_insync import Event
+
+from algotradebot.journal import journal
+from algotradebot.metrics import latency
+
+# connection lost -> reconnected and resumed
+_RECOVERY = latency.histogram('recovery')
+
+
+class ConnectionSupervisor:
+    '''
+    Keeps the IB connection up.
+    --------------------------
+    A drop shows up as disconnectedEvent (socket closed, TWS restart) or as
+    a heartbeat (reqCurrentTime every heartbeat seconds) not answered
+    within timeout, which is taken as a dead connection and closed. The
+    supervisor then reconnects with exponential backoff (backoff seconds,
+    doubling up to max_backoff) for as long as it takes, and once connected
+    awaits resume(), e.g. StrategyRunner.resume_async: re-subscribing the
+    bars and tickers, backfilling the missed bars and re-syncing the orders
+    and positions. Each recovery is journaled, its time recorded and
+    recoveredEvent(seconds) emitted.
+    ib is the IB connection itself, not a PacedIB: the heartbeat must not
+    wait in the request queue behind a backfill.
+    '''
+
+    def __init__(self, ib, host, port, clientId, resume=None, heartbeat=10, timeout=5,
+                 backoff=1, max_backoff=30):
+        self.ib = ib
+        self.host = host
+        self.port = port
+        self.clientId = clientId
+        self.resume = resume
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # recoveries so far
+        self.reconnects = 0
+        self._lost_at = None
+        self._task = None
+        self._heartbeat = None
+        self.recoveredEvent = Event('recoveredEvent')
+
+    def start(self):
+        self.ib.disconnectedEvent += self._on_disconnected
+        if self.heartbeat:
+            self._heartbeat = asyncio.ensure_future(self._beat())
+
+    def stop(self):
+        # before an intended disconnect, which must not be recovered from
+        self.ib.disconnectedEvent -= self._on_disconnected
+        for task in (self._task, self._heartbeat):
+            if task is not None:
+                task.cancel()
+
+    def recovering(self):
+        return self._task is not None and not self._task.done()
+
+    def _on_disconnected(self):
+        if self.recovering():
+            return
+        self._lost_at = perf_counter_ns()
+        journal.event("IB connection lost")
+        self._task = asyncio.ensure_future(self._recover())
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            if self.recovering():
+                continue
+            if not self.ib.isConnected():
+                self._on_disconnected()
+                continue
+            try:
+                await asyncio.wait_for(self.ib.reqCurrentTimeAsync(), self.timeout)
+            except (asyncio.TimeoutError, ConnectionError) as e:
+                journal.event(f"IB heartbeat failed: {e!r}")
+                # disconnectedEvent starts the recovery
+                self.ib.disconnect()
+                if not self.recovering():
+                    self._on_disconnected()
+
+    async def _recover(self):
+        delay = self.backoff
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                await self.ib.connectAsync(self.host, self.port, clientId=self.clientId, timeout=self.timeout)
+                break
+            except (OSError, asyncio.TimeoutError, ConnectionError) as e:
+                journal.event(f"IB reconnect attempt {attempt} failed: {e!r}, next in {delay:g}s")
+                # a half open connection would refuse the next attempt
+                self.ib.disconnect()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        try:
+            if self.resume is not None:
+                await self.resume()
+        except Exception as e:
+            journal.event(f"IB resume after reconnect failed: {e!r}")
+        self.reconnects += 1
+        _RECOVERY.since(self._lost_at)
+        seconds = (perf_counter_ns() - self._lost_at) / 1e9
+        journal.event(f"IB connection recovered in {seconds:.2f}s ({attempt} attempts)")
+        self.recoveredEvent.emit(seconds)
@@ -0,0 +1,131 @@
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from algotradebot.backtest import load_bars, resample_bars, simulate, summary
+from algotradebot.signals import EMACrossSignal, VWAPSignal
+from algotradebot.store import BarStore
+
+BAR_COLUMNS = ('date', 'high', 'low', 'close', 'volume')
+
+# bar arrays of the worker process, attached to the parent's shared memory:
+_bars = None
+_segments = []
+
+
+def share_bars(bars):
+    '''
+    Copies the bar columns once into shared memory blocks. Returns the blocks
+    (kept by the parent, unlinked when done) and the layout for the workers.
+    '''
+    blocks, layout = [], {}
+    for column in BAR_COLUMNS:
+        values = bars[column].to_numpy()
+        if column == 'date':
+            values = values.astype('datetime64[ns]').view('int64')
+        values = np.ascontiguousarray(values, dtype='int64' if column == 'date' else 'float64')
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, values.dtype, buffer=block.buf)[:] = values
+        blocks.append(block)
+        layout[column] = (block.name, values.shape, values.dtype.str)
+    return blocks, layout
+
+
+def _attach(layout):
+    # worker initializer: zero copy numpy views on the shared bar columns
+    global _bars
+    _bars = {}
+    for column, (name, shape, dtype) in layout.items():
+        block = shared_memory.SharedMemory(name=name)
+        _segments.append(block)
+        values = np.ndarray(shape, dtype, buffer=block.buf)
+        _bars[column] = values.view('datetime64[ns]') if column == 'date' else values
+    return _bars
+
+
+def _make_signal(signal, params):
+    if signal == 'ema':
+        return EMACrossSignal(fast=params['fast'], slow=params['slow'])
+    return VWAPSignal(window=params['vwap_window'])
+
+
+def _run(signal, params, brackets):
+    # one signal configuration: conditions once, then every stop loss / take profit pair
+    conditions = _make_signal(signal, params).conditions(_bars)
+    results = []
+    for stop_loss_percent, profit_booking_percent in brackets:
+        trades = simulate(_bars, conditions, stop_loss_percent, profit_booking_percent)
+        results.append(dict(params, stop_loss_percent=stop_loss_percent,
+                            profit_booking_percent=profit_booking_percent, **summary(trades)))
+    return results
+
+
+def sweep(bars, signal, stop_losses, take_profits, fast=(4,), slow=(55,), vwap_windows=(3,),
+          processes=None):
+    '''
+    Parameter sweep.
+    ---------------
+    Backtests every combination of the grids on a process pool. The bar
+    columns are shared with the workers through shared memory (no pickling
+    of the data), each task is one signal configuration that is run for all
+    the stop loss / take profit pairs. Returns the results ranked by total
+    return.
+    '''
+    if signal == 'ema':
+        configs = [{'fast': f, 'slow': s} for f, s in itertools.product(fast, slow) if f < s]
+    else:
+        configs = [{'vwap_window': w} for w in vwap_windows]
+    brackets = list(itertools.product(stop_losses, take_profits))
+
+    blocks, layout = share_bars(bars)
+    try:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(),
+                                 initializer=_attach, initargs=(layout,)) as pool:
+            futures = [pool.submit(_run, signal, params, brackets) for params in configs]
+            results = [row for future in futures for row in future.result()]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    results = pd.DataFrame(results)
+    return results.sort_values('total_return_percent', ascending=False).reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='algotradebot.sweep',
+                                     description="Stop loss / take profit / indicator window sweep")
+    parser.add_argument('bars', help="csv or parquet bar file (date, open, high, low, close, volume), "
+                                     "or the symbol with --bar-store")
+    parser.add_argument('--bar-store', help="read the 1 min bars of the symbol from this bar store")
+    parser.add_argument('--bar-size', default='15 mins')
+    parser.add_argument('--signal', choices=['ema', 'vwap'], default='ema')
+    parser.add_argument('--stop-loss', type=float, nargs='+', default=[50])
+    parser.add_argument('--take-profit', type=float, nargs='+', default=[100])
+    parser.add_argument('--fast', type=int, nargs='+', default=[4], help="fast EMA windows")
+    parser.add_argument('--slow', type=int, nargs='+', default=[55], help="slow EMA windows")
+    parser.add_argument('--vwap-window', type=int, nargs='+', default=[3])
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--output', default='sweep_results.csv')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.bar_store:
+        bars = BarStore(args.bar_store).frame(args.bars, '1 min')
+    else:
+        bars = load_bars(args.bars)
+    bars = resample_bars(bars, args.bar_size)
+    results = sweep(bars, args.signal, args.stop_loss, args.take_profit, args.fast, args.slow,
+                    args.vwap_window, args.processes)
+    results.to_csv(args.output, index=False)
+    print(f"{len(results)} backtests in {time.perf_counter() - start:.1f}s, results in {args.output}")
+    print(results.head(10).to_string())
+
+
+if __name__ == '__main__':
+    main()
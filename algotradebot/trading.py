@@ -0,0 +1,119 @@
+import asyncio
+import math
+from decimal import Decimal
+from time import perf_counter_ns
+
+from algotradebot.chains import OptionChainCache
+from algotradebot.journal import journal
+from algotradebot.metrics import latency
+from algotradebot.params import ParameterStore
+from algotradebot.quotes import quote_price
+
+_CHAIN = latency.histogram('chain')
+_ORDER = latency.histogram('order')
+
+
+def load_parameters(path='Yaz_Trading_Bot_Parameters.csv'):
+    # Stop-Loss % and Take Profit % from the parameters csv (global values):
+    params = ParameterStore(path).get()
+    return params.stop_loss_percent, params.profit_booking_percent
+
+
+# function for rounding strike prices:
+def roundStrikePrice(x, base=5):
+    return base * round(x/base)
+
+
+async def select_option_contract(ib, stock, right, tradingClass=None, exchange='SMART', cache=None,
+                                 ladder=None, delta=None, max_cost=None):
+    '''
+    First ITM option contract of the next weekly expiry for the underlying.
+    CALLS take the strike below the rounded market price, PUTS the rounded one.
+    Picked from the strike ladder when it is ready, otherwise looked up with a
+    ticker snapshot; chains and qualified contracts come from the cache.
+    With a target delta and / or a max_cost (option price per share, and a
+    ladder) the contract is the one the ladder's chain pricer picks instead:
+    the closest delta, the highest one without a target, among the
+    contracts costing at most max_cost. The first ITM fallback does not
+    know the prices: none with a max_cost.
+    Returns None when no contract could be qualified.
+    '''
+    if ladder is not None:
+        start = perf_counter_ns()
+        if delta is None and max_cost is None:
+            option_contract = ladder.itm_contract(right)
+        else:
+            option_contract = await ladder.delta_contract(right, delta, max_cost)
+        if option_contract is not None:
+            _CHAIN.since(start)
+            return option_contract
+    if max_cost is not None:
+        journal.event(f"{stock.symbol} no {right} contract priced at most {max_cost:g}")
+        return None
+    cache = cache or OptionChainCache(ib)
+    # Switch to live (1) frozen (2) delayed (3) delayed frozen (4).
+    ib.reqMarketDataType(1)
+    # The ticker (which can take up to 11 seconds) and the chain are independent:
+    [ticker], expirations = await asyncio.gather(
+        latency.timed('ticker', ib.reqTickersAsync(stock)),
+        latency.timed('chain', cache.expirations_async(stock, tradingClass, exchange)))
+    journal.ticker(ticker)
+    CurrentStrike = ticker.marketPrice()
+    # taking first ITM strike:
+    if right == 'C':
+        strikes = [roundStrikePrice(CurrentStrike) - 5]
+    else:
+        strikes = [roundStrikePrice(CurrentStrike)]
+    # selecting next 3 week expiry of the weekly options trading on SMART:
+    expirations = expirations[:3]
+    # the 3 expirations are qualified concurrently:
+    option_contracts = await latency.timed('qualify', cache.get_contracts_async(
+        stock.symbol, expirations, strikes, [right], tradingClass, exchange))
+    if not option_contracts:
+        journal.event(f"{stock.symbol} no {right} contract for {strikes} {expirations}")
+    return option_contracts[0] if option_contracts else None
+
+
+def round_to_tick(price, minTick, rounding=round):
+    # price on the minTick grid, rounding: round, math.floor or math.ceil
+    dps = max(-Decimal(str(minTick)).as_tuple().exponent, 0)
+    # round(..., 6) absorbs the float error of the division (2.05 / 0.05 = 40.99999...)
+    return round(rounding(round(price / minTick, 6)) * minTick, dps)
+
+
+async def place_bracket_order(ib, option_contract, action, qty, stop_loss_percent, profit_booking_percent,
+                              cache=None, quotes=None):
+    '''
+    Bracket order (limit entry, take profit and stop loss) around the live
+    mid price of the option: read from the streaming quotes when the
+    contract is subscribed, from a ticker snapshot otherwise. The entry
+    limit is the mid on the passive side of the tick grid. Returns the list
+    of placed trades.
+    '''
+    cache = cache or OptionChainCache(ib)
+    ticker = quotes.ticker(option_contract) if quotes is not None else None
+    if ticker is not None:
+        minTick = await latency.timed('min_tick', cache.min_tick_async(option_contract))
+    else:
+        # Switch to live (1) frozen (2) delayed (3) delayed frozen (4).
+        ib.reqMarketDataType(1)
+        [ticker], minTick = await asyncio.gather(
+            latency.timed('ticker', ib.reqTickersAsync(option_contract)),
+            latency.timed('min_tick', cache.min_tick_async(option_contract)))
+    journal.ticker(ticker)
+    CurrentValue = quote_price(ticker)
+    if not CurrentValue > 0:
+        raise ValueError(f"no price for {option_contract.localSymbol}")
+    lmtPrice = round_to_tick(CurrentValue, minTick, math.floor if action == 'BUY' else math.ceil)
+    # building order
+    entry_order = ib.bracketOrder(
+        action,
+        qty,
+        limitPrice=lmtPrice,
+        takeProfitPrice=round_to_tick(lmtPrice + lmtPrice*(profit_booking_percent/100), minTick),
+        stopLossPrice=round_to_tick(lmtPrice - lmtPrice*(stop_loss_percent/100), minTick)
+    )
+    start = perf_counter_ns()
+    entry_trades = [ib.placeOrder(option_contract, o) for o in entry_order]
+    _ORDER.since(start)
+    return entry_trades
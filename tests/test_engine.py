@@ -0,0 +1,69 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+from ib_insync.contract import Stock
+
+from algotradebot.engine import BarEngine
+from algotradebot.mock import MockIB
+
+
+@pytest.fixture(autouse=True)
+def loop():
+    # ib_insync runs on the current event loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def mock_ib(n=60, history=30):
+    dates = pd.date_range('2025-01-02 14:30', periods=n, freq='1min', tz='UTC')
+    close = 100 + np.arange(n) * 0.1
+    ib = MockIB({'TSLA': pd.DataFrame({'date': dates, 'open': close, 'high': close, 'low': close,
+                                       'close': close, 'volume': np.full(n, 10.0)})}, history=history)
+    ib.connect()
+    return ib
+
+
+def reconnect(ib):
+    # the subscriptions go with the connection
+    ib.subscriptions = []
+    ib.disconnect()
+    ib.connect()
+
+
+@pytest.mark.parametrize('capacity', [None, 100])
+def test_resume_backfills_the_missed_bars(capacity):
+    ib = mock_ib()
+    engine = BarEngine(ib, Stock('TSLA', 'SMART', 'USD'), '1 min', '1 D', capacity=capacity, formatDate=2)
+    closed = []
+    engine.barCloseEvent += lambda bars, bar: closed.append(bar.date)
+    engine.start()
+    reconnect(ib)
+    # three bars close while nothing comes in
+    for _ in range(3):
+        ib.step()
+    missed = ib.run(engine.resume_async())
+    assert [bar.date for bar in missed] == ib.dates[30:33]
+    ib.sleep(60)
+    assert closed == ib.dates[30:34]
+    assert [bar.date for bar in engine.completed_bars()] == ib.dates[:34]
+
+
+@pytest.mark.parametrize('capacity', [None, 100])
+def test_resume_with_only_the_forming_bar_subscribes_again(capacity):
+    # '60 S': the history is the forming candle alone
+    ib = mock_ib()
+    engine = BarEngine(ib, Stock('TSLA', 'SMART', 'USD'), '1 min', '60 S', capacity=capacity, formatDate=2)
+    closed = []
+    engine.barCloseEvent += lambda bars, bar: closed.append(bar.date)
+    engine.start()
+    assert not len(engine.completed_bars())
+    reconnect(ib)
+    assert ib.run(engine.resume_async()) == []
+    assert len(ib.subscriptions) == 1
+    ib.sleep(2 * 60)
+    assert closed == ib.dates[30:32]
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from algotradebot.indicators import EMA, VWAP, ema_array, vwap_array
+
+# the reference implementation the bots used before the streaming indicators
+ema_indicator = pytest.importorskip('ta.trend').ema_indicator
+VolumeWeightedAveragePrice = pytest.importorskip('ta.volume').VolumeWeightedAveragePrice
+
+TOLERANCE = 1e-9
+
+
+@pytest.fixture
+def bars():
+    rng = np.random.default_rng(7)
+    close = 200 + np.cumsum(rng.normal(0, 0.5, 500))
+    spread = rng.uniform(0.05, 1.0, 500)
+    volume = rng.integers(0, 5000, 500).astype(float)
+    # a stretch without volume (halt, pre market)
+    volume[100:106] = 0
+    return pd.DataFrame({'high': close + spread, 'low': close - spread, 'close': close, 'volume': volume})
+
+
+def assert_close(actual, expected):
+    np.testing.assert_allclose(np.asarray(actual, dtype=float), np.asarray(expected, dtype=float),
+                               rtol=TOLERANCE, atol=TOLERANCE, equal_nan=True)
+
+
+@pytest.mark.parametrize('window', [4, 55])
+@pytest.mark.parametrize('fillna', [False, True])
+def test_ema_matches_ta(bars, window, fillna):
+    expected = ema_indicator(bars['close'], window, fillna).to_numpy()
+    ema = EMA(window, fillna)
+    peeked, streamed = [], []
+    for close in bars['close']:
+        peeked.append(ema.peek(close))
+        # peek() leaves the state alone
+        assert ema.peek(close) == peeked[-1] or np.isnan(peeked[-1])
+        streamed.append(ema.update(close))
+    assert_close(streamed, expected)
+    assert_close(peeked, expected)
+    assert_close(ema_array(bars['close'], window, fillna), expected)
+
+
+@pytest.mark.parametrize('window', [3, 14])
+@pytest.mark.parametrize('fillna', [False, True])
+def test_vwap_matches_ta(bars, window, fillna):
+    expected = VolumeWeightedAveragePrice(bars['high'], bars['low'], bars['close'], bars['volume'], window,
+                                          fillna).volume_weighted_average_price().to_numpy()
+    vwap = VWAP(window, fillna)
+    peeked, streamed = [], []
+    for high, low, close, volume in bars[['high', 'low', 'close', 'volume']].itertuples(index=False):
+        peeked.append(vwap.peek(high, low, close, volume))
+        streamed.append(vwap.update(high, low, close, volume))
+    assert_close(streamed, expected)
+    assert_close(peeked, expected)
+    assert_close(vwap_array(bars['high'], bars['low'], bars['close'], bars['volume'], window, fillna), expected)
+
+
+def test_seed_then_stream_matches_streaming_throughout(bars):
+    # seeded from the history, then updated per candle: same values as streaming from the start
+    ema, vwap = EMA(55), VWAP(3)
+    ema.seed(bars['close'][:300])
+    vwap.seed(bars[:300])
+    expected_ema = ema_indicator(bars['close'], 55).to_numpy()
+    expected_vwap = VolumeWeightedAveragePrice(bars['high'], bars['low'], bars['close'], bars['volume'], 3,
+                                               True).volume_weighted_average_price().to_numpy()
+    for i, (high, low, close, volume) in enumerate(bars[['high', 'low', 'close', 'volume']].itertuples(index=False)):
+        if i < 300:
+            continue
+        assert_close(ema.update(close), expected_ema[i])
+        assert_close(vwap.update(high, low, close, volume), expected_vwap[i])
@@ -0,0 +1,106 @@
+import datetime
+import math
+
+from ib_insync.contract import Option
+from ib_insync.objects import BarData
+from ib_insync.order import LimitOrder, OrderStatus, Trade
+
+from algotradebot.journal import LONG_ENTRY, MAGIC, NONE, Journal, read_journal
+from algotradebot.params import Parameters
+
+DATE = datetime.datetime(2025, 1, 2, 14, 30, tzinfo=datetime.timezone.utc)
+
+
+def bar(minute, close):
+    return BarData(date=DATE + datetime.timedelta(minutes=minute), open=close - 1, high=close + 1, low=close - 2,
+                   close=close, volume=1000.0, average=close, barCount=7)
+
+
+def trade():
+    contract = Option('TSLA', '20250103', 200.0, 'C', 'SMART', conId=11, localSymbol='TSLA  250103C00200000')
+    order = LimitOrder('BUY', 2, 3.25, orderId=5)
+    return Trade(contract, order, OrderStatus(orderId=5, status='Submitted', remaining=2))
+
+
+def record(path):
+    journal = Journal().open(path)
+    journal.history('TSLA', [bar(0, 200.0), bar(1, 201.0)])
+    journal.bar('TSLA', bar(2, 202.0))
+    journal.signal('TSLA 1 min VWAPSignal', NONE, {'last_close': 202.0, 'vwap': 201.5})
+    journal.signal('TSLA 3 mins EMACrossSignal', LONG_ENTRY, {'last_close': 202.0, 'ema_fast': 201.0,
+                                                              'ema_slow': 200.0})
+    journal.order(trade(), 'entry')
+    journal.status(trade())
+    journal.strategy('TSLA', 'TSLA', '3 mins', 'ema', 2, None, 50.0, 100.0, max_cost=4.0)
+    journal.parameters('TSLA', Parameters(50.0, 100.0, qty=2, ema_slow=30))
+    journal.event("TSLA warmed up")
+    journal.close()
+
+
+def test_records_read_back(tmp_path):
+    path = str(tmp_path / 'session.journal')
+    record(path)
+    frames = read_journal(path)
+    history, bars = frames['history'], frames['bars']
+    assert list(history['close']) == [200.0, 201.0]
+    assert list(history['symbol']) == ['TSLA', 'TSLA']
+    assert bars['date'][0] == DATE + datetime.timedelta(minutes=2)
+    assert (bars['high'][0], bars['barCount'][0]) == (203.0, 7)
+    signals = frames['signals']
+    assert list(signals['decision']) == ['', 'long_entry']
+    assert list(signals['strategy']) == ['TSLA 1 min VWAPSignal', 'TSLA 3 mins EMACrossSignal']
+    assert signals['value1'][0] == 201.5 and math.isnan(signals['value2'][0])
+    assert signals['value2'][1] == 200.0
+    order = frames['orders'].iloc[0]
+    assert (order.orderId, order.conId, order.contract, order.leg) == (5, 11, 'TSLA  250103C00200000', 'entry')
+    assert (order.action, order.orderType, order.qty, order.lmtPrice) == ('BUY', 'LMT', 2.0, 3.25)
+    # unset order prices
+    assert math.isnan(order.auxPrice)
+    assert frames['statuses'].iloc[0].status == 'Submitted'
+    strategy = frames['strategies'].iloc[0]
+    assert (strategy.barSizeSetting, strategy.signal, strategy.qty, strategy.max_cost) == ('3 mins', 'ema', 2, 4.0)
+    assert math.isnan(strategy.delta)
+    parameters = frames['parameters'].iloc[0]
+    assert (parameters.barSizeSetting, parameters.ema_slow, parameters.ema_fast) == ('', 30, 0)
+    assert list(frames['events']['text']) == ["TSLA warmed up"]
+    # in recording order across the kinds
+    seqs = [frame['seq'] for frame in frames.values() if len(frame)]
+    assert sorted(seq for frame in seqs for seq in frame) == list(range(1, sum(map(len, seqs)) + 1))
+
+
+def test_sessions_append_to_the_file(tmp_path):
+    path = str(tmp_path / 'session.journal')
+    record(path)
+    journal = Journal().open(path)
+    journal.event("second session")
+    journal.bar('MSFT', bar(3, 400.0))
+    journal.close()
+    with open(path, 'rb') as f:
+        assert f.read().count(MAGIC) == 1
+    frames = read_journal(path)
+    assert list(frames['bars']['session']) == [0, 1]
+    # string ids start over in a session
+    assert list(frames['bars']['symbol']) == ['TSLA', 'MSFT']
+    last = read_journal(path, session=-1)
+    assert list(last['events']['text']) == ["second session"]
+    assert len(last['history']) == 0
+    first = read_journal(path, session=0)
+    assert list(first['events']['text']) == ["TSLA warmed up"]
+
+
+def test_block_cut_short_ends_the_read(tmp_path):
+    path = str(tmp_path / 'session.journal')
+    record(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-5])
+    frames = read_journal(path)
+    assert list(frames['history']['close']) == [200.0, 201.0]
+
+
+def test_nothing_recorded_until_opened():
+    journal = Journal()
+    journal.bar('TSLA', bar(0, 200.0))
+    journal.event("not recorded")
+    assert not journal.recording and not journal._queue
@@ -0,0 +1,97 @@
+from ib_insync import Event
+from ib_insync.contract import Option
+from ib_insync.order import LimitOrder, OrderStatus, StopOrder, Trade
+
+from algotradebot.orders import CLOSED, EXIT, EXITING, OrderTracker
+
+
+class AsyncCancelIB:
+    # cancels are requests only, the statuses come when the test sends them
+    def __init__(self):
+        self.orderStatusEvent = Event('orderStatusEvent')
+        self.execDetailsEvent = Event('execDetailsEvent')
+        self.positionEvent = Event('positionEvent')
+        self.cancelled = []
+        self.placed = []
+        self._ids = iter(range(100, 200))
+
+    def placeOrder(self, contract, order):
+        order.orderId = next(self._ids)
+        trade = Trade(contract, order, OrderStatus(orderId=order.orderId, status='Submitted',
+                                                   remaining=order.totalQuantity))
+        self.placed.append(trade)
+        return trade
+
+    def cancelOrder(self, order):
+        self.cancelled.append(order.orderId)
+
+    def status(self, trade, status, filled=0):
+        trade.orderStatus.status = status
+        trade.orderStatus.filled = filled
+        trade.orderStatus.remaining = trade.order.totalQuantity - filled
+        self.orderStatusEvent.emit(trade)
+
+
+def bracket_trades(contract, qty=2):
+    orders = (LimitOrder('BUY', qty, 5.0, orderId=1), LimitOrder('SELL', qty, 10.0, orderId=2, parentId=1),
+              StopOrder('SELL', qty, 2.5, orderId=3, parentId=1))
+    return [Trade(contract, order, OrderStatus(orderId=order.orderId, status='Submitted', remaining=qty))
+            for order in orders]
+
+
+def pending_bracket():
+    ib = AsyncCancelIB()
+    tracker = OrderTracker(ib)
+    contract = Option('TSLA', '20240119', 200, 'C', 'SMART', conId=42, localSymbol='TSLA C200')
+    trades = bracket_trades(contract)
+    return ib, tracker, tracker.track('LONG', contract, 'BUY', trades), trades
+
+
+def test_flatten_pending_keeps_tracking_until_entry_cancelled():
+    ib, tracker, bracket, (entry, take_profit, stop_loss) = pending_bracket()
+    tracker.flatten(bracket)
+    assert bracket.state == EXITING
+    assert ib.cancelled == [1, 2, 3]
+    assert not ib.placed
+
+    ib.status(entry, 'Cancelled')
+    ib.status(take_profit, 'Cancelled')
+    ib.status(stop_loss, 'Cancelled')
+    assert bracket.state == CLOSED
+    assert not ib.placed
+    assert not tracker.legs
+
+
+def test_flatten_pending_entry_filling_before_cancel_is_exited():
+    ib, tracker, bracket, (entry, take_profit, stop_loss) = pending_bracket()
+    tracker.flatten(bracket)
+
+    # the entry fills (partly, then fully) before the cancel lands
+    ib.status(entry, 'Submitted', filled=1)
+    assert bracket.state == EXITING
+    assert [(t.order.action, t.order.orderType, t.order.totalQuantity) for t in ib.placed] == [('SELL', 'MKT', 1)]
+    ib.status(entry, 'Filled', filled=2)
+    assert [t.order.totalQuantity for t in ib.placed] == [1, 1]
+    assert bracket.exited == 2
+
+    ib.status(take_profit, 'Cancelled')
+    ib.status(stop_loss, 'Cancelled')
+    ib.status(ib.placed[0], 'Filled', filled=1)
+    assert bracket.state == EXITING
+    ib.status(ib.placed[1], 'Filled', filled=1)
+    assert bracket.state == CLOSED
+
+
+def test_flatten_open_exits_the_filled_quantity():
+    ib, tracker, bracket, (entry, take_profit, stop_loss) = pending_bracket()
+    ib.status(entry, 'Filled', filled=2)
+    tracker.flatten(bracket)
+    assert ib.cancelled == [2, 3]
+    assert bracket.trades[EXIT].order.totalQuantity == 2
+
+    # the cancels landing first must not close it with the exit working
+    ib.status(take_profit, 'Cancelled')
+    ib.status(stop_loss, 'Cancelled')
+    assert bracket.state == EXITING
+    ib.status(bracket.trades[EXIT], 'Filled', filled=2)
+    assert bracket.state == CLOSED
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+from algotradebot.pacing import HISTORICAL, MARKET_DATA, REFERENCE, RequestScheduler
+
+
+async def answer(value):
+    return value
+
+
+def test_urgent_request_not_held_behind_paced_historical_head():
+    async def run():
+        # one historical request, then the next one every 10s
+        scheduler = RequestScheduler(historical_rate=0.1, historical_burst=1)
+        assert await scheduler.request(HISTORICAL, answer, 'first', historical=True) == 'first'
+        waiting = asyncio.ensure_future(scheduler.request(HISTORICAL, answer, 'second', historical=True))
+        await asyncio.sleep(0.05)
+        assert scheduler.depth()['historical'] == 1
+
+        start = time.monotonic()
+        reference = await asyncio.wait_for(scheduler.request(REFERENCE, answer, 'reference'), 1)
+        clock = await asyncio.wait_for(scheduler.request(MARKET_DATA, answer, 'clock'), 1)
+        elapsed = time.monotonic() - start
+
+        assert (reference, clock) == ('reference', 'clock')
+        assert elapsed < 0.5
+        # the historical head is still waiting on its token
+        assert not waiting.done()
+        waiting.cancel()
+
+    asyncio.run(run())
+
+
+def test_identical_requests_in_flight_are_coalesced():
+    calls = []
+
+    async def details(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    async def run():
+        scheduler = RequestScheduler()
+        return await asyncio.gather(*(scheduler.request(REFERENCE, details, 'AAPL', key=('details', 'AAPL'))
+                                      for _ in range(3)))
+
+    assert asyncio.run(run()) == ['AAPL'] * 3
+    assert calls == ['AAPL']
@@ -0,0 +1,51 @@
+import numpy as np
+
+from algotradebot.pricer import ChainPricer, expiry_time
+
+EXPIRATIONS = ['20250110', '20250117']
+STRIKES = [90.0, 95.0, 100.0, 105.0, 110.0]
+
+
+def valued(spot=100.0):
+    pricer = ChainPricer('TEST', EXPIRATIONS, STRIKES)
+    # a week before the first expiry
+    return pricer.value(spot, expiry_time(EXPIRATIONS[0]) - 7 * 86400)
+
+
+def test_pick_closest_delta():
+    pricer = valued()
+    expiry, strike = pricer.pick('C', 0.6)
+    i, j = EXPIRATIONS.index(expiry), STRIKES.index(strike)
+    assert abs(pricer.delta[0, i, j] - 0.6) == np.abs(pricer.delta[0] - 0.6).min()
+    expiry, strike = pricer.pick('P', 0.6)
+    i, j = EXPIRATIONS.index(expiry), STRIKES.index(strike)
+    assert pricer.delta[1, i, j] < 0
+    assert abs(abs(pricer.delta[1, i, j]) - 0.6) == np.abs(np.abs(pricer.delta[1]) - 0.6).min()
+
+
+def test_pick_with_max_cost_only_takes_contracts_priced_below_it():
+    pricer = valued()
+    unlimited = pricer.pick('C', 0.9)
+    i, j = EXPIRATIONS.index(unlimited[0]), STRIKES.index(unlimited[1])
+    max_cost = pricer.price[0, i, j] / 2
+    expiry, strike = pricer.pick('C', 0.9, max_cost=max_cost)
+    i, j = EXPIRATIONS.index(expiry), STRIKES.index(strike)
+    assert pricer.price[0, i, j] <= max_cost
+    # the closest delta among the affordable ones
+    affordable = pricer.price[0] <= max_cost
+    assert abs(pricer.delta[0, i, j] - 0.9) == np.abs(pricer.delta[0] - 0.9)[affordable].min()
+
+
+def test_pick_without_target_takes_the_highest_delta_within_max_cost():
+    pricer = valued()
+    expiry, strike = pricer.pick('C', max_cost=3.0)
+    i, j = EXPIRATIONS.index(expiry), STRIKES.index(strike)
+    assert pricer.price[0, i, j] <= 3.0
+    assert pricer.delta[0, i, j] == pricer.delta[0][pricer.price[0] <= 3.0].max()
+
+
+def test_pick_none_when_nothing_is_cheap_enough():
+    pricer = valued()
+    assert pricer.pick('C', 0.5, max_cost=0.0) is None
+    assert pricer.pick('C', 0.5, max_cost=pricer.price[0].max(), expiry_index=1) is not None
+
@@ -0,0 +1,81 @@
+import asyncio
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from algotradebot.journal import journal
+from algotradebot.mock import MockIB
+from algotradebot.replay import diff, replay
+from algotradebot.runner import StrategyRunner
+
+
+@pytest.fixture(autouse=True)
+def loop():
+    # ib_insync runs on the current event loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def signals(*rows):
+    return pd.DataFrame(rows, columns=['strategy', 'decision', 'last_close', 'value1', 'value2'])
+
+
+def orders(*rows):
+    return pd.DataFrame(rows, columns=['contract', 'leg', 'action', 'orderType', 'qty', 'lmtPrice', 'auxPrice'])
+
+
+ENTRY = ('TSLA 250103C00200000', 'entry', 'BUY', 'LMT', 1.0, 3.25, math.nan)
+STOP = ('TSLA 250103C00200000', 'stop_loss', 'SELL', 'STP', 1.0, math.nan, 1.6)
+
+
+def test_same_sessions_have_no_differences():
+    session = {'signals': signals(('TSLA 1 min VWAPSignal', '', 200.0, 199.5, math.nan)),
+               'orders': orders(ENTRY, STOP)}
+    differences = diff(session, {name: frame.copy() for name, frame in session.items()})
+    # NaN is the same as NaN
+    assert len(differences['signals']) == 0 and len(differences['orders']) == 0
+
+
+def test_differing_records_side_by_side():
+    recorded = {'signals': signals(('TSLA 1 min VWAPSignal', '', 200.0, 199.5, math.nan),
+                                   ('TSLA 1 min VWAPSignal', 'long_entry', 201.0, 200.0, math.nan)),
+                'orders': orders(ENTRY, STOP)}
+    replayed = {'signals': signals(('TSLA 1 min VWAPSignal', '', 200.0, 199.5, math.nan),
+                                   ('TSLA 1 min VWAPSignal', '', 201.0, 200.0, math.nan)),
+                'orders': orders(ENTRY)}
+    differences = diff(recorded, replayed)
+    signal, = differences['signals'].itertuples()
+    assert signal.Index == 1
+    assert (signal.recorded_decision, signal.replayed_decision) == ('long_entry', '')
+    # a record missing on one side is a difference as well
+    order, = differences['orders'].itertuples()
+    assert order.Index == 1
+    assert order.recorded_leg == 'stop_loss' and pd.isna(order.replayed_leg)
+
+
+def test_recorded_mock_session_replays_the_same(tmp_path):
+    n = 400
+    dates = pd.date_range('2025-01-02 14:30', periods=n, freq='1min', tz='UTC')
+    close = 200 + np.cumsum(np.sin(np.arange(n) / 7.0) * 0.4 + 0.02)
+    bars = pd.DataFrame({'date': dates, 'open': close, 'high': close + 0.3, 'low': close - 0.3, 'close': close,
+                         'volume': np.full(n, 1000.0)})
+    path = str(tmp_path / 'session.journal')
+    journal.open(path)
+    ib = MockIB({'TSLA': bars}, history=300)
+    ib.connect()
+    runner = StrategyRunner(ib, [('TSLA', 'TSLA')], [('3 mins', 'ema'), ('1 min', 'vwap')], 50, 100)
+    runner.start()
+    ib.sleep(100 * 60)
+    runner.stop()
+    journal.close()
+
+    recorded, replayed = replay(path, output=str(tmp_path / 'session.replay'))
+    assert len(recorded['signals']) and len(recorded['orders'])
+    assert len(replayed['signals']) == len(recorded['signals'])
+    differences = diff(recorded, replayed)
+    assert len(differences['signals']) == 0 and len(differences['orders']) == 0
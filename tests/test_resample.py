@@ -0,0 +1,53 @@
+import pandas as pd
+from ib_insync.objects import BarData
+
+from algotradebot.resample import BarResampler, roll_up
+
+
+def minute_bars(times):
+    # 1 min bars at those UTC times, close rising by one each
+    return [BarData(date=pd.Timestamp(f'2025-01-02 {time}', tz='UTC').to_pydatetime(), open=100.0 + i,
+                    high=101.0 + i, low=99.0 + i, close=100.0 + i, volume=10.0, average=100.0 + i, barCount=1)
+            for i, time in enumerate(times)]
+
+
+def test_candle_closes_with_the_minute_ending_its_period():
+    resampler = BarResampler(3)
+    candles = [resampler.update(bar) for bar in minute_bars(['14:30', '14:31', '14:32'])]
+    assert candles[:2] == [[], []]
+    candle, = candles[2]
+    assert candle.date.minute == 30
+    assert (candle.open, candle.high, candle.low, candle.close) == (100.0, 103.0, 99.0, 102.0)
+    assert candle.volume == 30.0
+    assert candle.average == 101.0
+    assert resampler.current is None
+
+
+def test_missing_closing_minute_does_not_merge_two_periods():
+    # 14:32 never came: the 14:30 candle closes with the first bar of the next period
+    resampler = BarResampler(3)
+    bars = minute_bars(['14:30', '14:31', '14:33', '14:34', '14:35'])
+    assert resampler.update(bars[0]) == [] and resampler.update(bars[1]) == []
+    stale, = resampler.update(bars[2])
+    assert stale.date.minute == 30 and stale.close == 101.0 and stale.volume == 20.0
+    assert resampler.update(bars[3]) == []
+    candle, = resampler.update(bars[4])
+    assert candle.date.minute == 33 and candle.open == 102.0 and candle.volume == 30.0
+
+
+def test_gap_ending_on_a_period_boundary_closes_both_candles():
+    # 14:30 - 14:31, then nothing until 14:35, the last minute of its period
+    resampler = BarResampler(3)
+    bars = minute_bars(['14:30', '14:31', '14:35'])
+    assert resampler.resample(bars[:2]) == []
+    stale, candle = resampler.update(bars[2])
+    assert stale.date.minute == 30 and stale.close == 101.0
+    assert candle.date.minute == 35 and candle.volume == 10.0
+
+
+def test_roll_up_shares_the_minutes_between_timeframes():
+    bars = minute_bars([f'14:{minute}' for minute in range(30, 45)])
+    resamplers, candles = roll_up(bars, [5, 3, 5])
+    assert list(resamplers) == [3, 5]
+    assert [candle.date.minute for candle in candles[3]] == [30, 33, 36, 39, 42]
+    assert [candle.date.minute for candle in candles[5]] == [30, 35, 40]
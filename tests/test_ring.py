@@ -0,0 +1,57 @@
+import datetime
+
+import numpy as np
+import pytest
+from ib_insync.objects import BarData
+
+from algotradebot.ring import BarRing
+
+
+def minute_bars(n):
+    start = datetime.datetime(2025, 1, 2, 14, 30, tzinfo=datetime.timezone.utc)
+    return [BarData(date=start + datetime.timedelta(minutes=i), open=100.0 + i, high=101.0 + i, low=99.0 + i,
+                    close=100.5 + i, volume=10.0 * i, average=100.2 + i, barCount=i)
+            for i in range(n)]
+
+
+def test_partly_filled_ring_is_in_order():
+    ring = BarRing(5)
+    bars = minute_bars(3)
+    ring.extend(bars)
+    assert len(ring) == 3
+    assert list(ring) == bars
+    assert ring[0] == bars[0] and ring[-1] == bars[-1]
+    assert list(ring['close']) == [bar.close for bar in bars]
+
+
+@pytest.mark.parametrize('n', [5, 7, 12, 13])
+def test_wrapped_ring_keeps_the_last_capacity_bars(n):
+    ring = BarRing(5)
+    bars = minute_bars(n)
+    for bar in bars:
+        ring.append(bar)
+    assert len(ring) == 5 and ring.count == n
+    assert list(ring) == bars[-5:]
+    assert ring[-1] == bars[-1] and ring[-5] == bars[-5]
+    assert list(ring.view('close')) == [bar.close for bar in bars[-5:]]
+    assert list(ring.view('date', 2)) == [bar.date for bar in bars[-2:]]
+    with pytest.raises(IndexError):
+        ring[5]
+    with pytest.raises(IndexError):
+        ring[-6]
+
+
+def test_views_are_contiguous_and_not_copies():
+    ring = BarRing(4)
+    ring.extend(minute_bars(6))
+    close = ring.view('close')
+    assert close.base is ring.close and close.flags['C_CONTIGUOUS']
+    assert ring.view('volume', 10).shape == (4,)
+
+
+def test_extend_keeps_the_last_capacity_bars():
+    ring = BarRing(4)
+    bars = minute_bars(10)
+    ring.extend(iter(bars))
+    assert list(ring) == bars[-4:]
+    assert np.array_equal(ring['barCount'], [bar.barCount for bar in bars[-4:]])
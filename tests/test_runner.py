@@ -0,0 +1,168 @@
+import asyncio
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from algotradebot.indicators import EMA
+from algotradebot.mock import MockIB
+from algotradebot.params import ParameterStore
+from algotradebot.resample import BarResampler
+from algotradebot.runner import StrategyRunner
+from algotradebot.store import BarStore
+
+
+@pytest.fixture(autouse=True)
+def loop():
+    # ib_insync runs on the current event loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def session_bars(n=400):
+    # 1 min bars of a trending, wobbling underlying from the 9:30 open on
+    dates = pd.date_range('2025-01-02 14:30', periods=n, freq='1min', tz='UTC')
+    close = 200 + np.cumsum(np.sin(np.arange(n) / 7.0) * 0.4 + 0.02)
+    return pd.DataFrame({'date': dates, 'open': close, 'high': close + 0.3, 'low': close - 0.3,
+                         'close': close, 'volume': np.full(n, 1000.0)})
+
+
+def mock_runner(strategies, history=300, **kwargs):
+    ib = MockIB({'TSLA': session_bars()}, history=history)
+    ib.connect()
+    kwargs.setdefault('stop_loss_percent', 50)
+    kwargs.setdefault('profit_booking_percent', 100)
+    runner = StrategyRunner(ib, [('TSLA', 'TSLA')], strategies, **kwargs)
+    runner.start()
+    return ib, runner, runner.states[0]
+
+
+def test_bars_are_utc_and_compare_with_open_time():
+    ib, runner, state = mock_runner([('1 min', 'vwap')])
+    assert state.engine.formatDate == 2
+    # the open (a tz aware New York time) comes 10 bars after the history
+    runner.open_time = pd.Timestamp(ib.dates[310]).tz_convert('America/New_York')
+    (_, strategy), = state.strategies
+    evaluated = []
+    on_bar = strategy.on_bar
+    strategy.on_bar = lambda candle: (evaluated.append(candle.date), on_bar(candle))
+    ib.sleep(30 * 60)
+    runner.stop()
+    assert evaluated[0] == ib.dates[310]
+    assert len(evaluated) == 20
+
+
+class WarmUpBarsIB(MockIB):
+    # two 1 min bars close while the warm up waits on the option chain
+    async def reqSecDefOptParamsAsync(self, *args):
+        self.step()
+        self.step()
+        return self.reqSecDefOptParams(*args)
+
+
+def test_bars_closing_during_the_warm_up_are_rolled_up():
+    ib = WarmUpBarsIB({'TSLA': session_bars()}, history=300)
+    ib.connect()
+    runner = StrategyRunner(ib, [('TSLA', 'TSLA')], [('3 mins', 'vwap')], stop_loss_percent=50,
+                            profit_booking_percent=100)
+    runner.start()
+    state = runner.states[0]
+    assert state.engine.completed_bars()[-1].date == ib.dates[301]
+    candles = []
+    state.engine.candleCloseEvent += lambda minutes, candle: candles.append(candle)
+    ib.sleep(60)
+    runner.stop()
+    # the 3 min candle of bars 300 - 302 has all three of them
+    candle, = candles
+    assert candle.date == ib.dates[300]
+    assert candle.volume == 3000
+
+
+def test_live_bars_are_stored_from_the_writer_thread(tmp_path):
+    store = BarStore(str(tmp_path))
+    ib, runner, state = mock_runner([('3 mins', 'ema')], store=store)
+    assert store.count('TSLA', '1 min') == 300
+    ib.sleep(30 * 60)
+    runner.stop()
+    # every live bar is written, in order, once the session stops at the latest
+    assert store.count('TSLA', '1 min') == 330
+    assert store.last_date('TSLA', '1 min') == ib.dates[329]
+
+
+def test_max_cost_reaches_the_contract_pick():
+    ib, runner, state = mock_runner([('1 min', 'vwap')], max_cost=4.0)
+    picks = []
+    delta_contract = state.ladder.delta_contract
+
+    async def recorded(right, delta, max_cost=None, expiry_index=None):
+        contract = await delta_contract(right, delta, max_cost, expiry_index)
+        picks.append((delta, max_cost, contract))
+        return contract
+
+    state.ladder.delta_contract = recorded
+    ib.sleep(60 * 60)
+    runner.stop()
+    assert picks and all(delta is None and max_cost == 4.0 for delta, max_cost, _ in picks)
+    # the entries went out on the picked contracts
+    picked = {contract.conId for _, _, contract in picks if contract is not None}
+    entries = {trade.contract.conId for trade in ib.trades if trade.order.parentId == 0}
+    assert entries and entries <= picked
+
+
+def write_parameters(path, **values):
+    rows = {'Stop-Loss %': 50, 'Take Profit %': 100, **values}
+    pd.DataFrame({'Parameters': list(rows), 'Value': list(rows.values())}).to_csv(path, index=False)
+
+
+def test_indicator_window_change_rebuilds_the_strategies(tmp_path):
+    path = tmp_path / 'parameters.csv'
+    write_parameters(path, **{'EMA Slow': 20})
+    params = ParameterStore(str(path))
+    ib, runner, state = mock_runner([('3 mins', 'ema')], params=params)
+    (_, before), = state.strategies
+    assert before.signal.ema_slow.window == 20
+    ib.sleep(10 * 60)
+
+    write_parameters(path, **{'EMA Slow': 30})
+    os.utime(path, ns=(params.mtime + 1, params.mtime + 1))
+    assert params.reload()
+    (minutes, after), = state.strategies
+    assert after is not before and minutes == 3
+    assert after.signal.ema_slow.window == 30
+    # reseeded from the session's 1 min candles, as a warm up would be
+    reference = EMA(30)
+    reference.seed([candle.close for candle in BarResampler(3).resample(state.engine.completed_bars())])
+    assert after.signal.slow == reference.value
+
+    # the new strategy is the one trading from now on
+    evaluated = []
+    on_bar = after.on_bar
+    after.on_bar = lambda candle: (evaluated.append(candle), on_bar(candle))
+    before.on_bar = lambda candle: pytest.fail("the replaced strategy was evaluated")
+    ib.sleep(9 * 60)
+    runner.stop()
+    assert len(evaluated) == 3
+    for candle in evaluated:
+        reference.update(candle.close)
+    assert after.signal.slow == reference.value
+
+
+def test_bar_size_change_rebuilds_the_roll_up(tmp_path):
+    path = tmp_path / 'parameters.csv'
+    write_parameters(path)
+    params = ParameterStore(str(path))
+    ib, runner, state = mock_runner([('3 mins', 'vwap')], params=params)
+    write_parameters(path, **{'Bar Size': '5 mins'})
+    os.utime(path, ns=(params.mtime + 1, params.mtime + 1))
+    assert params.reload()
+    assert [minutes for minutes, _ in state.strategies] == [5]
+    assert list(state.engine.resamplers) == [5]
+    candles = []
+    state.engine.candleCloseEvent += lambda minutes, candle: candles.append((minutes, candle.date.minute % 5))
+    ib.sleep(15 * 60)
+    runner.stop()
+    assert candles and all(candle == (5, 0) for candle in candles)
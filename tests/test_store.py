@@ -0,0 +1,100 @@
+import asyncio
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from ib_insync.contract import Stock
+from ib_insync.objects import BarData
+
+from algotradebot.mock import MockIB
+from algotradebot.store import BarStore, duration_since
+
+
+@pytest.fixture(autouse=True)
+def loop():
+    # ib_insync runs on the current event loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def session(n=60):
+    dates = pd.date_range('2025-01-02 14:30', periods=n, freq='1min', tz='UTC')
+    close = 100 + np.arange(n) * 0.25
+    return pd.DataFrame({'date': dates, 'open': close, 'high': close + 0.5, 'low': close - 0.5, 'close': close,
+                         'volume': np.full(n, 10.0), 'barCount': np.arange(n)})
+
+
+def bars(frame):
+    return [BarData(date=row.date.to_pydatetime(), open=row.open, high=row.high, low=row.low, close=row.close,
+                    volume=row.volume, average=row.close, barCount=int(row.barCount))
+            for row in frame.itertuples()]
+
+
+def test_append_only_writes_bars_after_the_last_stored_one(tmp_path):
+    store = BarStore(str(tmp_path))
+    history = bars(session())
+    assert store.append('TSLA', '1 min', history[:20]) == 20
+    # overlapping download: the first 20 are there already
+    assert store.append('TSLA', '1 min', history[10:30]) == 10
+    assert store.append('TSLA', '1 min', history[:30]) == 0
+    assert store.count('TSLA', '1 min') == 30
+    assert store.last_date('TSLA', '1 min') == history[29].date
+    assert store.bars('TSLA', '1 min', 30) == history[:30]
+    assert store.bars('TSLA', '1 min', 5) == history[25:30]
+    frame = store.frame('TSLA', '1 min')
+    assert list(frame['close']) == [bar.close for bar in history[:30]]
+
+
+def test_interrupted_append_is_dropped_by_the_next_one(tmp_path):
+    store = BarStore(str(tmp_path))
+    history = bars(session())
+    store.append('TSLA', '1 min', history[:10])
+    # a crash after the close column was written, before the date column
+    with open(os.path.join(store.path('TSLA', '1 min'), 'close'), 'ab') as f:
+        f.write(np.zeros(3).tobytes())
+    assert store.count('TSLA', '1 min') == 10
+    store.append('TSLA', '1 min', history[10:15])
+    assert store.bars('TSLA', '1 min', 15) == history[:15]
+
+
+def test_empty_store(tmp_path):
+    store = BarStore(str(tmp_path / 'empty'))
+    assert store.count('TSLA', '1 min') == 0
+    assert store.last_date('TSLA', '1 min') is None
+    assert store.bars('TSLA', '1 min', 10) == []
+
+
+def test_update_downloads_only_the_missing_completed_bars(tmp_path):
+    store = BarStore(str(tmp_path))
+    ib = MockIB({'TSLA': session()}, history=30)
+    ib.connect()
+    stock = Stock('TSLA', 'SMART', 'USD')
+    # the whole duration at first, without the candle still forming
+    assert store.update(ib, stock, '1 min', '1 D') == 30
+    assert store.last_date('TSLA', '1 min') == ib.dates[29]
+    for _ in range(5):
+        ib.step()
+    requests = []
+    reqHistoricalData = ib.reqHistoricalData
+
+    def recorded(*args, **kwargs):
+        requests.append(kwargs['durationStr'])
+        return reqHistoricalData(*args, **kwargs)
+
+    ib.reqHistoricalData = recorded
+    assert store.update(ib, stock, '1 min', '1 D') == 5
+    # only the time since the last stored bar is asked for
+    assert requests == [duration_since(ib.dates[29], ib.reqCurrentTime())]
+    assert store.count('TSLA', '1 min') == 35
+    assert [bar.date for bar in store.bars('TSLA', '1 min', 35)] == ib.dates[:35]
+
+
+def test_duration_since():
+    now = datetime.datetime(2025, 1, 2, 15, 0, tzinfo=datetime.timezone.utc)
+    assert duration_since(now - datetime.timedelta(minutes=5), now) == '360 S'
+    assert duration_since(now - datetime.timedelta(days=2, hours=1), now) == '3 D'
@@ -0,0 +1,63 @@
+import asyncio
+
+from ib_insync.contract import Stock
+
+from algotradebot import journal as events
+from algotradebot.orders import CLOSED, EXITING, OPEN, Bracket
+from algotradebot.strategy import Strategy
+
+
+class FixedSignal:
+    # every rule answers what it was given
+    def __init__(self, **rules):
+        self.rules = rules
+
+    def __getattr__(self, rule):
+        return lambda: self.rules.get(rule, False)
+
+    def values(self):
+        return {}
+
+
+class Tracker:
+    def __init__(self):
+        self.flattened = []
+
+    def flatten(self, bracket):
+        bracket.state = EXITING
+        self.flattened.append(bracket)
+
+
+def strategy(signal, position=None):
+    strategy = Strategy(None, Stock('TSLA', 'SMART', 'USD'), signal, '3 mins', 50, 100, tracker=Tracker())
+    strategy.position = position
+    return strategy
+
+
+def bracket(side, state):
+    bracket = Bracket(side, None, 'BUY', [])
+    bracket.state = state
+    return bracket
+
+
+def test_no_exit_on_the_previous_bracket_while_an_entry_is_in_flight():
+    async def run():
+        # the LONG entry is on its way, the SHORT bracket before it is on the way out
+        s = strategy(FixedSignal(short_exit=True, long_exit=True), bracket('SHORT', EXITING))
+        s.entry = asyncio.get_running_loop().create_future()
+        assert s.decision() == events.NONE
+        s.evaluate()
+        assert s.tracker.flattened == []
+        s.position = bracket('LONG', CLOSED)
+        s.evaluate()
+        assert s.tracker.flattened == []
+
+    asyncio.run(run())
+
+
+def test_exit_only_for_the_bracket_held():
+    s = strategy(FixedSignal(long_exit=True, short_entry=True), bracket('LONG', OPEN))
+    s.evaluate()
+    assert s.tracker.flattened == [s.position]
+    # flattening the long does not start the short in the same evaluation
+    assert s.entry is None